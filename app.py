@@ -1,26 +1,272 @@
-"""Este é um fork do projeto nfe_utils (https://github.com/edsonbernar/nfe_utils), 
+"""Este é um fork do projeto nfe_utils (https://github.com/edsonbernar/nfe_utils),
 originalmente criado por Edson Bernardino (https://github.com/edsonbernar)."""
 
+import argparse
 import os
-from pdf_docs import Danfe
+import time
+from multiprocessing import Pool
+from conversao import (LIMITE_FLUXO, caminho_pdf, converter, iniciar_worker,
+                       ler_paths_xml, rotear)
 from tqdm import tqdm
 import warnings
 
-def printpdf(fullpath, filename, destfolder):
-    xmls = [open(fullpath, "r", encoding="utf8").read()]
-    pdf = Danfe(xmls=xmls, image=None, cfg_layout='ICMS_IPI', receipt_pos='top')
-    pdf.output(f"{destfolder}{str(filename).replace('.xml','.pdf')}")
+def converter_lote(tarefas, workers=1, total=None, ao_concluir=None,
+                   saida=None):
+    # Processa as tarefas em paralelo e devolve os resultados por arquivo.
+    # `saida` (ver saidas.py) troca a gravação de um PDF por XML por outro
+    # destino
+    resultados = []
+    progresso = tqdm(total=total, desc="Imprimindo XML to PDF", unit="file")
+    funcao = converter
+    if saida is not None:
+        funcao = saida.funcao
+        tarefas = saida.preparar(tarefas)
 
-def ler_paths_xml(pasta):
-    arquivos = os.listdir(pasta)
-    arquivos_xml = [arquivo for arquivo in arquivos if arquivo.endswith(".xml")]
-    return arquivos_xml
+    def concluir(item):
+        for resultado in (saida.receber(item) if saida else [item]):
+            resultados.append(resultado)
+            if ao_concluir is not None:
+                ao_concluir(resultado)
+            progresso.update()
+
+    if workers > 1:
+        # Lotes maiores reduzem a troca de mensagens entre processos
+        chunksize = getattr(saida, "chunksize", None) or (
+            max(1, min(32, total // (workers * 8))) if total else 8)
+        with Pool(workers, initializer=iniciar_worker) as pool:
+            for item in pool.imap_unordered(funcao, tarefas, chunksize):
+                concluir(item)
+    else:
+        for tarefa in tarefas:
+            concluir(funcao(tarefa))
+    if saida is not None:
+        # Resultados retidos pela saída até o arquivo final ser gravado
+        for resultado in saida.finalizar():
+            resultados.append(resultado)
+            if ao_concluir is not None:
+                ao_concluir(resultado)
+            progresso.update()
+    progresso.close()
+    return resultados
+
+def resumo(resultados, decorrido, pulados=0, ignorados=0):
+    ok = [r for r in resultados if r.ok]
+    falhas = [r for r in resultados if not r.ok]
+    paginas = sum(r.paginas for r in ok)
+    tempos = sorted(r.tempo for r in ok)
+    print(f"Convertidos: {len(ok)}  Falhas: {len(falhas)}  "
+          f"Pulados: {pulados}  Ignorados: {ignorados}  Páginas: {paginas}  "
+          f"Tempo: {decorrido:.1f}s  "
+          f"({len(resultados) / decorrido if decorrido else 0:.1f} arquivos/s)")
+    if tempos:
+        print(f"Tempo por arquivo: médio {sum(tempos) / len(tempos):.3f}s  "
+              f"máximo {tempos[-1]:.3f}s")
+    for r in falhas:
+        print(f"  FALHA {r.origem}: {r.erro}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Conversor de XML NF-e para PDF")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="número de processos em paralelo "
+                             "(0 = todos os núcleos)")
+    parser.add_argument("--origem", default="XML/", help="pasta dos XMLs")
+    parser.add_argument("--destino", default="PDF/", help="pasta dos PDFs")
+    parser.add_argument("--incluir", action="append", default=None,
+                        metavar="GLOB", help="arquivos a converter "
+                        "(padrão: *.xml; com '/' compara o caminho relativo)")
+    parser.add_argument("--excluir", action="append", default=[],
+                        metavar="GLOB", help="arquivos ou subpastas a ignorar")
+    parser.add_argument("-z", "--compactados", action="store_true",
+                        help="converte também os XMLs dentro de pacotes "
+                             ".zip/.tar(.gz) encontrados na origem")
+    parser.add_argument("--layout", default="ICMS_IPI",
+                        choices=["ICMS", "ICMS_ST", "ICMS_IPI"],
+                        help="colunas dos produtos no modo retrato")
+    parser.add_argument("--recibo", default="top", choices=["top", "bottom"],
+                        help="posição do canhoto")
+    parser.add_argument("--logo", default=None, help="imagem do logotipo")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="pula XMLs já convertidos com a mesma "
+                             "configuração")
+    parser.add_argument("--manifesto", default=None,
+                        help="arquivo do manifesto incremental "
+                             "(padrão: <destino>/.manifesto.db)")
+    parser.add_argument("--saida", default="pasta",
+                        choices=["pasta", "zip", "spool"],
+                        help="pasta: um PDF por XML; zip: todos os PDFs num "
+                             ".zip; spool: várias notas por PDF com índice")
+    parser.add_argument("--lote", type=int, default=500,
+                        help="notas por arquivo nos modos --saida zip/spool")
+    parser.add_argument("-r", "--retomar", action="store_true",
+                        help="continua uma execução interrompida, pulando "
+                             "os XMLs registrados no diário")
+    parser.add_argument("--diario", default=None,
+                        help="diário da execução "
+                             "(padrão: <destino>/.diario.log)")
+    parser.add_argument("--cache", default=None, metavar="PASTA",
+                        help="guarda as NF-e lidas e paginadas em PASTA "
+                             "para acelerar reimpressões")
+    parser.add_argument("--cache-limite", type=int, default=256,
+                        metavar="MB", help="tamanho máximo do cache")
+    parser.add_argument("--fluxo", type=int, nargs="?", default=None,
+                        const=LIMITE_FLUXO >> 20, metavar="MB",
+                        help="lê em fluxo os XMLs a partir de MB megabytes "
+                             f"(padrão {LIMITE_FLUXO >> 20}): usa bem menos "
+                             "memória em notas com muitos itens, mas "
+                             "renderiza cerca de 50%% mais devagar; "
+                             "desligado sem a opção")
+    parser.add_argument("-m", "--monitorar", action="store_true",
+                        help="fica em execução convertendo os XMLs que "
+                             "chegarem na pasta de origem")
+    parser.add_argument("--polling", action="store_true",
+                        help="no modo monitorar, varre a pasta em vez de "
+                             "usar inotify (ex.: pastas de rede)")
+    args = parser.parse_args()
+    if args.incremental and args.saida != "pasta":
+        parser.error("--incremental só é suportado com --saida pasta")
+    if args.fluxo is not None and args.saida != "pasta":
+        parser.error("--fluxo só é suportado com --saida pasta")
+
     warnings.simplefilter("ignore")
-    pastaXML = "XML/"
-    paths_xml = ler_paths_xml(pastaXML)
-    PastaPDF = "PDF/"
+    pastaXML = os.path.join(args.origem, "")
+    PastaPDF = os.path.join(args.destino, "")
+    workers = args.workers or os.cpu_count()
+    opcoes = dict(image=args.logo, cfg_layout=args.layout,
+                  receipt_pos=args.recibo)
+    if args.fluxo is not None:
+        opcoes["limite_fluxo"] = args.fluxo << 20
+    if args.cache:
+        from cache import abrir
+        opcoes["cache"] = abrir(args.cache, args.cache_limite << 20)
+
+    # PDFs e pacotes pela metade de uma execução interrompida
+    from diario import limpar_temporarios
+    limpar_temporarios(PastaPDF)
+
+    manifesto = None
+    if args.incremental:
+        os.makedirs(PastaPDF, exist_ok=True)
+        from manifesto import Manifesto, chave_config
+        manifesto = Manifesto(
+            args.manifesto or os.path.join(PastaPDF, ".manifesto.db"),
+            chave_config(args.layout, args.recibo, args.logo))
+
+    if args.monitorar:
+        from monitor import monitorar
+        monitorar(pastaXML, PastaPDF, opcoes, workers=workers,
+                  polling=args.polling, manifesto=manifesto)
+        raise SystemExit(0)
+
+    # A conversão começa enquanto a varredura ainda está em andamento
+    incluir = args.incluir or ["*.xml"]
+    if args.compactados:
+        from fontes import EXTENSOES, compactado, membros_xml, nome_pacote
+        paths_xml = ler_paths_xml(pastaXML, excluir=args.excluir, incluir=(
+            incluir + [f"*{ext}" for ext in EXTENSOES]))
+    else:
+        paths_xml = ler_paths_xml(pastaXML, incluir=incluir,
+                                  excluir=args.excluir)
+
+    def gerar_tarefas(paths_xml):
+        for path_xml in paths_xml:
+            fullpath = f"{pastaXML}{path_xml}"
+            if args.compactados and compactado(path_xml):
+                # PDFs em <destino>/<subpasta>/<pacote>/<membro>.pdf
+                pasta_pacote = os.path.join(os.path.dirname(path_xml),
+                                            nome_pacote(path_xml))
+                try:
+                    for membro, conteudo in membros_xml(fullpath, incluir):
+                        yield (f"{fullpath}::{membro}",
+                               f"{pasta_pacote}/{membro}", PastaPDF, opcoes,
+                               conteudo)
+                except Exception as e:
+                    tqdm.write(f"Pacote ignorado {fullpath}: {e!r}")
+            else:
+                yield fullpath, path_xml, PastaPDF, opcoes, None
+    tarefas = gerar_tarefas(paths_xml)
+
+    from diario import Diario
+    os.makedirs(PastaPDF, exist_ok=True)
+    diario = Diario(args.diario or os.path.join(PastaPDF, ".diario.log"),
+                    retomar=args.retomar)
+
+    pulados = [0]
+    ignorados = [0]
+    # Respostas da distribuição ilegíveis, roteadas na thread do Pool
+    falhas = []
+
+    # Origens a registrar no manifesto ao concluir: XMLs soltos e os
+    # documentos de suas respostas da distribuição
+    manifestaveis = set()
+
+    def pendentes(tarefas):
+        for t in tarefas:
+            # Membros de pacotes não têm stat próprio e não entram no
+            # manifesto. Com workers este filtro roda na thread do Pool que
+            # distribui as tarefas: manifesto.atual() não grava nada
+            if diario.concluido(t[0]) or (
+                    manifesto is not None and t[4] is None and
+                    manifesto.atual(t[0], caminho_pdf(t[1], t[2]))):
+                pulados[0] += 1
+            else:
+                yield t
+    tarefas = pendentes(tarefas)
+
+    # O spool junta várias DANFEs por PDF: cartas de correção ficam de fora
+    rotas = ("danfe", "distribuicao")
+    if args.saida != "spool":
+        rotas += ("dacce",)
+
+    def ignorar(origem):
+        # Documento não suportado ou fora das rotas, inclusive dentro de
+        # uma resposta da distribuição (ex.: CC-e no spool)
+        ignorados[0] += 1
+
+    def roteadas(tarefas):
+        for t in tarefas:
+            manifestar = manifesto is not None and t[4] is None
+            for roteada in rotear(t, rotas, falhas.append, ignorar):
+                # Documentos de uma resposta da distribuição entram no
+                # diário e no manifesto um a um
+                if diario.concluido(roteada[0]) or (
+                        manifestar and roteada[0] != t[0] and
+                        manifesto.atual(roteada[0], caminho_pdf(
+                            roteada[1], roteada[2]))):
+                    pulados[0] += 1
+                    continue
+                if manifestar:
+                    manifestaveis.add(roteada[0])
+                yield roteada
+    tarefas = roteadas(tarefas)
+
+    def ao_concluir(resultado):
+        if not resultado.ok:
+            return
+        diario.registrar(resultado.origem)
+        if resultado.origem in manifestaveis:
+            manifestaveis.discard(resultado.origem)
+            manifesto.registrar(resultado.origem, resultado.destino)
+
+    saida = None
+    if args.saida != "pasta":
+        from saidas import SaidaSpool, SaidaZip
+        carimbo = time.strftime("%Y%m%d-%H%M%S")
+        if args.saida == "zip":
+            saida = SaidaZip(os.path.join(PastaPDF, f"danfes-{carimbo}"),
+                             docs_por_arquivo=args.lote)
+        else:
+            saida = SaidaSpool(os.path.join(PastaPDF, f"spool-{carimbo}"),
+                               docs_por_lote=args.lote)
 
-    for path_xml in tqdm(paths_xml, desc="Imprimindo XML to PDF", unit="file"):
-        printpdf(f"{pastaXML}{path_xml}", path_xml, PastaPDF)
\ No newline at end of file
+    inicio = time.perf_counter()
+    try:
+        resultados = converter_lote(tarefas, workers=workers,
+                                    ao_concluir=ao_concluir, saida=saida)
+    finally:
+        if saida is not None:
+            saida.fechar()
+        diario.fechar()
+        if manifesto is not None:
+            manifesto.fechar()
+    resumo(resultados + falhas, time.perf_counter() - inicio, pulados[0],
+           ignorados[0])
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Benchmark da geração de DANFE/DACCe
+
+    As NF-e são sintéticas, montadas a partir da estrutura de
+    XML/Exemplo.xml: de 1 a 5.000 itens, descrições longas (xProd e
+    infAdProd), impressão retrato e paisagem (tpImp) e todos os
+    cfg_layout. Também são geradas cartas de correção para a DaCCe.
+
+    Cada cenário roda num processo próprio, para que o pico de memória
+    (RSS) seja só dele. São medidos docs/s, páginas/s, latência p50/p99
+    por documento (renderização + output) e o pico de RSS. O resultado é
+    gravado em JSON e pode ser comparado com uma execução anterior:
+
+        python benchmark.py --saida atual.json --comparar anterior.json
+        python benchmark.py --rapido --cenarios 'retrato'
+        python benchmark.py --perfil     # tempo médio por etapa da Danfe
+        python benchmark.py --xml etree  # força o backend XML da stdlib
+        python benchmark.py --cache /tmp/c   # reimpressões (cache.py)
+        python benchmark.py --gerar XML/sintetico   # só grava o corpus
+        python benchmark.py --paginacao 50000  # só o paginador, sem FPDF
+        python benchmark.py --code128 20000    # só o código de barras
+"""
+
+import argparse
+import copy
+import json
+import os
+import platform
+import re
+import resource
+import time
+import warnings
+import xml.etree.ElementTree as ET
+from multiprocessing import Pool
+
+import fpdf
+
+import nfe
+import paginacao
+import xfpdf
+from cache import CacheNFe
+import pdf_docs
+from pdf_docs import DaCCe, Danfe
+from xfpdf import xFPDF
+
+URL = 'http://www.portalfiscal.inf.br/nfe'
+NS = '{%s}' % URL
+ET.register_namespace('', URL)
+
+MODELO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'XML',
+                      'Exemplo.xml')
+
+LAYOUTS = ('ICMS', 'ICMS_ST', 'ICMS_IPI')
+
+PALAVRAS = ('PAPEL', 'MAXPLOT', 'BOBINA', 'SULFITE', 'ROLO', 'TINTA',
+            'CARTUCHO', 'PRETO', 'AZUL', 'COUCHE', 'FOSCO', 'BRILHO',
+            '170MX250M', '90G/M2', '3"', 'PLOTTER', 'A1', 'A0', 'ESPECIAL')
+
+EMITENTE = {'nome': 'Plotag Sistemas e Suprimentos Ltda',
+            'end': 'Rua Solon, 558', 'bairro': 'Bom Retiro',
+            'cidade': 'Sao Paulo', 'uf': 'SP', 'fone': '1123587604'}
+
+
+def texto(n, palavras):
+    # Texto determinístico com `palavras` palavras, variando com n
+    return ' '.join(PALAVRAS[(n * 7 + i * 3) % len(PALAVRAS)]
+                    for i in range(palavras))
+
+
+def gerar_nfe(itens, tpImp='1', descricao_longa=False, numero=1):
+    """XML de NF-e com `itens` itens, a partir do XML de exemplo"""
+    root = ET.parse(MODELO).getroot()
+    inf_nfe = root.find('.//%sinfNFe' % NS)
+    dets = inf_nfe.findall('%sdet' % NS)
+    modelo = dets[0]
+    posicao = list(inf_nfe).index(modelo)
+    for det in dets:
+        inf_nfe.remove(det)
+
+    inf_nfe.find('.//%stpImp' % NS).text = tpImp
+    inf_nfe.find('.//%snNF' % NS).text = str(numero)
+
+    for n in range(itens):
+        det = copy.deepcopy(modelo)
+        det.set('nItem', str(n + 1))
+        prod = det.find('%sprod' % NS)
+        prod.find('%scProd' % NS).text = 'B%08d' % n
+        qtd = 1 + n % 97
+        unit = 10 + (n * 37) % 990 + 0.5
+        prod.find('%sqCom' % NS).text = '%.4f' % qtd
+        prod.find('%sqTrib' % NS).text = '%.4f' % qtd
+        prod.find('%svUnCom' % NS).text = '%.4f' % unit
+        prod.find('%svUnTrib' % NS).text = '%.4f' % unit
+        prod.find('%svProd' % NS).text = '%.2f' % (qtd * unit)
+        if descricao_longa:
+            # Um terço dos itens com descrição longa e informação adicional
+            prod.find('%sxProd' % NS).text = texto(n, 4 + n % 3 * 12)
+            if n % 3 == 0:
+                adic = ET.SubElement(det, '%sinfAdProd' % NS)
+                adic.text = 'LOTE %d VALIDADE 12/2030 %s' % (
+                    n, texto(n, 10 + n % 5 * 10))
+        else:
+            prod.find('%sxProd' % NS).text = texto(n, 4)
+        inf_nfe.insert(posicao + n, det)
+
+    return ET.tostring(root, encoding='unicode')
+
+
+def gerar_cce(numero=1, tamanho=200):
+    """XML de evento de carta de correção (procEventoNFe)"""
+    chave = '3515030082260200012455001%09d1099234656' % numero
+    correcao = 'Corrige o endereco do destinatario. ' + texto(numero, tamanho)
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<procEventoNFe versao="1.00" xmlns="%(url)s">'
+        '<evento versao="1.00"><infEvento Id="ID110110%(chave)s01">'
+        '<cOrgao>35</cOrgao><tpAmb>2</tpAmb><CNPJ>00822602000124</CNPJ>'
+        '<chNFe>%(chave)s</chNFe>'
+        '<dhEvento>2015-03-28T10:00:00-03:00</dhEvento>'
+        '<tpEvento>110110</tpEvento><nSeqEvento>1</nSeqEvento>'
+        '<verEvento>1.00</verEvento><detEvento versao="1.00">'
+        '<descEvento>Carta de Correcao</descEvento>'
+        '<xCorrecao>%(correcao)s</xCorrecao>'
+        '<xCondUso>A Carta de Correcao e disciplinada pelo paragrafo 1o-A '
+        'do art. 7o do Convenio S/N, de 15 de dezembro de 1970 e pode ser '
+        'utilizada para regularizacao de erro ocorrido na emissao de '
+        'documento fiscal.</xCondUso></detEvento></infEvento></evento>'
+        '<retEvento versao="1.00"><infEvento><tpAmb>2</tpAmb>'
+        '<verAplic>SP_EVENTOS_PL_100</verAplic><cOrgao>35</cOrgao>'
+        '<cStat>135</cStat><xMotivo>Evento registrado</xMotivo>'
+        '<chNFe>%(chave)s</chNFe><tpEvento>110110</tpEvento>'
+        '<nSeqEvento>1</nSeqEvento><CNPJDest>99999999000191</CNPJDest>'
+        '<dhRegEvento>2015-03-28T10:00:05-03:00</dhRegEvento>'
+        '<nProt>135150000000001</nProt></infEvento></retEvento>'
+        '</procEventoNFe>' % dict(url=URL, chave=chave, correcao=correcao))
+
+
+def cenarios(rapido=False):
+    """Lista de (nome, tipo, parâmetros do gerador, opções, repetições)"""
+    lista = []
+    tamanhos = (1, 50, 500) if rapido else (1, 5, 50, 500)
+    for tpImp, orientacao in (('1', 'retrato'), ('2', 'paisagem')):
+        # O layout só muda as colunas de produtos no retrato
+        layouts = LAYOUTS if tpImp == '1' else ('ICMS_IPI',)
+        for layout in layouts:
+            for itens in tamanhos:
+                for longa in (False, True):
+                    if longa and itens == 1:
+                        continue
+                    nome = '%s-%s-%d%s' % (orientacao, layout, itens,
+                                           '-longa' if longa else '')
+                    lista.append((nome, 'danfe',
+                                  dict(itens=itens, tpImp=tpImp,
+                                       descricao_longa=longa),
+                                  dict(cfg_layout=layout),
+                                  max(3, min(50, 1000 // itens))))
+    itens = 1000 if rapido else 5000
+    for tpImp, orientacao in (('1', 'retrato'), ('2', 'paisagem')):
+        lista.append(('%s-ICMS_IPI-%d-longa' % (orientacao, itens), 'danfe',
+                      dict(itens=itens, tpImp=tpImp, descricao_longa=True),
+                      dict(cfg_layout='ICMS_IPI'), 3))
+    lista.append(('recibo-rodape-50', 'danfe',
+                  dict(itens=50, tpImp='1', descricao_longa=False),
+                  dict(receipt_pos='bottom'), 20))
+    lista.append(('cce', 'dacce', dict(tamanho=20), dict(emitente=EMITENTE),
+                  50))
+    lista.append(('cce-longa', 'dacce', dict(tamanho=300),
+                  dict(emitente=EMITENTE), 50))
+    return lista
+
+
+def gerar(tipo, parametros, numero=1):
+    if tipo == 'dacce':
+        return gerar_cce(numero=numero, **parametros)
+    return gerar_nfe(numero=numero, **parametros)
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1,
+                 max(0, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[indice]
+
+
+def medir(cenario, perfil=False, backend=None, cache=None):
+    # Executado num processo novo por cenário
+    warnings.simplefilter('ignore')
+    nfe.usar_backend(backend)
+    nome, tipo, parametros, opcoes, repeticoes = cenario
+    classe = DaCCe if tipo == 'dacce' else Danfe
+    xml = gerar(tipo, parametros)
+    if perfil and tipo == 'danfe':
+        opcoes = dict(opcoes, perfil=True)
+    if cache and tipo == 'danfe':
+        # O aquecimento grava a entrada; as repetições são reimpressões
+        opcoes = dict(opcoes, cache=CacheNFe(cache))
+    etapas = {}
+
+    # Aquecimento: imports tardios, fontes e caches do fpdf
+    bytes(classe(xmls=[xml], **opcoes).output())
+
+    tempos = []
+    paginas = 0
+    tamanho = 0
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        t = time.perf_counter()
+        pdf = classe(xmls=[xml], **opcoes)
+        dados = pdf.output()
+        tempos.append(time.perf_counter() - t)
+        paginas += pdf.pages_count
+        tamanho = len(dados)
+        for registro in getattr(pdf, 'perfis', ()):
+            for etapa, tempo in registro['etapas'].items():
+                etapas[etapa] = etapas.get(etapa, 0.0) + tempo
+    total = time.perf_counter() - inicio
+
+    resultado = {'cenario': nome, 'docs': repeticoes, 'paginas': paginas,
+            'bytes_pdf': tamanho, 'tempo': round(total, 4),
+            'docs_s': round(repeticoes / total, 2),
+            'paginas_s': round(paginas / total, 2),
+            'p50_ms': round(percentil(tempos, 50) * 1000, 2),
+            'p99_ms': round(percentil(tempos, 99) * 1000, 2),
+            # ru_maxrss é dado em KiB no Linux
+            'rss_pico_mb': round(resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    if etapas:
+        # Média por documento; codigo_barras está contido em emit_p/emit_l
+        resultado['etapas_ms'] = {k: round(v / repeticoes * 1000, 2)
+                                  for k, v in etapas.items()}
+        # Quebra de linhas das descrições (xFPDF.split_lines)
+        resultado['cache_linhas'] = {'acertos': xFPDF.line_cache.hits,
+                                     'falhas': xFPDF.line_cache.misses}
+    return resultado
+
+
+def executar(lista, repeticoes=None, perfil=False, backend=None,
+             cache=None):
+    resultados = []
+    for nome, tipo, parametros, opcoes, n in lista:
+        cenario = (nome, tipo, parametros, opcoes, repeticoes or n)
+        with Pool(1) as pool:
+            r = pool.apply(medir, (cenario, perfil, backend, cache))
+        print('%-32s %6.1f docs/s %8.1f pág/s  p50 %8.1f ms  p99 %8.1f ms'
+              '  RSS %6.1f MB' % (r['cenario'], r['docs_s'], r['paginas_s'],
+                                  r['p50_ms'], r['p99_ms'], r['rss_pico_mb']),
+              flush=True)
+        if 'cache_linhas' in r:
+            print('    cache de linhas: %(acertos)d acertos, %(falhas)d falhas'
+                  % r['cache_linhas'])
+        if 'etapas_ms' in r:
+            print('    ' + '  '.join('%s %.1f' % item for item in sorted(
+                r['etapas_ms'].items(), key=lambda item: -item[1])))
+        resultados.append(r)
+    return resultados
+
+
+def comparar(atual, anterior):
+    antes = {r['cenario']: r for r in anterior['resultados']}
+    print('\n%-32s %10s %10s %8s' % ('cenário', 'p50 antes', 'p50 agora',
+                                     'ganho'))
+    for r in atual['resultados']:
+        a = antes.get(r['cenario'])
+        if a is None:
+            continue
+        print('%-32s %8.1fms %8.1fms %7.2fx' % (
+            r['cenario'], a['p50_ms'], r['p50_ms'],
+            a['p50_ms'] / r['p50_ms'] if r['p50_ms'] else 0))
+
+
+def medir_paginacao(itens, repeticoes=5):
+    # Paginador isolado: linhas por item variando de 1 a 6, sem FPDF
+    linhas = [1 + (n * 7) % 6 for n in range(itens)]
+    for nome, funcao in (('paginar', paginacao.paginar),
+                         ('contar_paginas', paginacao.contar_paginas)):
+        tempos = []
+        for _ in range(repeticoes):
+            t = time.perf_counter()
+            resultado = funcao(linhas, *pdf_docs.LINHAS_RETRATO)
+            tempos.append(time.perf_counter() - t)
+        paginas = resultado if isinstance(resultado, int) else len(resultado)
+        print('%-16s %7d itens %6d páginas %8.2f ms' % (
+            nome, itens, paginas, min(tempos) * 1000))
+
+
+def medir_code128(barras, repeticoes=5):
+    # Código de barras da chave de acesso isolado, numa página em branco:
+    # chaves sempre novas (sem cache) e a mesma chave (reimpressões)
+    pdf = xFPDF()
+    pdf.add_page()
+    chaves = ['%044d' % (35240112345678000190550010000000011 + n)
+              for n in range(barras)]
+    for nome, lista in (('sem cache', chaves), ('mesma chave', chaves[:1])):
+        tempos = []
+        for _ in range(repeticoes):
+            xfpdf.code128_bars.cache_clear()
+            xfpdf.code128_cached_path.cache_clear()
+            conteudo = pdf.pages[pdf.page].contents
+            del conteudo[:]
+            t = time.perf_counter()
+            for n in range(barras):
+                pdf.code128(lista[n % len(lista)], 125, 35, height=9,
+                            thickness=0.265)
+            tempos.append(time.perf_counter() - t)
+        print('code128 %-12s %7d barras %8.2f us/barra %6d bytes/barra' % (
+            nome, barras, min(tempos) / barras * 1e6, len(conteudo) // barras))
+
+
+def gravar_corpus(pasta, lista):
+    os.makedirs(pasta, exist_ok=True)
+    for n, (nome, tipo, parametros, opcoes, _) in enumerate(lista, 1):
+        with open(os.path.join(pasta, '%s.xml' % nome), 'w',
+                  encoding='utf8') as f:
+            f.write(gerar(tipo, parametros, numero=n))
+    print('%d XMLs gravados em %s' % (len(lista), pasta))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark da geração de DANFE/DACCe")
+    parser.add_argument("--rapido", action="store_true",
+                        help="menos cenários e no máximo 1.000 itens")
+    parser.add_argument("--cenarios", default=None,
+                        help="expressão regular filtrando os cenários")
+    parser.add_argument("-n", "--repeticoes", type=int, default=None,
+                        help="documentos por cenário (padrão: conforme o "
+                             "tamanho da nota)")
+    parser.add_argument("--saida", default="benchmark.json",
+                        help="arquivo JSON com os resultados")
+    parser.add_argument("--comparar", default=None,
+                        help="JSON de uma execução anterior")
+    parser.add_argument("--perfil", action="store_true",
+                        help="registra o tempo médio (ms) de cada etapa "
+                             "da Danfe")
+    parser.add_argument("--xml", choices=("lxml", "etree"), default=None,
+                        help="backend de leitura do XML (padrão: o da "
+                             "variável NFE_XML ou lxml, se instalado)")
+    parser.add_argument("--cache", default=None, metavar="PASTA",
+                        help="usa o cache de NF-e lidas em PASTA (mede "
+                             "reimpressões)")
+    parser.add_argument("--listar", action="store_true",
+                        help="apenas lista os cenários")
+    parser.add_argument("--gerar", default=None, metavar="PASTA",
+                        help="grava o corpus sintético em PASTA e sai")
+    parser.add_argument("--paginacao", type=int, default=None,
+                        metavar="ITENS",
+                        help="mede só o paginador com ITENS itens e sai")
+    parser.add_argument("--code128", type=int, default=None,
+                        metavar="BARRAS",
+                        help="mede só o código de barras, desenhado BARRAS "
+                             "vezes, e sai")
+    args = parser.parse_args()
+
+    lista = cenarios(args.rapido)
+    if args.cenarios:
+        filtro = re.compile(args.cenarios)
+        lista = [c for c in lista if filtro.search(c[0])]
+
+    if args.listar:
+        for c in lista:
+            print(c[0])
+        raise SystemExit(0)
+    if args.gerar:
+        gravar_corpus(args.gerar, lista)
+        raise SystemExit(0)
+    if args.paginacao:
+        medir_paginacao(args.paginacao)
+        raise SystemExit(0)
+    if args.code128:
+        medir_code128(args.code128)
+        raise SystemExit(0)
+
+    # Resolvido uma vez: os cenários e o relatório usam o mesmo backend
+    backend = nfe.usar_backend(args.xml or os.environ.get('NFE_XML') or
+                               None).nome
+    inicio = time.time()
+    resultados = executar(lista, args.repeticoes, args.perfil, backend,
+                          args.cache)
+    relatorio = {'data': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'python': platform.python_version(),
+                 'fpdf2': fpdf.FPDF_VERSION,
+                 'xml': backend,
+                 'plataforma': platform.platform(),
+                 'cpu': platform.processor() or platform.machine(),
+                 'duracao': round(time.time() - inicio, 1),
+                 'resultados': resultados}
+    with open(args.saida, 'w', encoding='utf8') as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=1)
+    print('Resultados gravados em %s' % args.saida)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf8') as f:
+            comparar(relatorio, json.load(f))
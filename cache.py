@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Cache em disco das NF-e já lidas
+
+    Guarda, por NF-e, o modelo lido (nfe.NFe) e as paginações já calculadas
+    (linhas da descrição de cada item e intervalos de cada página), para
+    que uma reimpressão não passe pelo parse nem pelo
+    multi_cell(split_only=True). Cada entrada é um arquivo pickle nomeado
+    pela chave de acesso e pelo hash do XML, de modo que um XML alterado
+    nunca reaproveita a entrada antiga.
+
+    O total em disco é limitado: ao passar do limite, as entradas usadas
+    há mais tempo (mtime, renovado a cada acerto) são removidas. Vários
+    processos podem usar a mesma pasta. O conteúdo é desserializado com
+    pickle: a pasta deve ser tão confiável quanto o próprio código.
+"""
+
+import hashlib
+import os
+import pickle
+import re
+
+from diario import temporario
+
+# Muda quando o modelo (nfe.py) ou a paginação mudam: invalida o cache
+VERSAO = 2
+
+CHAVE_ID = re.compile(rb'Id="NFe(\d{44})"')
+CHAVE_ID_TEXTO = re.compile(r'Id="NFe(\d{44})"')
+# A chave está no início da nota (atributo do infNFe)
+INICIO = 64 << 10
+
+
+class Registro:
+    __slots__ = ('arquivo', 'nfe', 'paginas', 'alterado')
+
+    def __init__(self, arquivo):
+        self.arquivo = arquivo
+        self.nfe = None
+        # {(largura da coluna, linhas da 1ª página, linhas das demais):
+        #  (paginator, linhas da descrição de cada item)}
+        self.paginas = {}
+        self.alterado = False
+
+
+class CacheNFe:
+    def __init__(self, pasta, limite=256 << 20):
+        self.pasta = pasta
+        self.limite = limite
+        self.acertos = 0
+        self.falhas = 0
+        os.makedirs(pasta, exist_ok=True)
+        self.ocupado = sum(tamanho for _, tamanho, _ in self.entradas())
+
+    def __reduce__(self):
+        # Os workers recebem só a pasta e reaproveitam a instância local
+        return abrir, (self.pasta, self.limite)
+
+    def nome(self, dados):
+        if isinstance(dados, str):
+            achado = CHAVE_ID_TEXTO.search(dados, 0, INICIO)
+            dados = dados.encode('utf-8')
+        else:
+            achado = CHAVE_ID.search(dados, 0, INICIO)
+        chave = achado.group(1) if achado else 'NFe'
+        if isinstance(chave, bytes):
+            chave = chave.decode('ascii')
+        hash_ = hashlib.blake2b(dados, digest_size=16).hexdigest()
+        return f"{chave}-{hash_}-{VERSAO}.pkl"
+
+    def obter(self, dados):
+        """Registro do XML `dados`; nfe é None quando não está no cache"""
+        registro = Registro(os.path.join(self.pasta, self.nome(dados)))
+        try:
+            with open(registro.arquivo, 'rb') as f:
+                registro.nfe, registro.paginas = pickle.load(f)
+        except FileNotFoundError:
+            self.falhas += 1
+            return registro
+        except Exception:
+            # Entrada truncada ou ilegível: é refeita
+            self.falhas += 1
+            registro.nfe, registro.paginas = None, {}
+            return registro
+        self.acertos += 1
+        try:
+            os.utime(registro.arquivo)
+        except OSError:
+            pass
+        return registro
+
+    def gravar(self, registro):
+        dados = pickle.dumps((registro.nfe, registro.paginas),
+                             pickle.HIGHEST_PROTOCOL)
+        try:
+            anterior = os.path.getsize(registro.arquivo)
+        except OSError:
+            anterior = 0
+        # Rename atômico, sem fsync: após uma queda a entrada no máximo
+        # fica ilegível e é refeita
+        temp = temporario(registro.arquivo)
+        try:
+            with open(temp, 'wb') as f:
+                f.write(dados)
+            os.replace(temp, registro.arquivo)
+        except OSError:
+            if os.path.exists(temp):
+                os.remove(temp)
+            return
+        registro.alterado = False
+        self.ocupado += len(dados) - anterior
+        if self.ocupado > self.limite:
+            self.podar()
+
+    def entradas(self):
+        with os.scandir(self.pasta) as it:
+            for entrada in it:
+                if entrada.name.endswith('.pkl'):
+                    try:
+                        st = entrada.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield st.st_mtime_ns, st.st_size, entrada.path
+
+    def podar(self):
+        # Remove as menos usadas até 90% do limite; a soma é refeita a
+        # partir da pasta, que outros processos também alteram
+        entradas = sorted(self.entradas())
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        for _, tamanho, caminho in entradas:
+            if total <= self.limite * 0.9:
+                break
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+            total -= tamanho
+        self.ocupado = total
+
+
+abertos = {}
+
+
+def abrir(pasta, limite=256 << 20):
+    """Instância única por processo para cada pasta"""
+    cache = abertos.get(pasta)
+    if cache is None:
+        cache = abertos[pasta] = CacheNFe(pasta, limite)
+    return cache
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Conversão de um XML em PDF, usada pelo app.py e pelos módulos de
+    monitoramento (monitor.py), fontes (fontes.py) e saídas (saidas.py)
+
+    Fica fora do app.py para que os workers e esses módulos não importem
+    a linha de comando (argparse, barra de progresso).
+"""
+
+import fnmatch
+import os
+import re
+import signal
+import time
+import warnings
+from collections import namedtuple
+
+from diario import gravar_atomico
+from pdf_docs import DaCCe, Danfe
+from triagem import identificar, rota
+
+Resultado = namedtuple('Resultado', 'origem destino ok tempo paginas erro')
+
+def caminho_pdf(filename, destfolder):
+    return f"{destfolder}{os.path.splitext(str(filename))[0]}.pdf"
+
+def ler_xml(fullpath, conteudo=None):
+    # `conteudo` traz o XML já em memória (ex.: membro de um .zip). Sem ele
+    # o caminho vai direto para a Danfe, que lê os bytes (mmap se grande) e
+    # respeita o encoding declarado no XML
+    return fullpath if conteudo is None else conteudo
+
+# Limite padrão da leitura em fluxo (app.py --fluxo sem valor)
+LIMITE_FLUXO = 4 << 20
+
+def printpdf(fullpath, filename, destfolder, image=None, cfg_layout='ICMS_IPI',
+             receipt_pos='top', conteudo=None, cache=None, documento='danfe',
+             limite_fluxo=None):
+    # Com `limite_fluxo` (bytes), XMLs a partir desse tamanho são lidos em
+    # fluxo (ver nfe.LeitorNFe): menos memória, renderização mais lenta
+    if documento == 'dacce':
+        pdf = DaCCe(xmls=[ler_xml(fullpath, conteudo)], image=image)
+    else:
+        streaming = (limite_fluxo is not None and conteudo is None and
+                     os.path.getsize(fullpath) >= limite_fluxo)
+        pdf = Danfe(xmls=[ler_xml(fullpath, conteudo)], image=image,
+                    cfg_layout=cfg_layout, receipt_pos=receipt_pos,
+                    streaming=streaming, cache=cache)
+    destino = caminho_pdf(filename, destfolder)
+    # Subpastas da origem são reproduzidas no destino
+    if os.sep in filename or "/" in filename:
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+    gravar_atomico(destino, pdf.output())
+    return pdf.pages_count
+
+def converter(tarefa):
+    # Executado nos workers: devolve o Resultado de um arquivo
+    fullpath, filename, destfolder, opcoes, conteudo = tarefa
+    destino = caminho_pdf(filename, destfolder)
+    inicio = time.perf_counter()
+    try:
+        paginas = printpdf(fullpath, filename, destfolder, conteudo=conteudo,
+                           **opcoes)
+    except Exception as e:
+        return Resultado(fullpath, destino, False,
+                         time.perf_counter() - inicio, 0, repr(e))
+    return Resultado(fullpath, destino, True, time.perf_counter() - inicio,
+                     paginas, None)
+
+def rotear(tarefa, rotas=("danfe", "dacce"), ao_falhar=None,
+           ao_ignorar=None):
+    # Gera a tarefa ajustada ao tipo do XML, identificado pelo início do
+    # arquivo (ver triagem.py); nada quando o documento não é suportado ou
+    # está fora das rotas, caso em que ao_ignorar recebe a origem.
+    # Uma resposta da distribuição de DF-e gera uma tarefa por documento;
+    # se ela não puder ser lida, ao_falhar recebe o Resultado da falha
+    fullpath, filename, destfolder, opcoes, conteudo = tarefa
+    try:
+        documento = rota(identificar(
+            fullpath if conteudo is None else conteudo))
+    except OSError:
+        # O worker registra a falha
+        yield tarefa
+        return
+    if documento not in rotas:
+        if ao_ignorar is not None:
+            ao_ignorar(fullpath)
+        return
+    if documento == "dacce":
+        opcoes = dict(documento="dacce", image=opcoes.get("image"))
+        yield fullpath, filename, destfolder, opcoes, conteudo
+    elif documento == "distribuicao":
+        from fontes import documentos_distribuicao
+        # PDFs em <destino>/<subpasta>/<resposta>/<NSU>-<schema>.pdf
+        pasta = os.path.splitext(filename)[0]
+        try:
+            for nome, xml in documentos_distribuicao(
+                    fullpath if conteudo is None else conteudo):
+                yield from rotear((f"{fullpath}::{nome}", f"{pasta}/{nome}",
+                                   destfolder, opcoes, xml), rotas,
+                                  ao_falhar, ao_ignorar)
+        except (OSError, EOFError, ValueError, SyntaxError) as e:
+            # Leitura, base64, gzip ou XML inválidos na resposta
+            resultado = Resultado(fullpath, caminho_pdf(filename, destfolder),
+                                  False, 0.0, 0, repr(e))
+            if ao_falhar is None:
+                from tqdm import tqdm
+                tqdm.write(f"FALHA {fullpath}: {resultado.erro}")
+            else:
+                ao_falhar(resultado)
+    else:
+        yield tarefa
+
+def iniciar_worker():
+    # Interrupções são tratadas pelo processo principal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    warnings.simplefilter("ignore")
+
+def compilar_padroes(padroes):
+    # Padrões sem '/' valem para o nome do arquivo, os demais para o
+    # caminho relativo à pasta de origem
+    nomes = [fnmatch.translate(p) for p in padroes if '/' not in p]
+    caminhos = [fnmatch.translate(p) for p in padroes if '/' in p]
+    casa_nome = re.compile('|'.join(nomes)).match if nomes else None
+    casa_caminho = re.compile('|'.join(caminhos)).match if caminhos else None
+
+    def casa(rel, nome):
+        return bool((casa_nome and casa_nome(nome)) or
+                    (casa_caminho and casa_caminho(rel)))
+    return casa
+
+def ler_paths_xml(pasta, incluir=("*.xml",), excluir=(), recursivo=True):
+    # Gera os caminhos (relativos a `pasta`) à medida que a varredura
+    # avança, sem montar a lista inteira em memória
+    incluido = compilar_padroes(incluir)
+    excluido = compilar_padroes(excluir)
+    pendentes = [""]
+    while pendentes:
+        rel_dir = pendentes.pop()
+        try:
+            it = os.scandir(os.path.join(pasta, rel_dir))
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                rel = f"{rel_dir}{entry.name}"
+                if entry.is_dir(follow_symlinks=False):
+                    if recursivo and not excluido(rel, entry.name):
+                        pendentes.append(f"{rel}/")
+                elif incluido(rel, entry.name) and not excluido(rel, entry.name):
+                    yield rel
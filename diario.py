@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Diário de conversão para retomada após falhas
+
+    Arquivo de texto só de acréscimo, com uma linha (string JSON) por XML
+    cujo PDF já está gravado em definitivo. Cada registro é um único
+    write() em modo O_APPEND e o fsync é feito em grupo, no máximo a cada
+    `intervalo` segundos: após uma queda perde-se no pior caso o último
+    grupo, cujos arquivos são simplesmente convertidos de novo. Uma última
+    linha incompleta é ignorada na leitura.
+"""
+
+import json
+import os
+import time
+
+
+class Diario:
+    def __init__(self, caminho, retomar=False, intervalo=1.0):
+        self.caminho = caminho
+        self.intervalo = intervalo
+        self.concluidos = set()
+        if retomar and os.path.exists(caminho):
+            with open(caminho, 'rb') as f:
+                for linha in f:
+                    if not linha.endswith(b'\n'):
+                        break
+                    try:
+                        self.concluidos.add(json.loads(linha))
+                    except ValueError:
+                        break
+        modo = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if not retomar:
+            modo |= os.O_TRUNC
+        self.fd = os.open(caminho, modo, 0o644)
+        self.ultimo_sync = time.monotonic()
+        self.pendentes = 0
+
+    def concluido(self, origem):
+        return origem in self.concluidos
+
+    def registrar(self, origem):
+        os.write(self.fd, (json.dumps(origem) + '\n').encode())
+        self.pendentes += 1
+        if time.monotonic() - self.ultimo_sync >= self.intervalo:
+            self.sincronizar()
+
+    def sincronizar(self):
+        if self.pendentes:
+            os.fsync(self.fd)
+            self.pendentes = 0
+        self.ultimo_sync = time.monotonic()
+
+    def fechar(self):
+        self.sincronizar()
+        os.close(self.fd)
+
+
+def temporario(caminho):
+    # Temporário oculto na mesma pasta, para que o rename seja atômico
+    pasta, nome = os.path.split(caminho)
+    return os.path.join(pasta, f".{nome}.{os.getpid()}.tmp")
+
+
+def limpar_temporarios(pasta):
+    # Remove os temporários de processos que já terminaram (queda entre a
+    # gravação e o rename); os de uma conversão em andamento ficam
+    for raiz, _, nomes in os.walk(pasta):
+        for nome in nomes:
+            partes = nome.rsplit('.', 2)
+            if not (nome.startswith('.') and len(partes) == 3 and
+                    partes[2] == 'tmp' and partes[1].isdigit()):
+                continue
+            try:
+                os.kill(int(partes[1]), 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except OSError:
+                # Processo de outro usuário
+                continue
+            try:
+                os.remove(os.path.join(raiz, nome))
+            except FileNotFoundError:
+                pass
+
+
+def publicar(temp, caminho):
+    # Só renomeia depois de o conteúdo estar no disco: o arquivo final
+    # nunca existe pela metade, nem após uma queda de energia
+    fd = os.open(temp, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(temp, caminho)
+
+
+def gravar_atomico(caminho, dados):
+    temp = temporario(caminho)
+    try:
+        with open(temp, 'wb') as f:
+            f.write(dados)
+        publicar(temp, caminho)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
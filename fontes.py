@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Fontes de XML além de arquivos soltos em disco
+
+    Os membros de pacotes .zip/.tar(.gz/.bz2/.xz) são lidos um a um, apenas
+    quando consumidos, e entregues em memória ao conversor, sem extração
+    para o disco.
+
+    Respostas da distribuição de DF-e (retDistDFeInt) são percorridas em
+    fluxo: cada docZip (base64 + gzip) é descompactado em memória quando
+    consumido e descartado da árvore em seguida. Resumos (resNFe,
+    resEvento) são pulados sem decodificação.
+"""
+
+import base64
+import gzip
+import os
+import tarfile
+import zipfile
+
+from conversao import compilar_padroes
+from nfe import NS, backend
+
+EXTENSOES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2',
+             '.tar.xz', '.txz')
+
+
+def compactado(nome):
+    return nome.lower().endswith(EXTENSOES)
+
+
+def nome_pacote(nome):
+    # 'lote.tar.gz' -> 'lote'
+    base = os.path.basename(nome)
+    for ext in sorted(EXTENSOES, key=len, reverse=True):
+        if base.lower().endswith(ext):
+            return base[:-len(ext)]
+    return base
+
+
+def nome_seguro(nome):
+    # Impede que um membro como '../../x.xml' gere PDF fora do destino
+    partes = [p for p in nome.replace('\\', '/').split('/')
+              if p not in ('', '.', '..')]
+    return '/'.join(partes)
+
+
+def membros_xml(caminho, incluir=('*.xml',)):
+    """Gera (nome do membro, conteúdo em bytes) para cada XML do pacote"""
+    incluido = compilar_padroes(incluir)
+
+    if zipfile.is_zipfile(caminho):
+        with zipfile.ZipFile(caminho) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                if incluido(info.filename, os.path.basename(info.filename)):
+                    yield nome_seguro(info.filename), zf.read(info)
+        return
+
+    # Modo stream: leitura sequencial, sem seek (adequado para .tar.gz)
+    with tarfile.open(caminho, mode='r|*') as tf:
+        for info in tf:
+            if not info.isfile():
+                continue
+            if incluido(info.name, os.path.basename(info.name)):
+                f = tf.extractfile(info)
+                yield nome_seguro(info.name), f.read()
+
+
+DOC_ZIP = NS + 'docZip'
+LOTE_DIST = NS + 'loteDistDFeInt'
+
+
+def documentos_distribuicao(caminho):
+    """Gera (nome, XML em bytes) para cada docZip de um retDistDFeInt"""
+    lote = None
+    for evento, el in backend.iterparse(caminho, ('start', 'end')):
+        if evento == 'start':
+            if el.tag == LOTE_DIST and lote is None:
+                lote = el
+            continue
+        if el.tag != DOC_ZIP:
+            continue
+        # schema="procNFe_v4.00.xsd", "resNFe_v1.01.xsd", ...
+        tipo = el.get('schema', '').split('_')[0]
+        if not tipo.startswith('res'):
+            nome = f"{el.get('NSU', '')}-{tipo}.xml"
+            yield nome, gzip.decompress(base64.b64decode(el.text or ''))
+        el.clear()
+        if lote is not None and len(lote) and lote[-1] is el:
+            del lote[-1]
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Manifesto da conversão incremental
+
+    Guarda, para cada XML convertido, o hash do conteúdo, as configurações
+    de layout usadas e o PDF gerado. Arquivos cujo tamanho e data de
+    modificação não mudaram são pulados sem serem lidos; quando só a data
+    muda, o hash decide.
+
+    atual() pode rodar fora da thread que abriu o manifesto (o filtro das
+    tarefas é consumido pelo Pool numa thread própria): ela só lê, e o que
+    precisa ser gravado fica para registrar()/salvar()/fechar(), chamados
+    na thread principal.
+
+    Documentos de uma resposta da distribuição de DF-e entram um a um,
+    como "<resposta>::<documento>", com o tamanho, a data e o hash do
+    arquivo da resposta.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import deque
+
+
+def hash_arquivo(caminho):
+    h = hashlib.blake2b(digest_size=16)
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def arquivo_origem(origem):
+    # Arquivo de um documento de resposta da distribuição
+    return origem.split('::', 1)[0]
+
+
+def chave_config(cfg_layout, receipt_pos, image):
+    # O logo entra pelo conteúdo, não pelo nome do arquivo
+    logo = ''
+    if image:
+        if os.path.isfile(image):
+            logo = hash_arquivo(image)
+        else:
+            logo = hashlib.blake2b(image.encode(), digest_size=16).hexdigest()
+    return json.dumps([cfg_layout, receipt_pos, logo])
+
+
+class Manifesto:
+    def __init__(self, caminho, config, commit_cada=500):
+        self.config = config
+        self.commit_cada = commit_cada
+        self.pendentes = 0
+        self.hashes = {}
+        self.trava = threading.Lock()
+        self.renovacoes = deque()
+        self.db = sqlite3.connect(caminho)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS arquivos ('
+                        'origem TEXT PRIMARY KEY, tamanho INTEGER, '
+                        'mtime_ns INTEGER, hash TEXT, config TEXT, '
+                        'destino TEXT)')
+        # Carrega tudo de uma vez: uma consulta por arquivo custaria mais
+        # que o próprio stat
+        self.entradas = {row[0]: row[1:] for row in self.db.execute(
+            'SELECT origem, tamanho, mtime_ns, hash, config, destino '
+            'FROM arquivos')}
+
+    def atual(self, origem, destino):
+        """True se o PDF de destino já corresponde ao XML e à configuração"""
+        entrada = self.entradas.get(origem)
+        if entrada is None:
+            return False
+        tamanho, mtime_ns, hash_, config, destino_ = entrada
+        if config != self.config or destino_ != destino:
+            return False
+        if not os.path.exists(destino):
+            return False
+        arquivo = arquivo_origem(origem)
+        st = os.stat(arquivo)
+        if st.st_size == tamanho and st.st_mtime_ns == mtime_ns:
+            return True
+
+        novo_hash = hash_arquivo(arquivo)
+        if novo_hash != hash_:
+            with self.trava:
+                self.hashes[origem] = novo_hash
+            return False
+        # Arquivo tocado mas com o mesmo conteúdo: a entrada é renovada
+        # depois, na thread do banco (ver renovar)
+        self.renovacoes.append((origem, st, novo_hash, destino))
+        return True
+
+    def registrar(self, origem, destino):
+        self.renovar()
+        with self.trava:
+            hash_ = self.hashes.pop(origem, None)
+        arquivo = arquivo_origem(origem)
+        try:
+            st = os.stat(arquivo)
+            hash_ = hash_ or hash_arquivo(arquivo)
+        except FileNotFoundError:
+            # XML movido ou apagado depois de convertido (pasta de entrada
+            # do ERP): fica fora do manifesto
+            return
+        self._gravar(origem, st, hash_, destino)
+
+    def renovar(self):
+        # Grava as entradas de arquivos só tocados, vistas por atual()
+        while self.renovacoes:
+            self._gravar(*self.renovacoes.popleft())
+
+    def _gravar(self, origem, st, hash_, destino):
+        entrada = (st.st_size, st.st_mtime_ns, hash_, self.config, destino)
+        self.entradas[origem] = entrada
+        self.db.execute('INSERT OR REPLACE INTO arquivos VALUES '
+                        '(?, ?, ?, ?, ?, ?)', (origem,) + entrada)
+        self.pendentes += 1
+        if self.pendentes >= self.commit_cada:
+            self.salvar()
+
+    def salvar(self):
+        self.renovar()
+        if self.pendentes:
+            self.db.commit()
+            self.pendentes = 0
+
+    def fechar(self):
+        self.renovar()
+        self.db.commit()
+        self.db.close()
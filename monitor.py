@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Monitoramento de pasta
+
+    Converte os XMLs à medida que chegam na pasta de origem, usando um pool
+    de workers já aquecido. Usa inotify quando disponível (Linux) e cai para
+    varredura periódica caso contrário, por exemplo em pastas NFS, onde
+    gravações feitas por outra máquina não geram eventos.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import queue
+import select
+import signal
+import struct
+import time
+from multiprocessing import Pool
+
+from conversao import (caminho_pdf, converter, iniciar_worker,
+                       ler_paths_xml, rotear)
+
+# Sem spool no monitoramento: todos os documentos têm PDF próprio
+ROTAS = ("danfe", "dacce", "distribuicao")
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+EVENTO = struct.Struct('iIII')
+
+
+class Inotify:
+    # Só sinaliza arquivos fechados após escrita ou movidos para a pasta,
+    # portanto nunca entrega um arquivo ainda sendo gravado
+    def __init__(self, pasta):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(pasta),
+                                    IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch', pasta)
+        self.pasta = pasta
+
+    def novos(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            dados = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        nomes = []
+        pos = 0
+        while pos < len(dados):
+            _, mask, _, tamanho = EVENTO.unpack_from(dados, pos)
+            pos += EVENTO.size
+            nome = dados[pos:pos + tamanho].rstrip(b'\0')
+            pos += tamanho
+            if mask & IN_Q_OVERFLOW:
+                # Eventos perdidos: relê a pasta inteira
+                nomes.extend(ler_paths_xml(self.pasta, recursivo=False))
+            elif nome:
+                nomes.append(os.fsdecode(nome))
+        return [nome for nome in nomes if nome.endswith('.xml')]
+
+    def fechar(self):
+        os.close(self.fd)
+
+
+class Varredura:
+    # Considera o arquivo completo quando tamanho e data de modificação
+    # não mudam entre duas varreduras e a última escrita tem mais de
+    # `estabilidade` segundos
+    def __init__(self, pasta, intervalo=0.25, estabilidade=0.5):
+        self.pasta = pasta
+        self.intervalo = intervalo
+        self.estabilidade = estabilidade
+        self.vistos = {}
+        self.entregues = {}
+        # Os arquivos já presentes são tratados pela carga inicial
+        for nome, assinatura in self._listar():
+            self.entregues[nome] = assinatura
+
+    def _listar(self):
+        with os.scandir(self.pasta) as it:
+            for entry in it:
+                if entry.name.endswith('.xml') and entry.is_file():
+                    st = entry.stat()
+                    yield entry.name, (st.st_size, st.st_mtime_ns)
+
+    def novos(self, timeout):
+        time.sleep(min(timeout, self.intervalo))
+        agora = time.time_ns()
+        nomes = []
+        vistos = {}
+        for nome, assinatura in self._listar():
+            vistos[nome] = assinatura
+            if self.entregues.get(nome) == assinatura:
+                continue
+            estavel = (self.vistos.get(nome) == assinatura and
+                       agora - assinatura[1] >= self.estabilidade * 1e9)
+            if estavel:
+                self.entregues[nome] = assinatura
+                nomes.append(nome)
+        self.vistos = vistos
+        for nome in set(self.entregues) - set(vistos):
+            del self.entregues[nome]
+        return nomes
+
+    def fechar(self):
+        pass
+
+
+def criar_observador(pasta, polling=False, intervalo=0.25):
+    if not polling:
+        try:
+            return Inotify(pasta)
+        except (OSError, AttributeError):
+            pass
+    return Varredura(pasta, intervalo=intervalo)
+
+
+def monitorar(pastaXML, PastaPDF, opcoes, workers=1, polling=False,
+              intervalo=0.25, manifesto=None):
+    observador = criar_observador(pastaXML, polling=polling,
+                                  intervalo=intervalo)
+    print(f"Monitorando {pastaXML} ({type(observador).__name__}, "
+          f"{workers} workers)", flush=True)
+
+    # SIGTERM encerra como Ctrl+C, terminando os arquivos em andamento
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    concluidos = queue.Queue()
+    # Resultados pendentes por arquivo da pasta: uma resposta da
+    # distribuição gera um por documento
+    em_andamento = {}
+    repetir = set()
+    pool = Pool(workers, initializer=iniciar_worker)
+
+    def ignorar(origem):
+        print(f"{time.strftime('%H:%M:%S')} IGNORADO {origem}: "
+              f"documento não suportado", flush=True)
+
+    def enviar(nome):
+        if nome in em_andamento:
+            # Regravado durante a conversão: converte de novo ao terminar
+            repetir.add(nome)
+            return
+        fullpath = f"{pastaXML}{nome}"
+        if manifesto is not None and manifesto.atual(
+                fullpath, caminho_pdf(nome, PastaPDF)):
+            return
+        falhas = []
+        pendentes = 0
+        for tarefa in rotear((fullpath, nome, PastaPDF, opcoes, None),
+                             ROTAS, falhas.append, ignorar):
+            if manifesto is not None and tarefa[0] != fullpath and (
+                    manifesto.atual(tarefa[0],
+                                    caminho_pdf(tarefa[1], tarefa[2]))):
+                continue
+            pool.apply_async(converter, (tarefa,), callback=concluidos.put)
+            pendentes += 1
+        for r in falhas:
+            concluidos.put(r)
+        pendentes += len(falhas)
+        # Os resultados só são lidos por recolher(), nesta mesma thread
+        if pendentes:
+            em_andamento[nome] = pendentes
+
+    def recolher():
+        while True:
+            try:
+                r = concluidos.get_nowait()
+            except queue.Empty:
+                return
+            nome = os.path.basename(r.origem.split("::", 1)[0])
+            em_andamento[nome] -= 1
+            if r.ok:
+                if manifesto is not None:
+                    manifesto.registrar(r.origem, r.destino)
+                print(f"{time.strftime('%H:%M:%S')} OK {r.origem} -> "
+                      f"{r.destino} ({r.paginas} pág, {r.tempo:.2f}s)",
+                      flush=True)
+            else:
+                print(f"{time.strftime('%H:%M:%S')} FALHA {r.origem}: "
+                      f"{r.erro}", flush=True)
+            if em_andamento[nome]:
+                continue
+            del em_andamento[nome]
+            if nome in repetir:
+                repetir.discard(nome)
+                enviar(nome)
+
+    try:
+        for nome in ler_paths_xml(pastaXML, recursivo=False):
+            enviar(nome)
+        while True:
+            for nome in observador.novos(0.1):
+                enviar(nome)
+            recolher()
+            if manifesto is not None and not em_andamento:
+                manifesto.salvar()
+    except KeyboardInterrupt:
+        print("Encerrando...", flush=True)
+    finally:
+        observador.fechar()
+        pool.close()
+        pool.join()
+        recolher()
+        if manifesto is not None:
+            manifesto.fechar()
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Leitura da NF-e (nfeProc) para um modelo compacto
+
+    A árvore é percorrida uma única vez para localizar as seções e cada
+    seção uma vez para extrair seus campos. Os atributos têm o nome da tag
+    no XML e seguem a regra de get_tag_text: texto da primeira ocorrência
+    da tag na seção ('' quando a tag não existe).
+
+    LeitorNFe faz a mesma leitura em fluxo (iterparse), para notas com
+    milhares de itens: cada det vira um Item e é descartado em seguida.
+
+    Com o lxml instalado, ele é usado no parse e as buscas de campos são
+    expressões ETXPath pré-compiladas; sem ele, xml.etree.ElementTree.
+    A variável de ambiente NFE_XML (lxml/etree) força um dos dois.
+
+    O XML pode ser dado como texto (str), bytes, bytearray, memoryview,
+    arquivo binário ou caminho. Caminhos são lidos em bytes (mapeados com
+    mmap a partir de LIMITE_MMAP), de modo que o parser trabalha sobre o
+    conteúdo bruto e respeita o encoding declarado no XML.
+"""
+
+import contextlib
+import io
+import mmap
+import os
+import xml.etree.ElementTree as ET
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    # lxml é opcional
+    lxml_etree = None
+
+NS = '{http://www.portalfiscal.inf.br/nfe}'
+
+
+def tags(campos):
+    return {NS + campo: campo for campo in campos}
+
+
+# Arquivos a partir deste tamanho são mapeados em memória
+LIMITE_MMAP = 1 << 20
+
+
+def eh_caminho(xml):
+    # Só uma str sem '<' e sem quebra de linha é tratada como caminho;
+    # texto XML malformado segue para o parser, que aponta o erro
+    if isinstance(xml, str):
+        return '<' not in xml and '\n' not in xml
+    return isinstance(xml, os.PathLike)
+
+
+@contextlib.contextmanager
+def conteudo_xml(xml):
+    """Bytes de um caminho (mmap se grande); outras fontes passam direto"""
+    if not eh_caminho(xml):
+        yield xml
+        return
+    with open(xml, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < LIMITE_MMAP:
+            yield f.read()
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            yield m
+
+
+def fonte_binaria(xml):
+    if isinstance(xml, str):
+        if eh_caminho(xml):
+            return xml
+        return io.BytesIO(xml.encode('utf-8'))
+    if isinstance(xml, os.PathLike):
+        return xml
+    if isinstance(xml, (bytes, bytearray, memoryview)):
+        return io.BytesIO(xml)
+    xml.seek(0)
+    return xml
+
+
+class BackendET:
+    nome = 'etree'
+
+    def fromstring(self, xml):
+        return ET.fromstring(xml)
+
+    def iterparse(self, xml, events):
+        # Texto continua str: o encoding declarado não se aplica
+        if isinstance(xml, str) and not eh_caminho(xml):
+            return ET.iterparse(io.StringIO(xml), events=events)
+        return ET.iterparse(fonte_binaria(xml), events=events)
+
+    def primeiros(self, no, mapa):
+        achados = {}
+        total = len(mapa)
+        for el in no.iter():
+            campo = mapa.get(el.tag)
+            if campo is not None and campo not in achados:
+                achados[campo] = el
+                if len(achados) == total:
+                    break
+        return achados
+
+
+class BackendLxml:
+    nome = 'lxml'
+    # Mesma árvore que o ElementTree produz: sem comentários nem PIs
+    opcoes = dict(remove_comments=True, remove_pis=True,
+                  resolve_entities=False, huge_tree=True)
+
+    # Buffers (memoryview, mmap) são entregues ao parser em pedaços
+    bloco = 1 << 20
+
+    def __init__(self):
+        self.parser = lxml_etree.XMLParser(**self.opcoes)
+        self.parser_str = lxml_etree.XMLParser(encoding='utf-8',
+                                               **self.opcoes)
+        self.expressoes = {}
+
+    def fromstring(self, xml):
+        if isinstance(xml, str):
+            return lxml_etree.fromstring(xml.encode('utf-8'),
+                                         self.parser_str)
+        if isinstance(xml, bytes):
+            return lxml_etree.fromstring(xml, self.parser)
+        # Parser próprio: um erro no meio do feed não contamina o próximo
+        parser = lxml_etree.XMLParser(**self.opcoes)
+        with memoryview(xml) as dados:
+            for inicio in range(0, len(dados), self.bloco):
+                parser.feed(bytes(dados[inicio:inicio + self.bloco]))
+        return parser.close()
+
+    def iterparse(self, xml, events):
+        texto = isinstance(xml, str) and not eh_caminho(xml)
+        return lxml_etree.iterparse(
+            fonte_binaria(xml), events=events,
+            encoding='utf-8' if texto else None, **self.opcoes)
+
+    def primeiros(self, no, mapa):
+        chave = tuple(mapa)
+        xpath = self.expressoes.get(chave)
+        if xpath is None:
+            # União de descendant::{ns}tag: nós em ordem de documento
+            xpath = self.expressoes[chave] = lxml_etree.ETXPath(
+                '|'.join('descendant::%s' % tag for tag in mapa))
+        achados = {}
+        total = len(mapa)
+        for el in xpath(no):
+            campo = mapa[el.tag]
+            if campo not in achados:
+                achados[campo] = el
+                if len(achados) == total:
+                    break
+        return achados
+
+
+def usar_backend(nome=None):
+    """Seleciona o backend XML ('lxml' ou 'etree'); None prefere lxml"""
+    global backend
+    if nome is None:
+        nome = 'lxml' if lxml_etree is not None else 'etree'
+    if nome == 'lxml':
+        if lxml_etree is None:
+            raise ImportError('lxml não está instalado')
+        backend = BackendLxml()
+    elif nome == 'etree':
+        backend = BackendET()
+    else:
+        raise ValueError('backend XML desconhecido: %s' % nome)
+    return backend
+
+
+usar_backend(os.environ.get('NFE_XML') or None)
+
+
+def textos(no, mapa):
+    # Texto da primeira ocorrência de cada tag de `mapa` abaixo de `no`
+    if no is None:
+        return {}
+    return {campo: el.text
+            for campo, el in backend.primeiros(no, mapa).items()}
+
+
+def preencher(obj, no, mapa):
+    valores = textos(no, mapa)
+    for campo in mapa.values():
+        setattr(obj, campo, valores.get(campo, ''))
+
+
+class Secao:
+    __slots__ = ()
+
+    def __init_subclass__(cls):
+        cls.mapa = tags(cls.__slots__)
+
+    def __init__(self, no):
+        preencher(self, no, self.mapa)
+
+
+class Ide(Secao):
+    __slots__ = ('natOp', 'serie', 'nNF', 'dhEmi', 'dhSaiEnt', 'tpNF',
+                 'tpImp', 'tpAmb')
+
+
+class Emitente(Secao):
+    __slots__ = ('CNPJ', 'xNome', 'xLgr', 'nro', 'xBairro', 'xMun', 'UF',
+                 'CEP', 'fone', 'IE')
+
+
+class Destinatario(Secao):
+    __slots__ = ('CNPJ', 'CPF', 'xNome', 'xLgr', 'nro', 'xBairro', 'xMun',
+                 'UF', 'CEP', 'fone', 'IE')
+
+
+class Totais(Secao):
+    __slots__ = ('vBC', 'vICMS', 'vBCST', 'vST', 'vProd', 'vFrete', 'vSeg',
+                 'vDesc', 'vIPI', 'vOutro', 'vNF', 'vTotTrib')
+
+
+class Transporte(Secao):
+    __slots__ = ('modFrete', 'CNPJ', 'xNome', 'IE', 'xEnder', 'xMun', 'UF',
+                 'qVol', 'esp', 'marca', 'nVol', 'pesoL', 'pesoB')
+
+
+class Duplicata(Secao):
+    __slots__ = ('nDup', 'dVenc', 'vDup')
+
+
+class Protocolo(Secao):
+    __slots__ = ('dhRecbto', 'nProt')
+
+
+TAGS_ADIC = tags(('infAdFisco', 'infCpl'))
+TAGS_OBS = tags(('xTexto',))
+
+
+class InfAdic:
+    __slots__ = ('infAdFisco', 'infCpl', 'CodVendedor', 'NomeVendedor')
+
+    def __init__(self, no):
+        preencher(self, no, TAGS_ADIC)
+        vendedor = {}
+        for obs in no.iter(NS + 'obsCont'):
+            campo = obs.get('xCampo')
+            if campo in ('CodVendedor', 'NomeVendedor') and \
+                    campo not in vendedor:
+                vendedor[campo] = textos(obs, TAGS_OBS).get('xTexto', '')
+        self.CodVendedor = vendedor.get('CodVendedor', '')
+        self.NomeVendedor = vendedor.get('NomeVendedor', '')
+
+
+CAMPOS_PROD = ('cProd', 'xProd', 'NCM', 'CFOP', 'uCom', 'qCom', 'vUnCom',
+               'vProd')
+CAMPOS_ICMS = ('orig', 'CST', 'CSOSN', 'vBC', 'pICMS', 'vICMS', 'vBCST',
+               'vICMSST')
+CAMPOS_IPI = ('vIPI', 'pIPI')
+TAGS_PROD = tags(CAMPOS_PROD)
+TAGS_ICMS = tags(CAMPOS_ICMS)
+TAGS_IPI = tags(CAMPOS_IPI)
+# Grupos do det; ICMS e IPI só existem dentro de imposto
+TAGS_DET = tags(('prod', 'ICMS', 'IPI', 'infAdProd'))
+
+
+class Item:
+    __slots__ = CAMPOS_PROD + CAMPOS_ICMS + CAMPOS_IPI + ('infAdProd',)
+
+    def __init__(self, det):
+        grupos = backend.primeiros(det, TAGS_DET)
+        preencher(self, grupos.get('prod'), TAGS_PROD)
+        preencher(self, grupos.get('ICMS'), TAGS_ICMS)
+        preencher(self, grupos.get('IPI'), TAGS_IPI)
+        # None quando a tag não existe (a descrição não ganha linhas)
+        adic = grupos.get('infAdProd')
+        self.infAdProd = None if adic is None else adic.text
+
+
+SECOES = {NS + tag: tag for tag in ('infNFe', 'ide', 'emit', 'dest', 'total',
+                                    'transp', 'cobr', 'infAdic', 'protNFe')}
+DET = NS + 'det'
+
+
+def localizar(no, secoes, itens):
+    # Desce na árvore sem entrar nas seções já localizadas
+    for filho in no:
+        tag = filho.tag
+        if tag == DET:
+            itens.append(filho)
+            continue
+        nome = SECOES.get(tag)
+        if nome is not None and nome not in secoes:
+            secoes[nome] = filho
+            if nome != 'infNFe':
+                continue
+        localizar(filho, secoes, itens)
+
+
+class NFe:
+    __slots__ = ('chave', 'ide', 'emit', 'dest', 'totais', 'transp', 'cobr',
+                 'itens', 'protocolo', 'adic')
+
+    def __init__(self, secoes, dets):
+        self.chave = secoes['infNFe'].attrib.get('Id')[3:]
+        self.ide = Ide(secoes.get('ide'))
+        self.emit = Emitente(secoes.get('emit'))
+        self.dest = Destinatario(secoes.get('dest'))
+        self.totais = Totais(secoes.get('total'))
+        self.transp = Transporte(secoes.get('transp'))
+        self.protocolo = Protocolo(secoes.get('protNFe'))
+
+        # Salta o 1º elemento (tag fat) e considera os próximos 9 (tags dup)
+        cobr = secoes.get('cobr')
+        self.cobr = [Duplicata(dup) for dup in cobr[1:10]] \
+            if cobr is not None else []
+
+        adic = secoes.get('infAdic')
+        self.adic = InfAdic(adic) if adic is not None else None
+        self.itens = [Item(det) for det in dets]
+
+
+def ler_nfe(xml):
+    """Lê o XML de uma NF-e (texto, bytes ou caminho) e devolve o modelo"""
+    secoes = {}
+    dets = []
+    with conteudo_xml(xml) as dados:
+        raiz = backend.fromstring(dados)
+    localizar(raiz, secoes, dets)
+    return NFe(secoes, dets)
+
+
+INF_NFE = NS + 'infNFe'
+IDE = NS + 'ide'
+
+
+class LeitorNFe:
+    """
+    Leitura em fluxo de uma NF-e
+
+    Cada passada relê a fonte (texto, bytes, caminho ou arquivo binário
+    com seek).
+    itens() gera os Items um a um, removendo cada det da árvore assim que
+    é consumido; ao fim da passada `nfe` tem o cabeçalho (itens vazio).
+    Só as seções do cabeçalho ficam em memória.
+    """
+
+    def __init__(self, xml):
+        self.xml = xml
+        self.nfe = None
+
+    def eventos(self):
+        return backend.iterparse(self.xml, ('start', 'end'))
+
+    def ide(self):
+        # O grupo ide é o primeiro da NF-e: lê só o início da fonte
+        for evento, el in self.eventos():
+            if evento == 'end' and el.tag == IDE:
+                return Ide(el)
+        return Ide(None)
+
+    def itens(self):
+        secoes = {}
+        inf_nfe = None
+        for evento, el in self.eventos():
+            tag = el.tag
+            if evento == 'start':
+                if tag == INF_NFE and inf_nfe is None:
+                    inf_nfe = el
+                continue
+            if tag == DET:
+                yield Item(el)
+                el.clear()
+                if inf_nfe is not None and len(inf_nfe) and \
+                        inf_nfe[-1] is el:
+                    del inf_nfe[-1]
+                continue
+            nome = SECOES.get(tag)
+            if nome is not None and nome not in secoes:
+                secoes[nome] = el
+        self.nfe = NFe(secoes, [])
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Distribuição dos itens da DANFE pelas páginas
+
+    Trabalha só com o número de linhas de cada item (xProd e infAdProd já
+    quebrados na largura da coluna), sem FPDF, e pode ser usada e medida
+    isoladamente. Percorre os itens uma vez e guarda só as páginas: custo
+    O(n) e memória O(páginas), mesmo com dezenas de milhares de itens.
+
+    Cada página é um intervalo [inicio, fim) de itens com as linhas que
+    ocupa e o seu limite. Um item que não cabe na página corrente abre a
+    seguinte; se não couber nem numa página vazia, fica sozinho nela,
+    ultrapassando o limite. Se o primeiro item não couber na primeira
+    página, ela fica sem itens (só o cabeçalho da nota).
+"""
+
+from collections import namedtuple
+
+Pagina = namedtuple('Pagina', 'inicio fim linhas limite')
+
+
+def paginar(linhas, primeira, demais):
+    """Lista de Pagina para itens com `linhas` linhas cada (iterável)"""
+    paginas = []
+    inicio = fim = ocupadas = 0
+    limite = primeira
+    for n in linhas:
+        if ocupadas + n > limite:
+            paginas.append(Pagina(inicio, fim, ocupadas, limite))
+            inicio = fim
+            ocupadas = 0
+            limite = demais
+        fim += 1
+        ocupadas += n
+    paginas.append(Pagina(inicio, fim, ocupadas, limite))
+    return paginas
+
+
+def contar_paginas(linhas, primeira, demais):
+    """Número de páginas de paginar(), sem montar a lista"""
+    paginas = 1
+    ocupadas = 0
+    limite = primeira
+    for n in linhas:
+        if ocupadas + n > limite:
+            paginas += 1
+            ocupadas = 0
+            limite = demais
+        ocupadas += n
+    return paginas
@@ -50,9 +50,15 @@
     :license: BSD, see LICENSE for more details.
 """
 
+import contextlib
 import datetime
+import itertools
+import operator
 import re
+import time
 import xml.etree.ElementTree as ET
+import paginacao
+from nfe import LeitorNFe, conteudo_xml, ler_nfe
 from xfpdf import xFPDF
 
 
@@ -95,10 +101,14 @@ def chunks(cString, nLen):
       yield cString[start:start+nLen]
 
 
+# Troca os separadores do formato en-US de uma vez: 1,234.50 -> 1.234,50
+SEPARADORES = str.maketrans(',.', '.,')
+
+
 def format_number(cNumber, precision=0, group_sep='.', decimal_sep=','):
     try:
-        number = ("{:,." + str(precision) + "f}").format(
-            float(cNumber)).replace(",", "X").replace(".", ",").replace("X",".")
+        number = format(float(cNumber), ',.%df' % precision).translate(
+            SEPARADORES)
     except:
         number = ''
     return number
@@ -132,153 +142,182 @@ headers_2 = ['VLR. ICMS', 'VLR. IPI', 'ALÍQ\nICMS', 'ALÍQ\nIPI']
 headers_3 = ['BC ICMS ST', 'VLR ICMS ST', 'VLR ICMS', 'VLR. IPI', 'ALÍQ\nICMS', 
              'ALÍQ\nIPI']
 
-                              
+
+# Colunas dos produtos: (campo do Item, alinhamento[, casas decimais]).
+# O campo pode ser uma função do item; DESCRICAO é a coluna das linhas da
+# descrição (desc_item). Cada layout é compilado uma vez por compilar_linha
+DESCRICAO = None
+
+
+def cst(item):
+    return '%s%s' % (item.orig, item.CST or item.CSOSN)
+
+
 cells = [
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, get_tag_text(
-        node=kwargs['node_item'], url=url, tag='cProd'), 0, 0, 'L'),
-        
-    lambda **kwargs: kwargs['report'].desc_item(list_desc=kwargs['desc_item'], 
-        width=kwargs['width']),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, get_tag_text(
-        node=kwargs['node_item'], url=url, tag='NCM'), 0, 0, 'C'),
-                    
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, '%s%s' % (
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='orig'), 
-        (get_tag_text(node=kwargs['node_icms'], url=url, tag='CST') or \
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='CSOSN'))), 
-        0, 0, 'C'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, get_tag_text(
-        node=kwargs['node_item'], url=url, tag='CFOP'), 0, 0, 'C'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, get_tag_text(
-        node=kwargs['node_item'], url=url, tag='uCom'), 0, 0, 'C'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_item'], url=url, tag='qCom'), 
-        precision=4), 0, 0, 'R'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_item'], url=url, tag='vUnCom'), 
-        precision=2), 0, 0, 'R'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_item'], url=url, tag='vProd'), 
-        precision=2), 0, 0, 'R'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='vBC'), 
-        precision=2), 0, 0, 'R'),
+    ('cProd', 'L'),
+    (DESCRICAO, 'L'),
+    ('NCM', 'C'),
+    (cst, 'C'),
+    ('CFOP', 'C'),
+    ('uCom', 'C'),
+    ('qCom', 'R', 4),
+    ('vUnCom', 'R', 2),
+    ('vProd', 'R', 2),
+    ('vBC', 'R', 2),
 ]
 
-# ICMS - Variantes layout (Padrão)                            
+# ICMS - Variantes layout (Padrão)
 cells_0 = [
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='vICMS'), 
-        precision=2), 0, 0, 'R'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='pICMS'), 
-        precision=2), 0, 0, 'R'),                
+    ('vICMS', 'R', 2),
+    ('pICMS', 'R', 2),
 ]
-           
+
 # ICMS_ST-  Variantes layout
 cells_1 = [
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='vBCST'), 
-        precision=2), 0, 0, 'R'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='vICMSST'), 
-        precision=2), 0, 0, 'R'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='vICMS'), 
-        precision=2), 0, 0, 'R'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='pICMS'), 
-        precision=2), 0, 0, 'R'),
+    ('vBCST', 'R', 2),
+    ('vICMSST', 'R', 2),
+    ('vICMS', 'R', 2),
+    ('pICMS', 'R', 2),
 ]
 
 # ICMS_IPI - Variantes layout
 cells_2 = [
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='vICMS'), 
-        precision=2), 0, 0, 'R'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_ipi'], url=url, tag='vIPI'), 
-        precision=2), 0, 0, 'R'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='pICMS'), 
-        precision=2), 0, 0, 'R'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_ipi'], url=url, tag='pIPI'), 
-        precision=2), 0, 0, 'R'),
-
+    ('vICMS', 'R', 2),
+    ('vIPI', 'R', 2),
+    ('pICMS', 'R', 2),
+    ('pIPI', 'R', 2),
 ]
 
 # ICMS_ST_IPI -  Variantes layout
 cells_3 = [
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='vBCST'), 
-        precision=2), 0, 0, 'R'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='vICMSST'), 
-        precision=2), 0, 0, 'R'),
-
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='vICMS'), 
-        precision=2), 0, 0, 'R'),
+    ('vBCST', 'R', 2),
+    ('vICMSST', 'R', 2),
+    ('vICMS', 'R', 2),
+    ('vIPI', 'R', 2),
+    ('pICMS', 'R', 2),
+    ('pIPI', 'R', 2),
+]
 
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_ipi'], url=url, tag='vIPI'), 
-        precision=2), 0, 0, 'R'),
 
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_icms'], url=url, tag='pICMS'), 
-        precision=2), 0, 0, 'R'),
+def compilar_linha(larguras, colunas):
+    """Função (report, item, linhas da descrição) que desenha um item"""
+    # Os campos de todas as colunas saem do item numa única chamada
+    campos = operator.attrgetter(*(
+        campo for campo, *_ in colunas
+        if campo is not DESCRICAO and not callable(campo)))
+    celulas = []
+    for largura, (campo, alinhamento, *casas) in zip(larguras, colunas):
+        if campo is DESCRICAO:
+            tipo = 'descricao'
+        elif callable(campo):
+            tipo = 'funcao'
+        elif casas:
+            tipo = 'numero'
+        else:
+            tipo = 'texto'
+        celulas.append((largura, alinhamento, tipo, campo,
+                        casas[0] if casas else 0))
+
+    def linha(report, item, desc):
+        valores = iter(campos(item))
+        for largura, alinhamento, tipo, campo, casas in celulas:
+            if tipo == 'texto':
+                texto = next(valores)
+            elif tipo == 'numero':
+                texto = format_number(next(valores), precision=casas)
+            elif tipo == 'funcao':
+                texto = campo(item)
+            else:
+                report.desc_item(list_desc=desc, width=largura)
+                continue
+            report.text_cell(largura, 3, texto, alinhamento)
+    return linha
 
-    lambda **kwargs: kwargs['report'].cell(kwargs['width'], 3, format_number(
-        get_tag_text(node=kwargs['node_ipi'], url=url, tag='pIPI'), 
-        precision=2), 0, 0, 'R'),
 
-]
+def layout(larguras, cabecalhos, colunas):
+    return [larguras, cabecalhos, compilar_linha(larguras, colunas)]
 
 
 cols_produtos_portable = {                                         
 
-    'ICMS': [[11, 72, 13, 7, 7, 8, 13, 13, 15, 12, 12, 7], 
-             headers + headers_0,
-             cells + cells_0],        
+    'ICMS': layout([11, 72, 13, 7, 7, 8, 13, 13, 15, 12, 12, 7], 
+                   headers + headers_0,
+                   cells + cells_0),        
 
-    'ICMS_ST': [[11, 48, 13, 6.5, 6.5, 8, 13, 13, 15, 12, 12, 13, 12,7],
-                headers + headers_1,
-                cells + cells_1],
+    'ICMS_ST': layout([11, 48, 13, 6.5, 6.5, 8, 13, 13, 15, 12, 12, 13, 12,7],
+                      headers + headers_1,
+                      cells + cells_1),
             
-    'ICMS_IPI': [[11, 54, 13, 7, 7, 8, 13, 13, 14, 12, 12, 12, 7, 7],
-                 headers + headers_2,
-                 cells + cells_2],
+    'ICMS_IPI': layout([11, 54, 13, 7, 7, 8, 13, 13, 14, 12, 12, 12, 7, 7],
+                       headers + headers_2,
+                       cells + cells_2),
 
     }
 
 cols_produtos_landscape = {                                         
             
-    'ICMS_ST_IPI': [[22, 72, 13, 7, 7, 8, 13, 13, 14, 12, 12, 13, 12, 12, 9, 9],
-                    headers + headers_3,
-                    cells + cells_3],
+    'ICMS_ST_IPI': layout([22, 72, 13, 7, 7, 8, 13, 13, 14, 12, 12, 13, 12, 12, 9, 9],
+                          headers + headers_3,
+                          cells + cells_3),
 
     }
 
-# Recebe list xmls em string e image base64 - Modo retrato ou paisagem
+# Linhas de itens na 1ª página e nas seguintes: retrato e paisagem
+LINHAS_RETRATO = (23, 70)
+LINHAS_PAISAGEM = (6, 45)
+
+
+def linhas_descricao(pdf, item, col_w):
+    # Linhas da descrição do item (xProd e infAdProd) na largura col_w
+    pdf.set_font('Times', '', 6)
+    list_ = pdf.split_lines(w=col_w, h=3, txt=item.xProd)
+    if item.infAdProd is not None:
+        list_ = list_ + pdf.split_lines(w=col_w, h=3, txt=item.infAdProd)
+    return list_
+
+
+def contar_paginas(xml, cfg_layout='ICMS_ST'):
+    """Número de páginas da DANFE de `xml`, sem desenhá-la"""
+    # Lê em fluxo e só quebra as descrições, numa página em branco
+    leitor = LeitorNFe(xml)
+    if leitor.ide().tpImp == '1':
+        col_w = cols_produtos_portable[cfg_layout][0][1]
+        primeira, demais = LINHAS_RETRATO
+    else:
+        col_w = cols_produtos_landscape['ICMS_ST_IPI'][0][1]
+        primeira, demais = LINHAS_PAISAGEM
+    medidor = xFPDF()
+    medidor.add_page()
+    return paginacao.contar_paginas(
+        (len(linhas_descricao(medidor, item, col_w))
+         for item in leitor.itens()), primeira, demais)
+
+
+# Com o perfil desligado as etapas usam este contexto vazio
+SEM_PERFIL = contextlib.nullcontext()
+
+
+class Etapa:
+    # Acumula em etapas[nome] o tempo gasto dentro do bloco `with`
+    __slots__ = ('etapas', 'nome', 'inicio')
+
+    def __init__(self, etapas, nome):
+        self.etapas = etapas
+        self.nome = nome
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.etapas[self.nome] = (self.etapas.get(self.nome, 0.0) +
+                                  time.perf_counter() - self.inicio)
+
+
+# Recebe list xmls (texto, bytes, memoryview ou caminho) e image base64 -
+# Modo retrato ou paisagem
 class Danfe(xFPDF):
     def __init__(self, xmls=None, image=None, cfg_layout='ICMS_ST', 
-        receipt_pos='top'):
+        receipt_pos='top', perfil=False, streaming=False, cache=None):
          
         super(Danfe, self).__init__('P', 'mm', 'A4')     
         
@@ -289,6 +328,22 @@ class Danfe(xFPDF):
         #self.add_font('NimbusSanL', '', 'NimbusSanL.ttf', uni=True)
         self.logo_image = image
         self.receipt_pos = receipt_pos
+        self.cfg_layout = cfg_layout
+        
+        # streaming=True: lê as NF-e em fluxo (ver nfe.LeitorNFe), sem
+        # manter a árvore nem as descrições de todos os itens; aceita também
+        # arquivos binários abertos
+        self.streaming = streaming
+        
+        # cache: cache.CacheNFe com o modelo e a paginação de notas já
+        # impressas (não se aplica ao modo streaming)
+        self.cache = None if streaming else cache
+        
+        # perfil=True: tempo (s) de cada etapa por NF-e em self.perfis,
+        # um dict {'chave', 'itens', 'paginas', 'etapas'} por nota
+        self.perfil = perfil
+        self.perfis = []
+        self.etapas = None
                         
         if xmls is None:
             raise NameError('XML não informado!')
@@ -296,194 +351,247 @@ class Danfe(xFPDF):
         if not isinstance(xmls, list):
             xmls = [xmls]                
         
-        self.tasks = {'P': [lambda: self.recibo_p(),                
-                            lambda: self.emit_p(),
-                            lambda: self.dest_p(),
-                            lambda: self.fat_p(),
-                            lambda: self.impostos_p(),
-                            lambda: self.transp_p(),                            
-                            lambda: self.adic_p(),                            
+        self.tasks = {'P': [self.recibo_p,                
+                            self.emit_p,
+                            self.dest_p,
+                            self.fat_p,
+                            self.impostos_p,
+                            self.transp_p,                            
+                            self.adic_p,                            
                            ],
                             
-                      'L': [lambda: self.recibo_l(),
-                            lambda: self.emit_l(),
-                            lambda: self.dest_l(),
-                            lambda: self.fat_l(),
-                            lambda: self.impostos_l(),
-                            lambda: self.transp_l(),
-                            lambda: self.adic_l(),                                            
+                      'L': [self.recibo_l,
+                            self.emit_l,
+                            self.dest_l,
+                            self.fat_l,
+                            self.impostos_l,
+                            self.transp_l,
+                            self.adic_l,                                            
                            ]
                      } 
         
         for xml in xmls:
-                        
-            root = ET.fromstring(xml)
+            self.adicionar(xml)
+
+    def etapa(self, nome):
+        if self.etapas is None:
+            return SEM_PERFIL
+        return Etapa(self.etapas, nome)
+
+    def output(self, *args, **kwargs):
+        if not self.perfis:
+            return super(Danfe, self).output(*args, **kwargs)
+        # A serialização é do PDF inteiro; fica registrada na última nota
+        inicio = time.perf_counter()
+        try:
+            return super(Danfe, self).output(*args, **kwargs)
+        finally:
+            self.perfis[-1]['etapas']['output'] = (time.perf_counter() -
+                                                   inicio)
+
+    def adicionar(self, xml):
+        # Acrescenta as páginas de uma NF-e ao documento
+        if self.perfil:
+            self.etapas = {}
+            ultima = self.page
+        
+        registro = None
+        with self.etapa('parse'):
+            if self.streaming:
+                leitor = LeitorNFe(xml)
+                ide = leitor.ide()
+            elif self.cache is not None:
+                with conteudo_xml(xml) as dados:
+                    registro = self.cache.obter(dados)
+                    if registro.nfe is None:
+                        registro.nfe = ler_nfe(dados)
+                        registro.alterado = True
+                self.nfe = registro.nfe
+                ide = self.nfe.ide
+            else:
+                self.nfe = ler_nfe(xml)
+                ide = self.nfe.ide
+                                
+        # Buscando orientação de impressão do xml
+        tpImp = ide.tpImp            
+        if tpImp == '1':
+            orientation = 'P'
+            nr_lin_pg_1, nr_lin_pg = LINHAS_RETRATO
             
-            self.inf_nfe = root.find("%sinfNFe" % url)
-            self.prot_nfe = root.find("%sprotNFe" % url)
-            self.emit = root.find("%semit" % url)
-            self.ide = root.find("%side" % url)
-            self.dest = root.find("%sdest" % url)            
-            self.totais = root.find("%stotal" % url)
-            self.transp = root.find("%stransp" % url)
-            self.cobr = root.find("%scobr" % url) 
-            self.det = root.findall("%sdet" % url)
-            self.inf_adic = root.find("%sinfAdic" % url)
-                                    
-            # Buscando orientação de impressão do xml
-            tpImp = get_tag_text(node=self.ide, url=url, tag='tpImp')            
-            if tpImp == '1':
-                orientation = 'P'
-                nr_lin_pg_1 = 23
-                nr_lin_pg = 70
-                
-                if self.receipt_pos == 'top':
-                    self.lin_emit = 31
-                    self.lin_prod = 161
-                else:
-                    self.lin_emit = 10
-                    self.lin_prod = 140
-
-                self.lin_adic = self.lin_emit + 209.5
-                self.height_adic = 29
-                    
-                self.cols_produtos = cols_produtos_portable[cfg_layout]
-                  
-            else: 
-                orientation = 'L'
-                nr_lin_pg_1 = 6
-                nr_lin_pg = 45
+            if self.receipt_pos == 'top':
+                self.lin_emit = 31
+                self.lin_prod = 161
+            else:
                 self.lin_emit = 10
-                self.lin_prod = 134
-                self.cols_produtos = cols_produtos_landscape['ICMS_ST_IPI']
+                self.lin_prod = 140
+
+            self.lin_adic = self.lin_emit + 209.5
+            self.height_adic = 29
                 
-            self.add_page(orientation=orientation, format='A4')
+            self.cols_produtos = cols_produtos_portable[self.cfg_layout]
+              
+        else: 
+            orientation = 'L'
+            nr_lin_pg_1, nr_lin_pg = LINHAS_PAISAGEM
+            self.lin_emit = 10
+            self.lin_prod = 134
+            self.cols_produtos = cols_produtos_landscape['ICMS_ST_IPI']
             
-            # Calculando total linhas usadas para descrições dos itens
-            self.nr_pages = 1
-            self.current_page = 1
-                                                                   
-            #[ rec_ini , rec_fim , lines , limit_lines ]
-            paginator = [[0, 0, 0, nr_lin_pg_1]]
-
-            if self.det is not None:
-
-                list_desc = []
-                n_pg = 0                  
-                for id_ , item in enumerate(self.det):
-                    el_prod = item.find(
-                        ".//{http://www.portalfiscal.inf.br/nfe}prod")
-                    inf_add = item.find(
-                        ".//{http://www.portalfiscal.inf.br/nfe}infAdProd")
-                    
-                    # Width da coluna descrição produto                  
+        self.add_page(orientation=orientation, format='A4')
+        
+        # Calculando total linhas usadas para descrições dos itens
+        self.nr_pages = 1
+        self.current_page = 1
+                                                               
+        # Em fluxo, esta passada também lê o cabeçalho e as descrições
+        # são refeitas ao desenhar cada página
+        with self.etapa('paginacao'):
+            chave_pag = (self.cols_produtos[0][1], nr_lin_pg_1, nr_lin_pg)
+            salvo = registro.paginas.get(chave_pag) if registro else None
+            if salvo is not None:
+                paginator, list_desc = salvo
+                if list_desc:
+                    # Mesmo estado de fonte que linhas_desc deixaria
                     self.set_font('Times', '', 6)
-                    col_w = self.cols_produtos[0][1]                                                            
-                    list_ = self.multi_cell(w=col_w, h=3, txt=get_tag_text(
-                        node=el_prod, url=url, tag='xProd'), split_only=True)                  
-                                                             
-                    if inf_add is not None:
-                        list_.extend(self.multi_cell(w=col_w, h=3, 
-                            txt=inf_add.text, split_only=True))
-                        
-                    list_desc.append(list_)
-                    
-                    # Nr linhas necessárias p/ descrição item
-                    lin_itens = len(list_) 
-               
-                    if (paginator[n_pg][2] + lin_itens) > paginator[n_pg][3]:
-                        paginator.append([0, 0, 0, nr_lin_pg])
-                        n_pg += 1
-                        paginator[n_pg][0] = id_
-                        paginator[n_pg][1] = id_ +1
-                        paginator[n_pg][2] = lin_itens
-                    else:
-                        # adiciona-se 1 pelo funcionamento de xrange
-                        paginator[n_pg][1] = id_ +1  
-                        paginator[n_pg ][2] += lin_itens
-                  
-                self.nr_pages = len(paginator)   # Calculando nr. páginas
-                              
-                                            
-            dt, hr = getdateUTC(
-                get_tag_text(node=self.ide, url=url, tag='dhEmi'))
-                                             
-            total_nf = format_number(get_tag_text(
-                            node=self.totais, url=url, tag='vNF'), precision=2)
-                              
-            end = "%s - %s, %s, %s, %s - %s" % (
-                        get_tag_text(node=self.dest, url=url, tag='xNome'),
-                        get_tag_text(node=self.dest, url=url, tag='xLgr'),
-                        get_tag_text(node=self.dest, url=url, tag='nro'),
-                        get_tag_text(node=self.dest, url=url, tag='xBairro'),
-                        get_tag_text(node=self.dest, url=url, tag='xMun'),
-                        get_tag_text(node=self.dest, url=url, tag='UF')                
-                                            )
-
-            self.recibo_txt = ("RECEBEMOS DE %s OS PRODUTOS/SERVIÇOS "
-                               "CONSTANTES DA NOTA FISCAL INDICADA "
-                               "ABAIXO. EMISSÃO: %s VALOR TOTAL: %s " 
-                               "DESTINATARIO: %s" % (
-                                        get_tag_text(node=self.emit, 
-                                                     url=url, 
-                                                     tag='xNome'),           
-                                        dt, 
-                                        total_nf, 
-                                        end)
-                              )
-            
-            self.nr_nota = get_tag_text(node=self.ide, url=url, tag='nNF')
-            self.serie_nf = get_tag_text(node=self.ide, url=url, tag='serie')
-            self.tp_nf = get_tag_text(node=self.ide, url=url, tag='tpNF')            
-            self.key_nfe = self.inf_nfe.attrib.get('Id')[3:]
+            else:
+                paginator, list_desc = self.paginar(
+                    leitor.itens() if self.streaming else self.nfe.itens,
+                    nr_lin_pg_1, nr_lin_pg)
+                if registro is not None:
+                    registro.paginas[chave_pag] = (paginator, list_desc)
+                    registro.alterado = True
             
-            dt, hr = getdateUTC(get_tag_text(
-                node=self.prot_nfe, url=url, tag='dhRecbto'))             
+            self.nr_pages = len(paginator)   # Calculando nr. páginas
             
-            protocolo = get_tag_text(node=self.prot_nfe, url=url, tag='nProt')
-            self.prot_uso = '%s - %s %s' % (protocolo, dt, hr)     
-
-            self.current_page = 1
+            if self.streaming:
+                self.nfe = leitor.nfe
+                linhas = ((item, self.linhas_desc(item)) 
+                          for item in leitor.itens())
+            else:
+                linhas = zip(self.nfe.itens, list_desc)
             
-            #self.add_page(orientation=orientation, format='A4')
-            for task in self.tasks[orientation]:
+            if registro is not None and registro.alterado:
+                self.cache.gravar(registro)
+                          
+                                        
+        dt, hr = getdateUTC(self.nfe.ide.dhEmi)
+                                         
+        total_nf = format_number(self.nfe.totais.vNF, precision=2)
+                          
+        end = "%s - %s, %s, %s, %s - %s" % (
+                    self.nfe.dest.xNome,
+                    self.nfe.dest.xLgr,
+                    self.nfe.dest.nro,
+                    self.nfe.dest.xBairro,
+                    self.nfe.dest.xMun,
+                    self.nfe.dest.UF                
+                                        )
+
+        self.recibo_txt = ("RECEBEMOS DE %s OS PRODUTOS/SERVIÇOS "
+                           "CONSTANTES DA NOTA FISCAL INDICADA "
+                           "ABAIXO. EMISSÃO: %s VALOR TOTAL: %s " 
+                           "DESTINATARIO: %s" % (
+                                    self.nfe.emit.xNome,           
+                                    dt, 
+                                    total_nf, 
+                                    end)
+                          )
+        
+        self.nr_nota = self.nfe.ide.nNF
+        self.serie_nf = self.nfe.ide.serie
+        self.tp_nf = self.nfe.ide.tpNF            
+        self.key_nfe = self.nfe.chave
+        
+        dt, hr = getdateUTC(self.nfe.protocolo.dhRecbto)             
+        
+        protocolo = self.nfe.protocolo.nProt
+        self.prot_uso = '%s - %s %s' % (protocolo, dt, hr)     
+
+        self.current_page = 1
+        
+        #self.add_page(orientation=orientation, format='A4')
+        for task in self.tasks[orientation]:
+            with self.etapa(task.__name__):
                 task() 
-            
+        
+        with self.etapa('produtos'):
             if tpImp == '1':
-                self.produtos_p(paginator=paginator[0], list_desc=list_desc)
+                self.produtos_p(paginator=paginator[0], linhas=linhas)
             else:
-                self.produtos_l(paginator=paginator[0], list_desc=list_desc)
-            
-            # Gera o restante das páginas do XML
-            if paginator[1:]:
-                
-                self.lin_emit = 11
-                if tpImp == '1':
-                    self.lin_prod = self.lin_emit +49
-                else:
-                    self.lin_prod = self.lin_emit +42
+                self.produtos_l(paginator=paginator[0], linhas=linhas)
+        
+        # Gera o restante das páginas do XML
+        if paginator[1:]:
             
+            self.lin_emit = 11
+            if tpImp == '1':
+                self.lin_prod = self.lin_emit +49
+            else:
+                self.lin_prod = self.lin_emit +42
+        
+        with self.etapa('paginas_seguintes'):
             for pag in paginator[1:]:
                 self.current_page += 1
                 self.add_page(orientation=orientation, format='A4')                            
-                                                          
+                                                      
                 if tpImp == '1':                                        
                     self.emit_p()
-                    self.produtos_p(paginator=pag, list_desc=list_desc)
+                    self.produtos_p(paginator=pag, linhas=linhas)
                 else:
                     self.emit_l()
-                    self.produtos_l(paginator=pag, list_desc=list_desc)
-                
+                    self.produtos_l(paginator=pag, linhas=linhas)
+
+        if self.perfil:
+            self.perfis.append({'chave': self.key_nfe,
+                                'itens': paginator[-1].fim,
+                                'paginas': self.page - ultima,
+                                'etapas': self.etapas})
+            self.etapas = None
+
+    def paginar(self, itens, nr_lin_pg_1, nr_lin_pg):
+        # Distribui os itens pelas páginas conforme as linhas da descrição
+        # (paginacao.Pagina: inicio, fim, linhas, limite); em fluxo as
+        # descrições não são guardadas
+        if self.streaming:
+            list_desc = []
+            contagens = (len(self.linhas_desc(item)) for item in itens)
+        else:
+            list_desc = [self.linhas_desc(item) for item in itens]
+            contagens = map(len, list_desc)
+        return (paginacao.paginar(contagens, nr_lin_pg_1, nr_lin_pg),
+                list_desc)
+
+    def linhas_desc(self, item):
+        # Linhas da descrição do item na largura da coluna de produtos
+        return linhas_descricao(self, item, self.cols_produtos[0][1])
+            
     def recibo_p(self):
         
         if self.receipt_pos == 'top':
             lin = 10
+        else:
+            lin = self.lin_adic + self.height_adic +4
+        self.frame(self.moldura_recibo_p, self.receipt_pos, lin)
+        
+        self.set_font('Times', '', 5)
+        self.set_xy(x=10, y=lin)
+        self.multi_cell(w=150, h=3, txt=self.recibo_txt, border=0, 
+                        align='L', fill=False)                  
+        
+        self.set_font('Times', 'B', 8)
+        nf = '{0:011,}'.format(int(self.nr_nota)).replace( "," , "." )                     
+        self.text(x=163, y=lin +8, txt='Nº %s' % nf) 
+        self.text(x=163, y=lin +13, txt='SÉRIE %s' % self.serie_nf)
+        
+    def moldura_recibo_p(self, receipt_pos, lin):
+        # Parte fixa das seções: desenhada uma vez por posição (ver
+        # xFPDF.frame) e repetida em todas as páginas
+        if receipt_pos == 'top':
             self.dashed_line(10, lin +19, 200, lin +19, dash_length=0.5, 
                 space_length=1)
         else:
-            lin = self.lin_adic + self.height_adic +2
-            self.dashed_line(10, lin, 200, lin, dash_length=0.5, space_length=1)
-            lin += 2
+            self.dashed_line(10, lin -2, 200, lin -2, dash_length=0.5, 
+                space_length=1)
                                                                                             
         self.rect(x=10, y=lin, w=190, h=17, style='')
         self.line(10, lin +8.5, 160, lin +8.5)
@@ -491,65 +599,37 @@ class Danfe(xFPDF):
         self.line(54, lin +8.5, 54, lin +17)
         
         self.set_font('Times', '', 5)
-        self.set_xy(x=10, y=lin)
-        self.multi_cell(w=150, h=3, txt=self.recibo_txt, border=0, 
-                        align='L', fill=False)                  
-        
         self.text(x=11, y=lin +10.5, txt='DATA DE RECEBIMENTO')
         self.text(x=55, y=lin +10.5, 
             txt='IDENTIFICAÇÃO E ASSINATURA DO RECEBEDOR')
         self.text(x=178, y=lin +2, txt='NF-e')
         
-        self.set_font('Times', 'B', 8)
-        nf = '{0:011,}'.format(int(self.nr_nota)).replace( "," , "." )                     
-        self.text(x=163, y=lin +8, txt='Nº %s' % nf) 
-        self.text(x=163, y=lin +13, txt='SÉRIE %s' % self.serie_nf)
-        
     def emit_p(self):
         
-        self.rect(x=10, y=self.lin_emit, w=190, h=45, style='')
-        self.line(95, self.lin_emit, 95, self.lin_emit +31)
-        self.line(123, self.lin_emit, 123, self.lin_emit +38)
-        self.line(10, self.lin_emit +31, 200, self.lin_emit +31)
-        self.line(10, self.lin_emit +38, 200, self.lin_emit +38)
-        
-        self.line(70, self.lin_emit +38, 70, self.lin_emit +45)
-        self.line(110, self.lin_emit +38, 110, self.lin_emit +45)
+        self.frame(self.moldura_emit_p, self.lin_emit)
         
         if self.logo_image:
             self.image(self.logo_image, 11, self.lin_emit +1, 12, type='jpg')
 
         self.set_font('Times', 'B', 10)        
         self.set_xy(x=26, y=self.lin_emit +2)
-        text = get_tag_text(node=self.emit, url=url, tag='xNome')
+        text = self.nfe.emit.xNome
         self.multi_cell(w=70, h=5, txt=text, border=0, 
                         align='C', fill=False)                  
         
         self.set_font('Times', 'B', 7)
         self.set_xy(x=11, y=self.lin_emit +19)
         end = "%s, %s - %s - %s - %s - CEP: %s Fone: %s" % (                        
-                        get_tag_text(node=self.emit, url=url, tag='xLgr'),
-                        get_tag_text(node=self.emit, url=url, tag='nro'),
-                        get_tag_text(node=self.emit, url=url, tag='xBairro'),
-                        get_tag_text(node=self.emit, url=url, tag='xMun'),
-                        get_tag_text(node=self.emit, url=url, tag='UF'),
-                        get_tag_text(node=self.emit, url=url, tag='CEP'),
-                        get_tag_text(node=self.emit, url=url, tag='fone')
+                        self.nfe.emit.xLgr,
+                        self.nfe.emit.nro,
+                        self.nfe.emit.xBairro,
+                        self.nfe.emit.xMun,
+                        self.nfe.emit.UF,
+                        self.nfe.emit.CEP,
+                        self.nfe.emit.fone
                                             )
         
         self.multi_cell(w=83, h=4, txt=end, border=0, align='C', fill=False)                  
-        
-        self.set_font('Times', 'B', 12)
-        self.text(x=102, y=self.lin_emit +5, txt='DANFE')
-        
-        self.set_font('Times', '', 7)
-        self.text(x=96, y=self.lin_emit +9, txt='Documento Auxiliar da')
-        self.text(x=96, y=self.lin_emit +12, txt='Nota Fiscal Eletrônica')        
-        self.text(x=96, y=self.lin_emit +16, txt='0 - Entrada')
-        self.text(x=96, y=self.lin_emit +19, txt='1 - Saída')
-        self.rect(x=10, y=self.lin_emit, w=190, h=45, style='')
-        
-        self.rect(x=114, y=self.lin_emit +14, w=8, h=6, style='')
                 
         self.set_font('Times', 'B', 10)
         self.text(x=117, y=self.lin_emit +18, txt=self.tp_nf)
@@ -561,44 +641,23 @@ class Danfe(xFPDF):
         self.text(x=100, y=self.lin_emit +30, txt='Página %s de %s' % (
             self.current_page, self.nr_pages))
 
-        self.set_font('Times', '', 5)        
-        self.text(x=124, y=self.lin_emit +2.5, txt='CONTROLE DO FISCO')
-                
-        self.code128(self.key_nfe, 125, self.lin_emit +4, height=9, 
-            thickness=0.265, quiet_zone=True)
+        with self.etapa('codigo_barras'):
+            self.code128(self.key_nfe, 125, self.lin_emit +4, height=9, 
+                thickness=0.265, quiet_zone=True)
         
-        self.rect(x=124, y=self.lin_emit +15, w=75, h=6, style='')
-        self.text(x=125, y=self.lin_emit +17, txt='CHAVE DE ACESSO')
         self.set_font('Times', 'B', 7)
         self.text(x=131, y=self.lin_emit +20, 
             txt=' '.join(chunks(self.key_nfe, 4)))
-        
-        self.set_font('Times', '', 8)
-        self.set_xy(x=124, y=self.lin_emit +23)
-        text = ("Consulta de autenticidade no portal nacional da NF-e "
-                "www.nfe.fazenda.gov.br/portal ou no site da "
-                "Sefaz autorizadora")
-        self.multi_cell(w=75, h=3, txt=text, border=0, align='L', fill=False)                  
-                
-        self.set_font('Times', '', 5)        
-        self.text(x=11, y=self.lin_emit +33.1, txt='NATUREZA DA OPERAÇÃO')
-        self.text(x=11, y=self.lin_emit +40, txt='INSCRIÇÃO ESTADUAL')
-        self.text(x=71, y=self.lin_emit +40, 
-            txt='INSCRIÇÃO ESTADUAL DO SUBST. TRIB')
-        self.text(x=111, y=self.lin_emit +40, txt='CNPJ')
-
-        self.text(x=124, y=self.lin_emit +33.1, 
-            txt='PROTOCOLO DE AUTORIZAÇÃO DE USO')
                 
         self.set_font('Times', '', 8)
-        text = get_tag_text(node=self.ide, url=url, tag='natOp')                                                
+        text = self.nfe.ide.natOp                                                
         self.text(x=11, y=self.lin_emit +37, 
             txt=self.long_field(text=text, limit=112))
                        
         self.text(x=11, y=self.lin_emit +44, 
-            txt=get_tag_text(node=self.emit, url=url, tag='IE'))
+            txt=self.nfe.emit.IE)
         
-        text = get_tag_text(node=self.emit, url=url, tag='CNPJ')
+        text = self.nfe.emit.CNPJ
         self.text(x=111, y=self.lin_emit +44, txt=format_cpf_cnpj(text))
 
         self.set_font('Times', 'B', 7)
@@ -606,7 +665,7 @@ class Danfe(xFPDF):
         self.cell(77, 5, self.prot_uso, 0, 0, 'C') 
                 
         # Homologação
-        if get_tag_text(node=self.ide, url=url, tag='tpAmb') == '2':
+        if self.nfe.ide.tpAmb == '2':
             
             self.set_text_color(r=145, g=145, b=145)
             self.rotate(90, x=197, y=70)
@@ -616,134 +675,150 @@ class Danfe(xFPDF):
             self.rotate(0, x=197, y=70) 
             self.set_text_color(r=0, g=0, b=0)           
 
-    def dest_p(self):
-        lin = self.lin_emit + 49
-        self.set_font('Times', 'B', 7)        
-        self.text(x=11, y=lin -1, txt='DESTINATÁRIO/REMETENTE')
-        self.rect(x=10, y=lin, w=190, h=20, style='')
+    def moldura_emit_p(self, lin_emit):
         
-        self.line(10, lin +6.66, 200, lin +6.66)
-        self.line(10, lin +13.32, 200, lin +13.32)
-        self.line(123, lin, 123, lin +6.66)
-        self.line(169, lin, 169, lin +20)
-        self.line(97, lin +6.66, 97, lin +20) 
-        self.line(142, lin +6.66, 142, lin +13.32)
-        self.line(60, lin +13.32, 60, lin +20)
-        self.line(107, lin +13.32, 107, lin +20)
+        self.rect(x=10, y=lin_emit, w=190, h=45, style='')
+        self.line(95, lin_emit, 95, lin_emit +31)
+        self.line(123, lin_emit, 123, lin_emit +38)
+        self.line(10, lin_emit +31, 200, lin_emit +31)
+        self.line(10, lin_emit +38, 200, lin_emit +38)
+        
+        self.line(70, lin_emit +38, 70, lin_emit +45)
+        self.line(110, lin_emit +38, 110, lin_emit +45)
+        
+        self.set_font('Times', 'B', 12)
+        self.text(x=102, y=lin_emit +5, txt='DANFE')
         
+        self.set_font('Times', '', 7)
+        self.text(x=96, y=lin_emit +9, txt='Documento Auxiliar da')
+        self.text(x=96, y=lin_emit +12, txt='Nota Fiscal Eletrônica')        
+        self.text(x=96, y=lin_emit +16, txt='0 - Entrada')
+        self.text(x=96, y=lin_emit +19, txt='1 - Saída')
+        self.rect(x=10, y=lin_emit, w=190, h=45, style='')
+        
+        self.rect(x=114, y=lin_emit +14, w=8, h=6, style='')
+                
         self.set_font('Times', '', 5)        
-        self.text(x=11, y=lin +2, txt='NOME/RAZÃO SOCIAL')
-        self.text(x=124, y=lin +2, txt='CNPJ/CPF')
-        self.text(x=170, y=lin +2, txt='DATA DA EMISSÃO')
+        self.text(x=124, y=lin_emit +2.5, txt='CONTROLE DO FISCO')
         
-        self.text(x=11, y=lin +8.66, txt='ENDEREÇO')
-        self.text(x=98, y=lin +8.66, txt='BAIRRO/DISTRITO')
-        self.text(x=143, y=lin +8.66, txt='CEP')
-        self.text(x=170, y=lin +8.66, txt='DATA DA ENTRADA/SAÍDA')
+        self.rect(x=124, y=lin_emit +15, w=75, h=6, style='')
+        self.text(x=125, y=lin_emit +17, txt='CHAVE DE ACESSO')
         
-        self.text(x=11, y=lin +15.32, txt='MUNICÍPIO')
-        self.text(x=61, y=lin +15.32, txt='FONE/FAX')
-        self.text(x=98, y=lin +15.32, txt='UF')
-        self.text(x=108, y=lin +15.32, txt='INSCRIÇÃO ESTADUAL')
-        self.text(x=170, y=lin +15.32, txt='HORA DE ENTRADA/SAÍDA')
+        self.set_font('Times', '', 8)
+        self.set_xy(x=124, y=lin_emit +23)
+        text = ("Consulta de autenticidade no portal nacional da NF-e "
+                "www.nfe.fazenda.gov.br/portal ou no site da "
+                "Sefaz autorizadora")
+        self.multi_cell(w=75, h=3, txt=text, border=0, align='L', fill=False)                  
+                
+        self.set_font('Times', '', 5)        
+        self.text(x=11, y=lin_emit +33.1, txt='NATUREZA DA OPERAÇÃO')
+        self.text(x=11, y=lin_emit +40, txt='INSCRIÇÃO ESTADUAL')
+        self.text(x=71, y=lin_emit +40, 
+            txt='INSCRIÇÃO ESTADUAL DO SUBST. TRIB')
+        self.text(x=111, y=lin_emit +40, txt='CNPJ')
+
+        self.text(x=124, y=lin_emit +33.1, 
+            txt='PROTOCOLO DE AUTORIZAÇÃO DE USO')
+
+    def dest_p(self):
+        lin = self.lin_emit + 49
+        self.frame(self.moldura_dest_p, lin)
 
         self.set_font('Times', '', 8)
         
         # Homologação
-        if get_tag_text(node=self.ide, url=url, tag='tpAmb') == '1':
-            txt = get_tag_text(node=self.dest, url=url, tag='xNome')
+        if self.nfe.ide.tpAmb == '1':
+            txt = self.nfe.dest.xNome
         else:
             txt = "NF-E EMITIDA EM AMBIENTE DE HOMOLOGACAO - SEM VALOR FISCAL"
                 
         self.text(x=11, y=lin +5.7, txt=self.long_field(text=txt, limit=110))
         
-        txt = get_tag_text(node=self.dest, url=url, tag='CNPJ')
+        txt = self.nfe.dest.CNPJ
         if not txt:
-            txt = get_tag_text(node=self.dest, url=url, tag='CPF')            
+            txt = self.nfe.dest.CPF            
         self.text(x=124, y=lin +5.7, txt=format_cpf_cnpj(txt))
         
-        dt, h = getdateUTC(get_tag_text(node=self.ide, url=url, tag='dhEmi'))
+        dt, h = getdateUTC(self.nfe.ide.dhEmi)
         self.text(x=170, y=lin +5.7, txt=dt)
         
-        end = '%s, %s' % (get_tag_text(node=self.dest, url=url, tag='xLgr'),
-                          get_tag_text(node=self.dest, url=url, tag='nro'))         
+        end = '%s, %s' % (self.nfe.dest.xLgr,
+                          self.nfe.dest.nro)         
         self.text(x=11, y=lin +12.4, txt=self.long_field(text=end, limit=86))
         
-        txt = get_tag_text(node=self.dest, url=url, tag='xBairro')
+        txt = self.nfe.dest.xBairro
         self.text(x=98, y=lin +12.4, txt=self.long_field(text=txt, limit=44))
 
         self.text(x=143, y=lin +12.4, 
-            txt=get_tag_text(node=self.dest, url=url, tag='CEP'))
+            txt=self.nfe.dest.CEP)
         
-        dt, h = getdateUTC(get_tag_text(node=self.ide, url=url, tag='dhSaiEnt'))
+        dt, h = getdateUTC(self.nfe.ide.dhSaiEnt)
         self.text(x=170, y=lin +12.4, txt=dt)
         
-        txt = get_tag_text(node=self.dest, url=url, tag='xMun')
+        txt = self.nfe.dest.xMun
         self.text(x=11, y=lin +19.1, txt=self.long_field(text=txt, limit=50))
 
         self.text(x=61, y=lin +19.1, 
-            txt=get_tag_text(node=self.dest, url=url, tag='fone'))
+            txt=self.nfe.dest.fone)
                                          
         self.text(x=98, y=lin +19.1, 
-            txt=get_tag_text(node=self.dest, url=url, tag='UF'))
+            txt=self.nfe.dest.UF)
         
         self.text(x=108, y=lin +19.1, 
-            txt=get_tag_text(node=self.dest, url=url, tag='IE'))
+            txt=self.nfe.dest.IE)
+        
+    def moldura_dest_p(self, lin):
+        self.set_font('Times', 'B', 7)        
+        self.text(x=11, y=lin -1, txt='DESTINATÁRIO/REMETENTE')
+        self.rect(x=10, y=lin, w=190, h=20, style='')
+        
+        self.line(10, lin +6.66, 200, lin +6.66)
+        self.line(10, lin +13.32, 200, lin +13.32)
+        self.line(123, lin, 123, lin +6.66)
+        self.line(169, lin, 169, lin +20)
+        self.line(97, lin +6.66, 97, lin +20) 
+        self.line(142, lin +6.66, 142, lin +13.32)
+        self.line(60, lin +13.32, 60, lin +20)
+        self.line(107, lin +13.32, 107, lin +20)
+        
+        self.set_font('Times', '', 5)        
+        self.text(x=11, y=lin +2, txt='NOME/RAZÃO SOCIAL')
+        self.text(x=124, y=lin +2, txt='CNPJ/CPF')
+        self.text(x=170, y=lin +2, txt='DATA DA EMISSÃO')
+        
+        self.text(x=11, y=lin +8.66, txt='ENDEREÇO')
+        self.text(x=98, y=lin +8.66, txt='BAIRRO/DISTRITO')
+        self.text(x=143, y=lin +8.66, txt='CEP')
+        self.text(x=170, y=lin +8.66, txt='DATA DA ENTRADA/SAÍDA')
+        
+        self.text(x=11, y=lin +15.32, txt='MUNICÍPIO')
+        self.text(x=61, y=lin +15.32, txt='FONE/FAX')
+        self.text(x=98, y=lin +15.32, txt='UF')
+        self.text(x=108, y=lin +15.32, txt='INSCRIÇÃO ESTADUAL')
+        self.text(x=170, y=lin +15.32, txt='HORA DE ENTRADA/SAÍDA')
         
     def fat_p(self):    
                 
         lin = self.lin_emit +73
-        self.set_font('Times', 'B', 7)
-        self.text(x=11, y=lin -1, txt='FATURA')
-        self.rect(x=10, y=lin, w=190, h=13, style='')
-        self.line(57.5, lin, 57.5, lin +13)
-        self.line(105, lin, 105, lin +13)
-        self.line(152.5, lin, 152.5, lin +13)
-        self.line(152.5, lin +6.5, 200, lin +6.5)
+        self.frame(self.moldura_fat_p, lin)
                                 
-        if self.inf_adic is not None:
+        if self.nfe.adic is not None:
             self.set_font('Times', '', 8)
-            codvend = self.inf_adic.find(".//{http://www.portalfiscal.inf.br/"
-                "nfe}obsCont[@xCampo='CodVendedor']")      
-            
-            self.text(x=153.5, y=lin +5.7, 
-                txt=get_tag_text(node=codvend, url=url, tag='xTexto'))
+            self.text(x=153.5, y=lin +5.7, txt=self.nfe.adic.CodVendedor)
                   
-            vend = self.inf_adic.find(".//{http://www.portalfiscal.inf.br/nfe}"
-                "obsCont[@xCampo='NomeVendedor']")
-
-            txt = get_tag_text(node=vend, url=url, tag='xTexto')
+            txt = self.nfe.adic.NomeVendedor
             self.text(x=153.5, y=lin +12.24, 
                 txt=self.long_field(text=txt, limit=47))
-                                               
-        self.set_font('Times', '', 5)
-        self.text(x=153.5, y=lin +2, txt='CÓDIGO VENDEDOR')
-        self.text(x=153.5, y=lin +8.5, txt='NOME VENDEDOR')
-
-        self.set_xy(x=10, y=lin +0.5)        
-        self.cell(14.5, 2.5, 'FATURA', 0, 0, 'L')
-        self.cell(15, 2.5, 'VENCIMENTO', 0, 0, 'C')
-        self.cell(18, 2.5, 'VALOR', 0, 0, 'R')
-        self.cell(14.5, 2.5, 'FATURA', 0, 0, 'L')
-        self.cell(15, 2.5, 'VENCIMENTO', 0, 0, 'C')
-        self.cell(18, 2.5, 'VALOR', 0, 0, 'R')
-        self.cell(14.5, 2.5, 'FATURA', 0, 0, 'L')
-        self.cell(15, 2.5, 'VENCIMENTO', 0, 0, 'C')
-        self.cell(18, 2.5, 'VALOR', 0, 0, 'R')
-        
-        # Salta elemt 1 (tag fat) e considera os próximos 9 (tags dup)    
+        
         self.set_font('Times', '', 7)
-        cobr_iter = iter(self.cobr[1:10]) if self.cobr is not None else [] 
         n_dup_ = 1
         col_ = 10            
         self.set_xy(x=col_ , y=lin +3)
-        for i, dup in enumerate(cobr_iter):
-         
-            dt, hr = getdateUTC(
-                get_tag_text(node=dup, url=url, tag='dVenc'))
-            n_dup = get_tag_text(node=dup, url=url, tag='nDup')
-            vlr = format_number(
-                    get_tag_text(node=dup, url=url, tag='vDup'), precision=2)
+        for dup in self.nfe.cobr:
+            dt, hr = getdateUTC(dup.dVenc)
+            n_dup = dup.nDup
+            vlr = format_number(dup.vDup, precision=2)
                 
             self.cell(14.5, 4, n_dup, 0, 0, 'L')
             self.cell(15, 4, dt, 0, 0, 'C')
@@ -759,8 +834,47 @@ class Danfe(xFPDF):
                 
             self.set_x(x=col_)
                                                 
+    def moldura_fat_p(self, lin):
+        self.set_font('Times', 'B', 7)
+        self.text(x=11, y=lin -1, txt='FATURA')
+        self.rect(x=10, y=lin, w=190, h=13, style='')
+        self.line(57.5, lin, 57.5, lin +13)
+        self.line(105, lin, 105, lin +13)
+        self.line(152.5, lin, 152.5, lin +13)
+        self.line(152.5, lin +6.5, 200, lin +6.5)
+                                               
+        self.set_font('Times', '', 5)
+        self.text(x=153.5, y=lin +2, txt='CÓDIGO VENDEDOR')
+        self.text(x=153.5, y=lin +8.5, txt='NOME VENDEDOR')
+
+        self.set_xy(x=10, y=lin +0.5)        
+        for _ in range(3):
+            self.cell(14.5, 2.5, 'FATURA', 0, 0, 'L')
+            self.cell(15, 2.5, 'VENCIMENTO', 0, 0, 'C')
+            self.cell(18, 2.5, 'VALOR', 0, 0, 'R')
+                                                
     def impostos_p(self):    
         lin = self.lin_emit +90
+        self.frame(self.moldura_impostos_p, lin)
+        
+        self.set_font('Times', '', 8)
+        self.set_xy(x=11, y=lin +2.7)        
+        self.cell(37, 4, format_number(self.nfe.totais.vBC, precision=2), 0, 0, 'R')
+        self.cell(38, 4, format_number(self.nfe.totais.vICMS, precision=2), 0, 0, 'R')
+        self.cell(38, 4, format_number(self.nfe.totais.vBCST, precision=2), 0, 0, 'R')
+        self.cell(38, 4, format_number(self.nfe.totais.vST, precision=2), 0, 0, 'R')
+        self.cell(38, 4, format_number(self.nfe.totais.vProd, precision=2), 0, 0, 'R')
+        
+        self.set_xy(x=11, y=lin +9.2)        
+        self.cell(21, 4, format_number(self.nfe.totais.vFrete, precision=2), 0, 0, 'R')
+        self.cell(22, 4, format_number(self.nfe.totais.vSeg, precision=2), 0, 0, 'R')
+        self.cell(22, 4, format_number(self.nfe.totais.vDesc, precision=2), 0, 0, 'R')
+        self.cell(27, 4, format_number(self.nfe.totais.vOutro, precision=2), 0, 0, 'R')
+        self.cell(27, 4, format_number(self.nfe.totais.vIPI, precision=2), 0, 0, 'R')
+        self.cell(32, 4, format_number(self.nfe.totais.vTotTrib, precision=2), 0, 0, 'R')
+        self.cell(38, 4, format_number(self.nfe.totais.vNF, precision=2), 0, 0, 'R')
+    
+    def moldura_impostos_p(self, lin):
         self.set_font('Times', 'B', 7)
         self.text(x=11, y=lin -1, txt='CÁLCULO DO IMPOSTO')
         self.rect(x=10, y=lin, w=190, h=13, style='')
@@ -790,38 +904,54 @@ class Danfe(xFPDF):
         self.text(x=104, y=lin +8.5, txt='VALOR DO IPI')
         self.text(x=131, y=lin +8.5, txt='VALOR APROX. TRIBUTOS')
         self.text(x=163, y=lin +8.5, txt='VALOR TOTAL DA NOTA')
+    
+    def transp_p(self):
+        lin = self.lin_emit +107
+        self.frame(self.moldura_transp_p, lin)
         
         self.set_font('Times', '', 8)
-        self.set_xy(x=11, y=lin +2.7)        
-        self.cell(37, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vBC'), precision=2), 0, 0, 'R')
-        self.cell(38, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vICMS'), precision=2), 0, 0, 'R')
-        self.cell(38, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vBCST'), precision=2), 0, 0, 'R')
-        self.cell(38, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vST'), precision=2), 0, 0, 'R')
-        self.cell(38, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vProd'), precision=2), 0, 0, 'R')
+        text = self.nfe.transp.xNome                                                
+        self.text(x=11, y=lin +5.7, 
+            txt=self.long_field(text=text, limit=69))
         
-        self.set_xy(x=11, y=lin +9.2)        
-        self.cell(21, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vFrete'), precision=2), 0, 0, 'R')
-        self.cell(22, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vSeg'), precision=2), 0, 0, 'R')
-        self.cell(22, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vDesc'), precision=2), 0, 0, 'R')
-        self.cell(27, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vOutro'), precision=2), 0, 0, 'R')
-        self.cell(27, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vIPI'), precision=2), 0, 0, 'R')
-        self.cell(32, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vTotTrib'), precision=2), 0, 0, 'R')
-        self.cell(38, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vNF'), precision=2), 0, 0, 'R')
+        self.text(x=81, y=lin +5.7, txt=tp_frete[self.nfe.transp.modFrete])
+
+        text = self.nfe.transp.CNPJ
+        self.text(x=158, y=lin +5.7, txt=format_cpf_cnpj(text))
+
+        text = self.nfe.transp.xEnder                                                
+        self.text(x=11, y=lin +12.03, 
+            txt=self.long_field(text=text, limit=86))
+
+        text = self.nfe.transp.xMun                                                
+        self.text(x=98, y=lin +12.03, 
+            txt=self.long_field(text=text, limit=51))
+
+        self.text(x=148, y=lin +12.03, 
+            txt=self.nfe.transp.UF)
+
+        self.text(x=157, y=lin +12.03, 
+            txt=self.nfe.transp.IE)
+
+        self.text(x=11, y=lin +18.36, 
+            txt=self.nfe.transp.qVol)
+
+        self.text(x=37, y=lin +18.36, 
+            txt=self.nfe.transp.esp)
+
+        self.text(x=74, y=lin +18.36, 
+            txt=self.nfe.transp.marca)
+
+        self.text(x=112, y=lin +18.36, 
+            txt=self.nfe.transp.nVol)
+        
+        self.set_xy(x=147, y=lin +16)
+        self.cell(26, 3, format_number(self.nfe.transp.pesoB, precision=3), 0, 0, 'R')
+
+        self.cell(27, 3, format_number(self.nfe.transp.pesoL, precision=3), 0, 0, 'R')
+            
     
-    def transp_p(self):
-        lin = self.lin_emit +107
+    def moldura_transp_p(self, lin):
         self.set_font('Times', 'B', 7)
         self.text(x=11, y=lin -1, txt='TRANSPORTADOR/VOLUMES TRANSPORTADOS')
         self.rect(x=10, y=lin, w=190, h=19, style='')
@@ -857,111 +987,34 @@ class Danfe(xFPDF):
         self.text(x=112, y=lin +14.66, txt='NUMERAÇÃO')
         self.text(x=148, y=lin +14.66, txt='PESO BRUTO')
         self.text(x=174, y=lin +14.66, txt='PESO LÍQUIDO')
-        
-        self.set_font('Times', '', 8)
-        text = get_tag_text(node=self.transp, url=url, tag='xNome')                                                
-        self.text(x=11, y=lin +5.7, 
-            txt=self.long_field(text=text, limit=69))
-        
-        self.text(x=81, y=lin +5.7, txt=tp_frete[get_tag_text(
-            node=self.transp, url=url, tag='modFrete')])
-
-        text = get_tag_text(node=self.transp, url=url, tag='CNPJ')
-        self.text(x=158, y=lin +5.7, txt=format_cpf_cnpj(text))
-
-        text = get_tag_text(node=self.transp, url=url, tag='xEnder')                                                
-        self.text(x=11, y=lin +12.03, 
-            txt=self.long_field(text=text, limit=86))
-
-        text = get_tag_text(node=self.transp, url=url, tag='xMun')                                                
-        self.text(x=98, y=lin +12.03, 
-            txt=self.long_field(text=text, limit=51))
-
-        self.text(x=148, y=lin +12.03, 
-            txt=get_tag_text(node=self.transp, url=url, tag='UF'))
-
-        self.text(x=157, y=lin +12.03, 
-            txt=get_tag_text(node=self.transp, url=url, tag='IE'))
-
-        self.text(x=11, y=lin +18.36, 
-            txt=get_tag_text(node=self.transp, url=url, tag='qVol'))
-
-        self.text(x=37, y=lin +18.36, 
-            txt=get_tag_text(node=self.transp, url=url, tag='esp'))
-
-        self.text(x=74, y=lin +18.36, 
-            txt=get_tag_text(node=self.transp, url=url, tag='marca'))
-
-        self.text(x=112, y=lin +18.36, 
-            txt=get_tag_text(node=self.transp, url=url, tag='nVol'))
-        
-        self.set_xy(x=147, y=lin +16)
-        self.cell(26, 3, format_number(get_tag_text(
-            node=self.transp, url=url, tag='pesoB'), precision=3), 0, 0, 'R')
-
-        self.cell(27, 3, format_number(get_tag_text(
-            node=self.transp, url=url, tag='pesoL'), precision=3), 0, 0, 'R')
             
-    
-    def produtos_p(self, paginator=None, list_desc=None):
-        h_produtos = (paginator[2] * 3) +6.5
-        self.set_font('Times', 'B', 7)
-        self.text(x=11, y=self.lin_prod -1, txt='DADOS DO PRODUTO/SERVIÇO')
+    def produtos_p(self, paginator=None, linhas=None):
+        # linhas: iterador de (item, linhas da descrição), consumido aqui
+        # apenas nos itens desta página
+        h_produtos = (paginator.linhas * 3) +6.5
+        self.frame(self.moldura_produtos_p, self.lin_prod, self.cfg_layout)
         self.rect(x=10, y=self.lin_prod, w=190, h=h_produtos, style='')
                                                  
         cols = self.cols_produtos[0]
-        captions = self.cols_produtos[1]
-        cells = self.cols_produtos[2]
+        linha = self.cols_produtos[2]
         
-        # Colunas            
-        self.set_font('Times', 'B', 5)        
-        self.line(10, self.lin_prod +6, 200, self.lin_prod +6)
+        # Colunas (a altura depende dos itens da página)
         col_ = 10 # 10 mm margem
-        self.set_xy(x=10, y=self.lin_prod +1)
-        for id, col in enumerate(cols):
+        for col in cols:
             col_ += col            
             self.line(col_, self.lin_prod, col_, self.lin_prod + h_produtos)
-            
-            lbl = captions[id].split('\n')                              
-            if len(lbl) == 1:
-                self.cell(col, 4, captions[id], 0, 0, 'C')
-            else:
-                current_col = self.get_x()               
-                current_lin = self.get_y()
-                             
-                self.multi_cell(w=col, h=2, txt=captions[id], 
-                    border=0, align='C', fill=False)
-                
-                self.set_xy(current_col + col, current_lin)                   
         
         # Dados dos produtos        
         self.set_font('Times', '', 6)        
         self.set_xy(x=10, y=self.lin_prod + 6.5)        
         #self.set_fill_color(235, 235, 235)
                 
-        for id in range(paginator[0], paginator[1]):
-            
-            item = self.det[id] 
-            el_prod = item.find(".//{http://www.portalfiscal.inf.br/"
-                "nfe}prod")
-            el_imp  = item.find(".//{http://www.portalfiscal.inf.br/nfe}"
-                "imposto")
-         
-            el_imp_ICMS = el_imp.find(".//{http://www.portalfiscal.inf.br/"
-                "nfe}ICMS")
-
-            el_imp_IPI  = el_imp.find(".//{http://www.portalfiscal.inf.br/"
-                "nfe}IPI")
+        for item, desc in itertools.islice(linhas, 
+                                           paginator.fim - paginator.inicio):
                             
-            for id_col, col in enumerate(cols):
-                cells[id_col](report=self,
-                              node_item=el_prod, 
-                              node_icms=el_imp_ICMS, 
-                              node_ipi=el_imp_IPI,                               
-                              width=col,                              
-                              desc_item=list_desc[id])
+            linha(self, item, desc)
                                         
-            self.ln(3 * len(list_desc[id]))            
+            self.ln(3 * len(desc))            
             
             if self.get_y() < (self.lin_prod + h_produtos): # id % 2:                                
                 self.set_line_width(width=0.1)
@@ -972,33 +1025,55 @@ class Danfe(xFPDF):
                 self.set_line_width(width=0.2)
                 #self.set_draw_color(r=0, g=0, b=0)       
                                         
+    def moldura_produtos_p(self, lin_prod, cfg_layout):
+        self.set_font('Times', 'B', 7)
+        self.text(x=11, y=lin_prod -1, txt='DADOS DO PRODUTO/SERVIÇO')
+        self.cabecalho_colunas(cols_produtos_portable[cfg_layout], 10, 200, 
+                           lin_prod)
+        
+    def cabecalho_colunas(self, layout, margem, fim, lin_prod):
+        # Cabeçalhos das colunas de produtos
+        cols, captions = layout[0], layout[1]
+        self.set_font('Times', 'B', 5)        
+        self.line(margem, lin_prod +6, fim, lin_prod +6)
+        self.set_xy(x=margem, y=lin_prod +1)
+        for id, col in enumerate(cols):
+            lbl = captions[id].split('\n')                              
+            if len(lbl) == 1:
+                self.cell(col, 4, captions[id], 0, 0, 'C')
+            else:
+                current_col = self.get_x()               
+                current_lin = self.get_y()
+                             
+                self.multi_cell(w=col, h=2, txt=captions[id], 
+                    border=0, align='C', fill=False)
+                
+                self.set_xy(current_col + col, current_lin)                   
+                                        
     def desc_item(self, list_desc=None, width=None):
 
         col = self.get_x()               
         lin = self.get_y()
 
-        self.cell(width, 3, list_desc[0], 0, 0, 'L')
+        self.text_cell(width, 3, list_desc[0], 'L')
         self.ln(3)
                                 
         for desc in list_desc[1:]:
             self.set_x(x=col)
-            self.cell(width, 3, desc, 0, 0, 'L')            
+            self.text_cell(width, 3, desc, 'L')            
             self.ln(3)
                         
         self.set_xy(col +width, lin) 
         
     def adic_p(self):
         lin = self.lin_adic
-        self.set_font('Times', 'B', 7)
-        self.text(x=11, y=lin -1, txt='DADOS ADICIONAIS')
-        self.set_font('Times', '', 5)
-        self.text(x=11, y=lin +2.5, txt='INFORMAÇÕES COMPLEMENTARES')
-        self.text(x=106, y=lin +2.5, txt='RESERVADO AO FISCO')
-        self.rect(x=10, y=lin, w=190, h=self.height_adic, style='')
-        self.line(105, lin, 105, lin +29)
+        self.frame(self.moldura_adic_p, lin, self.height_adic)
 
-        fisco = get_tag_text(node=self.inf_adic, url=url, tag='infAdFisco')    
-        obs = get_tag_text(node=self.inf_adic, url=url, tag='infCpl') 
+        if self.nfe.adic is not None:
+            fisco = self.nfe.adic.infAdFisco
+            obs = self.nfe.adic.infCpl
+        else:
+            fisco = obs = ''
         if fisco:
             obs = "%s %s" %(fisco, obs)
                         
@@ -1009,15 +1084,19 @@ class Danfe(xFPDF):
             self.multi_cell(w=93, h=3, txt=self.long_field(text=obs, 
                 limit=txt_width), border=0, align='L', fill=False)                  
 
+    def moldura_adic_p(self, lin, height_adic):
+        self.set_font('Times', 'B', 7)
+        self.text(x=11, y=lin -1, txt='DADOS ADICIONAIS')
+        self.set_font('Times', '', 5)
+        self.text(x=11, y=lin +2.5, txt='INFORMAÇÕES COMPLEMENTARES')
+        self.text(x=106, y=lin +2.5, txt='RESERVADO AO FISCO')
+        self.rect(x=10, y=lin, w=190, h=height_adic, style='')
+        self.line(105, lin, 105, lin +29)
     
     # Layout paisagem
     def recibo_l(self):
         
-        self.rect(x=16, y=10, w=17, h=190, style='')
-        self.line(24.5, 10, 24.5, 160)
-        self.line(16, 160, 33, 160)
-        self.line(16, 54, 24.5, 54)
-        self.dashed_line(34.5, 10, 34.5, 200, dash_length=0.5, space_length=1)
+        self.frame(self.moldura_recibo_l)
          
         self.rotate(-90, x=33, y=10)
         
@@ -1026,9 +1105,6 @@ class Danfe(xFPDF):
         
         self.multi_cell(w=150, h=3, txt=self.recibo_txt, border=0, 
                        align='L', fill=False)                  
-        self.text(x=34, y=20.5, txt='DATA DE RECEBIMENTO')
-        self.text(x=79, y=20.5, txt='IDENTIFICAÇÃO E ASSINATURA DO RECEBEDOR')
-        self.text(x=201, y=12, txt='NF-e')
         self.set_font('Times', 'B', 8)
         
         nf = '{0:011,}'.format(int(self.nr_nota)).replace( "," , "." )                     
@@ -1037,47 +1113,49 @@ class Danfe(xFPDF):
         
         self.rotate(0, x=33, y=10) 
     
+    def moldura_recibo_l(self):
+        
+        self.rect(x=16, y=10, w=17, h=190, style='')
+        self.line(24.5, 10, 24.5, 160)
+        self.line(16, 160, 33, 160)
+        self.line(16, 54, 24.5, 54)
+        self.dashed_line(34.5, 10, 34.5, 200, dash_length=0.5, space_length=1)
+         
+        self.rotate(-90, x=33, y=10)
+        
+        self.set_font('Times', 'B', 5)        
+        self.text(x=34, y=20.5, txt='DATA DE RECEBIMENTO')
+        self.text(x=79, y=20.5, txt='IDENTIFICAÇÃO E ASSINATURA DO RECEBEDOR')
+        self.text(x=201, y=12, txt='NF-e')
+        
+        self.rotate(0, x=33, y=10) 
+    
     def emit_l(self):
         
-        self.rect(x=36, y=self.lin_emit, w=248, h=38, style='')                        
-        self.line(146, self.lin_emit, 146, self.lin_emit +38)        
-        self.line(184, self.lin_emit, 184, self.lin_emit +38)        
-        self.line(36, self.lin_emit +24, 146, self.lin_emit +24)
-        self.line(36, self.lin_emit +31, 284, self.lin_emit +31)
-        self.line(86, self.lin_emit +31, 86, self.lin_emit +38)
+        self.frame(self.moldura_emit_l, self.lin_emit)
         
         if self.logo_image:
             self.image(self.logo_image, 37, self.lin_emit +2, 15, type='jpg')
                 
         self.set_font('Times', 'B', 10)        
         self.set_xy(x=55, y=self.lin_emit +2)
-        text = get_tag_text(node=self.emit, url=url, tag='xNome')
+        text = self.nfe.emit.xNome
         self.multi_cell(w=90, h=5, txt=text, border=0, 
                         align='C', fill=False)                  
                 
         self.set_font('Times', 'B', 7)
         self.set_xy(x=55, y=self.lin_emit +15)
         end = "%s, %s - %s - %s - %s - CEP: %s Fone: %s" % (                        
-                        get_tag_text(node=self.emit, url=url, tag='xLgr'),
-                        get_tag_text(node=self.emit, url=url, tag='nro'),
-                        get_tag_text(node=self.emit, url=url, tag='xBairro'),
-                        get_tag_text(node=self.emit, url=url, tag='xMun'),
-                        get_tag_text(node=self.emit, url=url, tag='UF'),
-                        get_tag_text(node=self.emit, url=url, tag='CEP'),
-                        get_tag_text(node=self.emit, url=url, tag='fone')
+                        self.nfe.emit.xLgr,
+                        self.nfe.emit.nro,
+                        self.nfe.emit.xBairro,
+                        self.nfe.emit.xMun,
+                        self.nfe.emit.UF,
+                        self.nfe.emit.CEP,
+                        self.nfe.emit.fone
                                             )
         
         self.multi_cell(w=90, h=4, txt=end, border=0, align='C', fill=False)                  
-               
-        self.set_font('Times', 'B', 12)
-        self.text(x=158, y=self.lin_emit +5, txt='DANFE')
-        
-        self.set_font('Times', '', 7)
-        self.text(x=152, y=self.lin_emit +9, txt='Documento Auxiliar da')
-        self.text(x=152, y=self.lin_emit +12, txt='Nota Fiscal Eletrônica')        
-        self.text(x=152, y=self.lin_emit +16, txt='0 - Entrada')
-        self.text(x=152, y=self.lin_emit +19, txt='1 - Saída')        
-        self.rect(x=170, y=self.lin_emit +14, w=8, h=6, style='')
                 
         self.set_font('Times', 'B', 10)
         self.text(x=173, y=self.lin_emit +18, txt=self.tp_nf)
@@ -1088,45 +1166,24 @@ class Danfe(xFPDF):
         self.text(x=152, y=self.lin_emit +27, txt='SÉRIE %s' % self.serie_nf)
         self.text(x=156, y=self.lin_emit +30, txt='Página %s de %s' % (
             self.current_page, self.nr_pages))
-        
-        self.set_font('Times', '', 5)        
-        self.text(x=185, y=self.lin_emit +2.5, txt='CONTROLE DO FISCO')
                 
-        self.code128(self.key_nfe, 197.1, self.lin_emit +4, height=9, 
-            thickness=0.265, quiet_zone=True)
+        with self.etapa('codigo_barras'):
+            self.code128(self.key_nfe, 197.1, self.lin_emit +4, height=9, 
+                thickness=0.265, quiet_zone=True)
         
-        self.rect(x=185, y=self.lin_emit +15, w=98, h=6, style='')
-        self.text(x=186, y=self.lin_emit +17.2, txt='CHAVE DE ACESSO')
         self.set_font('Times', 'B', 7)
         self.text(x=205, y=self.lin_emit +20, 
             txt=' '.join(chunks(self.key_nfe, 4)))
-        
-        self.set_font('Times', '', 8)
-        self.set_xy(x=185, y=self.lin_emit +23)
-        text = ("Consulta de autenticidade no portal nacional da NF-e "
-                "www.nfe.fazenda.gov.br/portal ou no site da "
-                "Sefaz autorizadora")
-        self.multi_cell(w=98, h=3, txt=text, border=0, align='L', fill=False)                  
-                
-        self.set_font('Times', '', 5)        
-        self.text(x=37, y=self.lin_emit +26.1, txt='NATUREZA DA OPERAÇÃO')
-        self.text(x=37, y=self.lin_emit +33.2, txt='INSCRIÇÃO ESTADUAL')
-        self.text(x=87, y=self.lin_emit +33.2, 
-            txt='INSCRIÇÃO ESTADUAL DO SUBST. TRIB')
-        self.text(x=147, y=self.lin_emit +33.2, txt='CNPJ')
-
-        self.text(x=185, y=self.lin_emit +33.1, 
-            txt='PROTOCOLO DE AUTORIZAÇÃO DE USO')
                 
         self.set_font('Times', '', 8)
-        text = get_tag_text(node=self.ide, url=url, tag='natOp')                                                
+        text = self.nfe.ide.natOp                                                
         self.text(x=37, y=self.lin_emit +30, 
             txt=self.long_field(text=text, limit=112))
                        
         self.text(x=37, y=self.lin_emit +37.1, 
-            txt=get_tag_text(node=self.emit, url=url, tag='IE'))
+            txt=self.nfe.emit.IE)
         
-        text = get_tag_text(node=self.emit, url=url, tag='CNPJ')
+        text = self.nfe.emit.CNPJ
         self.text(x=147, y=self.lin_emit +37.1, txt=format_cpf_cnpj(text))
 
         self.set_font('Times', 'B', 7)
@@ -1134,7 +1191,7 @@ class Danfe(xFPDF):
         self.cell(100, 5, self.prot_uso, 0, 0, 'C')        
 
         # Homologação
-        if get_tag_text(node=self.ide, url=url, tag='tpAmb') == '2':
+        if self.nfe.ide.tpAmb == '2':
             
             self.set_text_color(r=145, g=145, b=145)
             self.rotate(90, x=204, y=14)
@@ -1144,135 +1201,148 @@ class Danfe(xFPDF):
             self.rotate(0, x=90, y=60) 
             self.set_text_color(r=0, g=0, b=0)           
             
-    def dest_l(self):
-        lin = self.lin_emit +42
+    def moldura_emit_l(self, lin_emit):
+        
+        self.rect(x=36, y=lin_emit, w=248, h=38, style='')                        
+        self.line(146, lin_emit, 146, lin_emit +38)        
+        self.line(184, lin_emit, 184, lin_emit +38)        
+        self.line(36, lin_emit +24, 146, lin_emit +24)
+        self.line(36, lin_emit +31, 284, lin_emit +31)
+        self.line(86, lin_emit +31, 86, lin_emit +38)
+               
+        self.set_font('Times', 'B', 12)
+        self.text(x=158, y=lin_emit +5, txt='DANFE')
+        
+        self.set_font('Times', '', 7)
+        self.text(x=152, y=lin_emit +9, txt='Documento Auxiliar da')
+        self.text(x=152, y=lin_emit +12, txt='Nota Fiscal Eletrônica')        
+        self.text(x=152, y=lin_emit +16, txt='0 - Entrada')
+        self.text(x=152, y=lin_emit +19, txt='1 - Saída')        
+        self.rect(x=170, y=lin_emit +14, w=8, h=6, style='')
         
-        self.set_font('Times', 'B', 7)        
-        self.text(x=37, y=lin -1, txt='DESTINATÁRIO/REMETENTE')
-        self.rect(x=36, y=lin, w=248, h=20, style='')        
-        self.line(36, self.lin_emit +48.66, 284, self.lin_emit +48.66)
-        self.line(36, self.lin_emit +55.32, 284, self.lin_emit +55.32)
-        self.line(184, self.lin_emit +42, 184, self.lin_emit +48.66)
-        self.line(242, self.lin_emit +42, 242, self.lin_emit +62)
-        self.line(151, self.lin_emit +48.66, 151, self.lin_emit +55.33)
-        self.line(204, self.lin_emit +48.66, 204, self.lin_emit +55.33)
-        
-        self.line(96, self.lin_emit +55.33, 96, self.lin_emit +62)
-        self.line(141, self.lin_emit +55.33, 141, self.lin_emit +62)
-        self.line(158, self.lin_emit +55.33, 158, self.lin_emit +62)
-                        
         self.set_font('Times', '', 5)        
-        self.text(x=37, y=lin +2, txt='NOME/RAZÃO SOCIAL')
-        self.text(x=185, y=lin +2, txt='CNPJ/CPF')
-        self.text(x=243, y=lin +2, txt='DATA DE EMISSÃO')
+        self.text(x=185, y=lin_emit +2.5, txt='CONTROLE DO FISCO')
         
-        self.text(x=37, y=lin +8.66, txt='ENDEREÇO')
-        self.text(x=152, y=lin +8.66, txt='BAIRRO/DISTRITO')
-        self.text(x=205, y=lin +8.66, txt='CEP')
-        self.text(x=243, y=lin +8.66, txt='DATA DE ENTRADA/SAÍDA')
+        self.rect(x=185, y=lin_emit +15, w=98, h=6, style='')
+        self.text(x=186, y=lin_emit +17.2, txt='CHAVE DE ACESSO')
         
-        self.text(x=37, y=lin +15.32, txt='MUNICÍPIO')
-        self.text(x=97, y=lin +15.32, txt='FONE/FAX')
-        self.text(x=142, y=lin +15.32, txt='UF')
-        self.text(x=159, y=lin +15.32, txt='INSCRIÇÃO ESTADUAL')
-        self.text(x=243, y=lin +15.32, txt='HORA DE ENTRADA/SAÍDA')
+        self.set_font('Times', '', 8)
+        self.set_xy(x=185, y=lin_emit +23)
+        text = ("Consulta de autenticidade no portal nacional da NF-e "
+                "www.nfe.fazenda.gov.br/portal ou no site da "
+                "Sefaz autorizadora")
+        self.multi_cell(w=98, h=3, txt=text, border=0, align='L', fill=False)                  
+                
+        self.set_font('Times', '', 5)        
+        self.text(x=37, y=lin_emit +26.1, txt='NATUREZA DA OPERAÇÃO')
+        self.text(x=37, y=lin_emit +33.2, txt='INSCRIÇÃO ESTADUAL')
+        self.text(x=87, y=lin_emit +33.2, 
+            txt='INSCRIÇÃO ESTADUAL DO SUBST. TRIB')
+        self.text(x=147, y=lin_emit +33.2, txt='CNPJ')
+
+        self.text(x=185, y=lin_emit +33.1, 
+            txt='PROTOCOLO DE AUTORIZAÇÃO DE USO')
+            
+    def dest_l(self):
+        lin = self.lin_emit +42
+        self.frame(self.moldura_dest_l, self.lin_emit)
 
         self.set_font('Times', '', 8)
         
         # Homologação
-        if get_tag_text(node=self.ide, url=url, tag='tpAmb') == '1':
-            txt = get_tag_text(node=self.dest, url=url, tag='xNome')
+        if self.nfe.ide.tpAmb == '1':
+            txt = self.nfe.dest.xNome
         else:
             txt = "NF-E EMITIDA EM AMBIENTE DE HOMOLOGACAO - SEM VALOR FISCAL"
                 
         self.text(x=37, y=lin +5.7, txt=self.long_field(text=txt, limit=145))
         
-        txt = get_tag_text(node=self.dest, url=url, tag='CNPJ')
+        txt = self.nfe.dest.CNPJ
         if not txt:
-            txt = get_tag_text(node=self.dest, url=url, tag='CPF')            
+            txt = self.nfe.dest.CPF            
         self.text(x=185, y=lin +5.7, txt=format_cpf_cnpj(txt))
         
-        dt, h = getdateUTC(get_tag_text(node=self.ide, url=url, tag='dhEmi'))
+        dt, h = getdateUTC(self.nfe.ide.dhEmi)
         self.text(x=243, y=lin +5.7, txt=dt)
         
-        end = '%s, %s' % (get_tag_text(node=self.dest, url=url, tag='xLgr'),
-                          get_tag_text(node=self.dest, url=url, tag='nro'))         
+        end = '%s, %s' % (self.nfe.dest.xLgr,
+                          self.nfe.dest.nro)         
         self.text(x=37, y=lin +12.4, txt=self.long_field(text=end, limit=86))
         
-        txt = get_tag_text(node=self.dest, url=url, tag='xBairro')
+        txt = self.nfe.dest.xBairro
         self.text(x=152, y=lin +12.4, txt=self.long_field(text=txt, limit=50))
 
         self.text(x=205, y=lin +12.4, 
-            txt=get_tag_text(node=self.dest, url=url, tag='CEP'))
+            txt=self.nfe.dest.CEP)
         
-        dt, h = getdateUTC(get_tag_text(node=self.ide, url=url, tag='dhSaiEnt'))
+        dt, h = getdateUTC(self.nfe.ide.dhSaiEnt)
         self.text(x=243, y=lin +12.4, txt=dt)
         
-        txt = get_tag_text(node=self.dest, url=url, tag='xMun')
+        txt = self.nfe.dest.xMun
         self.text(x=37, y=lin +19.1, txt=self.long_field(text=txt, limit=50))
 
         self.text(x=97, y=lin +19.1, 
-            txt=get_tag_text(node=self.dest, url=url, tag='fone'))
+            txt=self.nfe.dest.fone)
                                          
         self.text(x=142, y=lin +19.1, 
-            txt=get_tag_text(node=self.dest, url=url, tag='UF'))
+            txt=self.nfe.dest.UF)
         
         self.text(x=159, y=lin +19.1, 
-            txt=get_tag_text(node=self.dest, url=url, tag='IE'))
+            txt=self.nfe.dest.IE)
+                
+    def moldura_dest_l(self, lin_emit):
+        lin = lin_emit +42
+        
+        self.set_font('Times', 'B', 7)        
+        self.text(x=37, y=lin -1, txt='DESTINATÁRIO/REMETENTE')
+        self.rect(x=36, y=lin, w=248, h=20, style='')        
+        self.line(36, lin_emit +48.66, 284, lin_emit +48.66)
+        self.line(36, lin_emit +55.32, 284, lin_emit +55.32)
+        self.line(184, lin_emit +42, 184, lin_emit +48.66)
+        self.line(242, lin_emit +42, 242, lin_emit +62)
+        self.line(151, lin_emit +48.66, 151, lin_emit +55.33)
+        self.line(204, lin_emit +48.66, 204, lin_emit +55.33)
+        
+        self.line(96, lin_emit +55.33, 96, lin_emit +62)
+        self.line(141, lin_emit +55.33, 141, lin_emit +62)
+        self.line(158, lin_emit +55.33, 158, lin_emit +62)
+                        
+        self.set_font('Times', '', 5)        
+        self.text(x=37, y=lin +2, txt='NOME/RAZÃO SOCIAL')
+        self.text(x=185, y=lin +2, txt='CNPJ/CPF')
+        self.text(x=243, y=lin +2, txt='DATA DE EMISSÃO')
+        
+        self.text(x=37, y=lin +8.66, txt='ENDEREÇO')
+        self.text(x=152, y=lin +8.66, txt='BAIRRO/DISTRITO')
+        self.text(x=205, y=lin +8.66, txt='CEP')
+        self.text(x=243, y=lin +8.66, txt='DATA DE ENTRADA/SAÍDA')
+        
+        self.text(x=37, y=lin +15.32, txt='MUNICÍPIO')
+        self.text(x=97, y=lin +15.32, txt='FONE/FAX')
+        self.text(x=142, y=lin +15.32, txt='UF')
+        self.text(x=159, y=lin +15.32, txt='INSCRIÇÃO ESTADUAL')
+        self.text(x=243, y=lin +15.32, txt='HORA DE ENTRADA/SAÍDA')
                 
     def fat_l(self):    
         lin = self.lin_emit +66 
-        self.set_font('Times', 'B', 7)
-        self.text(x=37, y=lin -1, txt='FATURA')
-        self.rect(x=36, y=lin, w=248, h=13, style='')
-        self.line(98, self.lin_emit +66, 98, self.lin_emit +79)
-        self.line(160, self.lin_emit +66, 160, self.lin_emit +79)
-        self.line(222, self.lin_emit +66, 222, self.lin_emit +79)
-        self.line(222, self.lin_emit +72.5, 284, self.lin_emit +72.5)
+        self.frame(self.moldura_fat_l, self.lin_emit)
 
-        if self.inf_adic is not None:
+        if self.nfe.adic is not None:
             self.set_font('Times', '', 8)
-            codvend = self.inf_adic.find(".//{http://www.portalfiscal.inf.br/"
-                "nfe}obsCont[@xCampo='CodVendedor']")      
-            
-            self.text(x=223, y=lin +5.7, 
-                txt=get_tag_text(node=codvend, url=url, tag='xTexto'))
+            self.text(x=223, y=lin +5.7, txt=self.nfe.adic.CodVendedor)
                   
-            vend = self.inf_adic.find(".//{http://www.portalfiscal.inf.br/nfe}"
-                "obsCont[@xCampo='NomeVendedor']")
-
-            txt = get_tag_text(node=vend, url=url, tag='xTexto')
+            txt = self.nfe.adic.NomeVendedor
             self.text(x=223, y=lin +12.24, 
                 txt=self.long_field(text=txt, limit=60))
-                                               
-        self.set_font('Times', '', 5)
-        self.text(x=223, y=lin +2.3, txt='CÓDIGO VENDEDOR')
-        self.text(x=223, y=lin +8.6, txt='NOME VENDEDOR')
-
-        self.set_xy(x=36, y=lin +0.5)        
-        self.cell(19, 2.5, 'FATURA', 0, 0, 'L')
-        self.cell(22, 2.5, 'VENCIMENTO', 0, 0, 'C')
-        self.cell(21, 2.5, 'VALOR', 0, 0, 'R')
-        self.cell(19, 2.5, 'FATURA', 0, 0, 'L')
-        self.cell(22, 2.5, 'VENCIMENTO', 0, 0, 'C')
-        self.cell(21, 2.5, 'VALOR', 0, 0, 'R')
-        self.cell(19, 2.5, 'FATURA', 0, 0, 'L')
-        self.cell(22, 2.5, 'VENCIMENTO', 0, 0, 'C')
-        self.cell(21, 2.5, 'VALOR', 0, 0, 'R')
-        
-        # Salta elemt 1 (tag fat) e considera os próximos 9 (tags dup)    
+        
         self.set_font('Times', '', 7)
-        cobr_iter = iter(self.cobr[1:10]) if self.cobr is not None else [] 
         n_dup_ = 1
         col_ = 36            
         self.set_xy(x=col_ , y=lin +3)
-        for i, dup in enumerate(cobr_iter):
-         
-            dt, hr = getdateUTC(
-                get_tag_text(node=dup, url=url, tag='dVenc'))
-            n_dup = get_tag_text(node=dup, url=url, tag='nDup')
-            vlr = format_number(
-                    get_tag_text(node=dup, url=url, tag='vDup'), precision=2)
+        for dup in self.nfe.cobr:
+            dt, hr = getdateUTC(dup.dVenc)
+            n_dup = dup.nDup
+            vlr = format_number(dup.vDup, precision=2)
                 
             self.cell(19, 4, n_dup, 0, 0, 'L')
             self.cell(22, 4, dt, 0, 0, 'C')
@@ -1288,24 +1358,64 @@ class Danfe(xFPDF):
                 
             self.set_x(x=col_)
         
+    def moldura_fat_l(self, lin_emit):
+        lin = lin_emit +66 
+        self.set_font('Times', 'B', 7)
+        self.text(x=37, y=lin -1, txt='FATURA')
+        self.rect(x=36, y=lin, w=248, h=13, style='')
+        self.line(98, lin_emit +66, 98, lin_emit +79)
+        self.line(160, lin_emit +66, 160, lin_emit +79)
+        self.line(222, lin_emit +66, 222, lin_emit +79)
+        self.line(222, lin_emit +72.5, 284, lin_emit +72.5)
+                                               
+        self.set_font('Times', '', 5)
+        self.text(x=223, y=lin +2.3, txt='CÓDIGO VENDEDOR')
+        self.text(x=223, y=lin +8.6, txt='NOME VENDEDOR')
+
+        self.set_xy(x=36, y=lin +0.5)        
+        for _ in range(3):
+            self.cell(19, 2.5, 'FATURA', 0, 0, 'L')
+            self.cell(22, 2.5, 'VENCIMENTO', 0, 0, 'C')
+            self.cell(21, 2.5, 'VALOR', 0, 0, 'R')
     
     def impostos_l(self):    
         lin = self.lin_emit +83
+        self.frame(self.moldura_impostos_l, self.lin_emit)
+        
+        self.set_font('Times', '', 8)
+        self.set_xy(x=36, y=lin +2.7)        
+        self.cell(50, 4, format_number(self.nfe.totais.vBC, precision=2), 0, 0, 'R')
+        self.cell(51, 4, format_number(self.nfe.totais.vICMS, precision=2), 0, 0, 'R')
+        self.cell(50, 4, format_number(self.nfe.totais.vBCST, precision=2), 0, 0, 'R')
+        self.cell(50, 4, format_number(self.nfe.totais.vST, precision=2), 0, 0, 'R')
+        self.cell(47, 4, format_number(self.nfe.totais.vProd, precision=2), 0, 0, 'R')
+        
+        self.set_xy(x=36, y=lin +9.2)        
+        self.cell(30, 4, format_number(self.nfe.totais.vFrete, precision=2), 0, 0, 'R')
+        self.cell(29, 4, format_number(self.nfe.totais.vSeg, precision=2), 0, 0, 'R')
+        self.cell(30, 4, format_number(self.nfe.totais.vDesc, precision=2), 0, 0, 'R')
+        self.cell(40, 4, format_number(self.nfe.totais.vOutro, precision=2), 0, 0, 'R')
+        self.cell(30, 4, format_number(self.nfe.totais.vIPI, precision=2), 0, 0, 'R')
+        self.cell(42, 4, format_number(self.nfe.totais.vTotTrib, precision=2), 0, 0, 'R')
+        self.cell(47, 4, format_number(self.nfe.totais.vNF, precision=2), 0, 0, 'R')
+
+    def moldura_impostos_l(self, lin_emit):
+        lin = lin_emit +83
         self.set_font('Times', 'B', 7)
         self.text(x=37, y=92, txt='CÁLCULO DO IMPOSTO')
         self.rect(x=36, y=lin, w=248, h=13, style='')
-        self.line(36, self.lin_emit +89.5, 284, self.lin_emit +89.5)
+        self.line(36, lin_emit +89.5, 284, lin_emit +89.5)
         
-        self.line(86, lin, 86, self.lin_emit +89.5)
-        self.line(137, lin, 137, self.lin_emit +89.5)
-        self.line(187, lin, 187, self.lin_emit +89.5)
-        self.line(237, lin, 237, self.lin_emit +96)
+        self.line(86, lin, 86, lin_emit +89.5)
+        self.line(137, lin, 137, lin_emit +89.5)
+        self.line(187, lin, 187, lin_emit +89.5)
+        self.line(237, lin, 237, lin_emit +96)
         
-        self.line(66, self.lin_emit +89.5, 66, self.lin_emit +96)
-        self.line(95, self.lin_emit +89.5, 95, self.lin_emit +96)
-        self.line(125, self.lin_emit +89.5, 125, self.lin_emit +96)
-        self.line(165, self.lin_emit +89.5, 165, self.lin_emit +96)
-        self.line(195, self.lin_emit +89.5, 195, self.lin_emit +96)
+        self.line(66, lin_emit +89.5, 66, lin_emit +96)
+        self.line(95, lin_emit +89.5, 95, lin_emit +96)
+        self.line(125, lin_emit +89.5, 125, lin_emit +96)
+        self.line(165, lin_emit +89.5, 165, lin_emit +96)
+        self.line(195, lin_emit +89.5, 195, lin_emit +96)
         
         self.set_font('Times', '', 5)        
         self.text(x=37, y=lin +2, txt='BASE DE CÁLCULO DO ICMS')
@@ -1321,199 +1431,138 @@ class Danfe(xFPDF):
         self.text(x=166, y=lin +8.5, txt='VALOR DO IPI')
         self.text(x=196, y=lin +8.5, txt='VALOR APROX. TRIBUTOS')
         self.text(x=238, y=lin +8.5, txt='VALOR TOTAL DA NOTA')
-        
-        self.set_font('Times', '', 8)
-        self.set_xy(x=36, y=lin +2.7)        
-        self.cell(50, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vBC'), precision=2), 0, 0, 'R')
-        self.cell(51, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vICMS'), precision=2), 0, 0, 'R')
-        self.cell(50, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vBCST'), precision=2), 0, 0, 'R')
-        self.cell(50, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vST'), precision=2), 0, 0, 'R')
-        self.cell(47, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vProd'), precision=2), 0, 0, 'R')
-        
-        self.set_xy(x=36, y=lin +9.2)        
-        self.cell(30, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vFrete'), precision=2), 0, 0, 'R')
-        self.cell(29, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vSeg'), precision=2), 0, 0, 'R')
-        self.cell(30, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vDesc'), precision=2), 0, 0, 'R')
-        self.cell(40, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vOutro'), precision=2), 0, 0, 'R')
-        self.cell(30, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vIPI'), precision=2), 0, 0, 'R')
-        self.cell(42, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vTotTrib'), precision=2), 0, 0, 'R')
-        self.cell(47, 4, format_number(get_tag_text(
-            node=self.totais, url=url, tag='vNF'), precision=2), 0, 0, 'R')
 
     def transp_l(self):
         lin = self.lin_emit +100
-        self.set_font('Times', 'B', 7)
-        self.text(x=37, y=lin -1, txt='TRANSPORTADOR/VOLUMES TRANSPORTADOS')
-        self.rect(x=36, y=lin, w=248, h=20, style='')        
-        self.line(36, self.lin_emit +106.66, 284, self.lin_emit +106.66)
-        self.line(36, self.lin_emit +113.3, 284, self.lin_emit +113.3)
-        
-        self.line(121, self.lin_emit +100, 121, self.lin_emit +106.66)
-        self.line(146, self.lin_emit +100, 146, self.lin_emit +113.3)
-        self.line(183, self.lin_emit +100, 183, self.lin_emit +106.66)
-        self.line(214, self.lin_emit +100, 214, self.lin_emit +120)
-        self.line(226, self.lin_emit +100, 226, self.lin_emit +113.3)
-        
-        self.line(71, self.lin_emit +113.3, 71, self.lin_emit +120)
-        self.line(121, self.lin_emit +113.3, 121, self.lin_emit +120)
-        self.line(170, self.lin_emit +113.3, 170, self.lin_emit +120)
-        self.line(248, self.lin_emit +113.3, 248, self.lin_emit +120)
-        
-    
-
-        self.set_font('Times', '', 5)        
-        self.text(x=37, y=lin +2, txt='RAZÃO SOCIAL')
-        self.text(x=122, y=lin +2, txt='FRETE POR CONTA')
-        self.text(x=147, y=lin +2, txt='CÓDIGO ANTT')
-        self.text(x=184, y=lin +2, txt='PLACA DO VEÍCULO')
-        self.text(x=215, y=lin +2, txt='UF')
-        self.text(x=227, y=lin +2, txt='CNPJ/CPF')
-        self.text(x=37, y=lin +8.7, txt='ENDEREÇO')
-        self.text(x=147, y=lin +8.7, txt='MUNICÍPIO')
-        self.text(x=215, y=lin +8.7, txt='UF')
-        self.text(x=227, y=lin +8.7, txt='INSCRIÇÃO ESTADUAL')
-        
-        self.text(x=37, y=lin +15.4, txt='QUANTIDADE')
-        self.text(x=72, y=lin +15.4, txt='ESPÉCIE')
-        self.text(x=122, y=lin +15.4, txt='MARCA')
-        self.text(x=171, y=lin +15.4, txt='NUMERAÇÃO')
-        self.text(x=215, y=lin +15.4, txt='PESO BRUTO')
-        self.text(x=249, y=lin +15.4, txt='PESO LÍQUIDO')
+        self.frame(self.moldura_transp_l, self.lin_emit)
         
         self.set_font('Times', '', 8)
-        text = get_tag_text(node=self.transp, url=url, tag='xNome')                                                
+        text = self.nfe.transp.xNome                                                
         self.text(x=37, y=lin +5.7, 
             txt=self.long_field(text=text, limit=85))
         
-        self.text(x=122, y=lin +5.7, txt=tp_frete[get_tag_text(
-            node=self.transp, url=url, tag='modFrete')])
+        self.text(x=122, y=lin +5.7, txt=tp_frete[self.nfe.transp.modFrete])
 
-        text = get_tag_text(node=self.transp, url=url, tag='CNPJ')
+        text = self.nfe.transp.CNPJ
         self.text(x=227, y=lin +5.7, txt=format_cpf_cnpj(text))
 
-        text = get_tag_text(node=self.transp, url=url, tag='xEnder')                                                
+        text = self.nfe.transp.xEnder                                                
         self.text(x=37, y=lin +12.5, 
             txt=self.long_field(text=text, limit=110))
 
-        text = get_tag_text(node=self.transp, url=url, tag='xMun')                                                
+        text = self.nfe.transp.xMun                                                
         self.text(x=147, y=lin +12.5, 
             txt=self.long_field(text=text, limit=51))
 
         self.text(x=215, y=lin +12.5, 
-            txt=get_tag_text(node=self.transp, url=url, tag='UF'))
+            txt=self.nfe.transp.UF)
 
         self.text(x=227, y=lin +12.5, 
-            txt=get_tag_text(node=self.transp, url=url, tag='IE'))
+            txt=self.nfe.transp.IE)
 
         self.text(x=37, y=lin +19.2, 
-            txt=get_tag_text(node=self.transp, url=url, tag='qVol'))
+            txt=self.nfe.transp.qVol)
 
         self.text(x=72, y=lin +19.2, 
-            txt=get_tag_text(node=self.transp, url=url, tag='esp'))
+            txt=self.nfe.transp.esp)
 
         self.text(x=122, y=lin +19.2, 
-            txt=get_tag_text(node=self.transp, url=url, tag='marca'))
+            txt=self.nfe.transp.marca)
 
         self.text(x=171, y=lin +19.2, 
-            txt=get_tag_text(node=self.transp, url=url, tag='nVol'))
+            txt=self.nfe.transp.nVol)
         
         self.set_xy(x=214, y=lin +16.7)
-        self.cell(34, 3, format_number(get_tag_text(
-            node=self.transp, url=url, tag='pesoB'), precision=3), 0, 0, 'R')
+        self.cell(34, 3, format_number(self.nfe.transp.pesoB, precision=3), 0, 0, 'R')
 
-        self.cell(36, 3, format_number(get_tag_text(
-            node=self.transp, url=url, tag='pesoL'), precision=3), 0, 0, 'R')
+        self.cell(36, 3, format_number(self.nfe.transp.pesoL, precision=3), 0, 0, 'R')
 
-    def produtos_l(self, paginator=None, list_desc=None):
-        
-        h_produtos = (paginator[2] * 3) +6.5
+    def moldura_transp_l(self, lin_emit):
+        lin = lin_emit +100
         self.set_font('Times', 'B', 7)
-        self.text(x=37, y=self.lin_prod -1, txt='DADOS DO PRODUTO/SERVIÇO')
+        self.text(x=37, y=lin -1, txt='TRANSPORTADOR/VOLUMES TRANSPORTADOS')
+        self.rect(x=36, y=lin, w=248, h=20, style='')        
+        self.line(36, lin_emit +106.66, 284, lin_emit +106.66)
+        self.line(36, lin_emit +113.3, 284, lin_emit +113.3)
+        
+        self.line(121, lin_emit +100, 121, lin_emit +106.66)
+        self.line(146, lin_emit +100, 146, lin_emit +113.3)
+        self.line(183, lin_emit +100, 183, lin_emit +106.66)
+        self.line(214, lin_emit +100, 214, lin_emit +120)
+        self.line(226, lin_emit +100, 226, lin_emit +113.3)
+        
+        self.line(71, lin_emit +113.3, 71, lin_emit +120)
+        self.line(121, lin_emit +113.3, 121, lin_emit +120)
+        self.line(170, lin_emit +113.3, 170, lin_emit +120)
+        self.line(248, lin_emit +113.3, 248, lin_emit +120)
+
+        self.set_font('Times', '', 5)        
+        self.text(x=37, y=lin +2, txt='RAZÃO SOCIAL')
+        self.text(x=122, y=lin +2, txt='FRETE POR CONTA')
+        self.text(x=147, y=lin +2, txt='CÓDIGO ANTT')
+        self.text(x=184, y=lin +2, txt='PLACA DO VEÍCULO')
+        self.text(x=215, y=lin +2, txt='UF')
+        self.text(x=227, y=lin +2, txt='CNPJ/CPF')
+        self.text(x=37, y=lin +8.7, txt='ENDEREÇO')
+        self.text(x=147, y=lin +8.7, txt='MUNICÍPIO')
+        self.text(x=215, y=lin +8.7, txt='UF')
+        self.text(x=227, y=lin +8.7, txt='INSCRIÇÃO ESTADUAL')
+        
+        self.text(x=37, y=lin +15.4, txt='QUANTIDADE')
+        self.text(x=72, y=lin +15.4, txt='ESPÉCIE')
+        self.text(x=122, y=lin +15.4, txt='MARCA')
+        self.text(x=171, y=lin +15.4, txt='NUMERAÇÃO')
+        self.text(x=215, y=lin +15.4, txt='PESO BRUTO')
+        self.text(x=249, y=lin +15.4, txt='PESO LÍQUIDO')
+
+    def produtos_l(self, paginator=None, linhas=None):
+        # linhas: iterador de (item, linhas da descrição), consumido aqui
+        # apenas nos itens desta página
+        
+        h_produtos = (paginator.linhas * 3) +6.5
+        self.frame(self.moldura_produtos_l, self.lin_prod)
         self.rect(x=36, y=self.lin_prod, w=248, h=h_produtos, style='')
                                                  
         cols = self.cols_produtos[0]
-        captions = self.cols_produtos[1]
-        cells = self.cols_produtos[2]
+        linha = self.cols_produtos[2]
         
-        # Colunas            
-        self.set_font('Times', 'B', 5)        
-        self.line(36, self.lin_prod +6, 284, self.lin_prod +6)
+        # Colunas (a altura depende dos itens da página)
         col_ = 36 # 10 mm margem
-        self.set_xy(x=36, y=self.lin_prod +1)
-        for id, col in enumerate(cols):
+        for col in cols:
             col_ += col            
             self.line(col_, self.lin_prod, col_, self.lin_prod + h_produtos)
-            
-            lbl = captions[id].split('\n')                              
-            if len(lbl) == 1:
-                self.cell(col, 4, captions[id], 0, 0, 'C')
-            else:
-                current_col = self.get_x()               
-                current_lin = self.get_y()
-                             
-                self.multi_cell(w=col, h=2, txt=captions[id], 
-                    border=0, align='C', fill=False)
-                
-                self.set_xy(current_col + col, current_lin)                   
         
         # Dados dos produtos        
         self.set_font('Times', '', 6)        
         self.set_xy(x=36, y=self.lin_prod + 6.5)        
         #self.set_fill_color(235, 235, 235)
                 
-        for id in range(paginator[0], paginator[1]):
-            
-            item = self.det[id] 
-            el_prod = item.find(".//{http://www.portalfiscal.inf.br/"
-                "nfe}prod")
-
-            el_imp  = item.find(".//{http://www.portalfiscal.inf.br/nfe}"
-                "imposto")
-         
-            el_imp_ICMS = el_imp.find(".//{http://www.portalfiscal.inf.br/"
-                "nfe}ICMS")
-
-            el_imp_IPI  = el_imp.find(".//{http://www.portalfiscal.inf.br/"
-                "nfe}IPI")
+        for item, desc in itertools.islice(linhas, 
+                                           paginator.fim - paginator.inicio):
                             
-            for id_col, col in enumerate(cols):
-                cells[id_col](report=self,
-                              node_item=el_prod, 
-                              node_icms=el_imp_ICMS, 
-                              node_ipi=el_imp_IPI,                               
-                              width=col,                              
-                              desc_item=list_desc[id])
+            linha(self, item, desc)
                                         
-            self.ln(3 * len(list_desc[id]))
+            self.ln(3 * len(desc))
             self.set_x(x=36) 
             
             if self.get_y() < (self.lin_prod + h_produtos): # id % 2:                
                 y = self.get_y() -0.1 
                 self.dashed_line(36, y, 284, y, dash_length=1, space_length=1)       
         
+    def moldura_produtos_l(self, lin_prod):
+        self.set_font('Times', 'B', 7)
+        self.text(x=37, y=lin_prod -1, txt='DADOS DO PRODUTO/SERVIÇO')
+        self.cabecalho_colunas(cols_produtos_landscape['ICMS_ST_IPI'], 36, 
+                               284, lin_prod)
     
     def adic_l(self):
-        self.set_font('Times', 'B', 7)
-        self.text(x=37, y=166, txt='DADOS ADICIONAIS')
-        self.set_font('Times', '', 5)
-        self.text(x=37, y=169.5, txt='INFORMAÇÕES COMPLEMENTARES')
-        self.text(x=161, y=169.5, txt='RESERVADO AO FISCO')
-        self.rect(x=36, y=167, w=248, h=29, style='')
-        self.line(160, 167, 160, 196)
+        self.frame(self.moldura_adic_l)
 
-        fisco = get_tag_text(node=self.inf_adic, url=url, tag='infAdFisco')    
-        obs = get_tag_text(node=self.inf_adic, url=url, tag='infCpl') 
+        if self.nfe.adic is not None:
+            fisco = self.nfe.adic.infAdFisco
+            obs = self.nfe.adic.infCpl
+        else:
+            fisco = obs = ''
         if fisco:
             obs = "%s %s" %(fisco, obs)
                         
@@ -1525,8 +1574,18 @@ class Danfe(xFPDF):
                                                             limit=txt_width), 
                             border=0, align='L', fill=False)                  
 
+    def moldura_adic_l(self):
+        self.set_font('Times', 'B', 7)
+        self.text(x=37, y=166, txt='DADOS ADICIONAIS')
+        self.set_font('Times', '', 5)
+        self.text(x=37, y=169.5, txt='INFORMAÇÕES COMPLEMENTARES')
+        self.text(x=161, y=169.5, txt='RESERVADO AO FISCO')
+        self.rect(x=36, y=167, w=248, h=29, style='')
+        self.line(160, 167, 160, 196)
+
         
-# Recebe list xmls em string e image base64 - Modo retrato
+# Recebe list xmls (texto, bytes, memoryview ou caminho) e image base64 -
+# Modo retrato
 class DaCCe(xFPDF):
     def __init__(self, xmls=None, emitente=None, image=None):
          
@@ -1547,7 +1606,8 @@ class DaCCe(xFPDF):
 
         for xml in xmls:
                         
-            root = ET.fromstring(xml)
+            with conteudo_xml(xml) as dados:
+                root = ET.fromstring(dados)
             det_event = root.find("%sdetEvento" % url)
             inf_event = root.find("%sinfEvento" % url)
             ret_Event = root.find("%sretEvento" % url)
@@ -1559,7 +1619,7 @@ class DaCCe(xFPDF):
             self.rect(x=10, y=10, w=190, h=33, style='')
             self.line(90, 10, 90, 43)
 
-            cc = ''
+            emitente_nome = ''
             txt = ''
             if emitente:
                 emitente_nome = emitente['nome']
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Destinos dos PDFs gerados
+
+    SaidaPasta - um PDF por XML na pasta de destino (padrão)
+    SaidaZip   - os PDFs são gravados em sequência dentro de arquivos .zip
+                 de até `docs_por_arquivo` PDFs cada
+    SaidaSpool - várias DANFEs por PDF, com um índice JSON das páginas de
+                 cada chave de acesso
+
+    Cada saída informa a função executada nos workers (`funcao`), como
+    agrupar as tarefas (`preparar`) e como gravar o que o worker devolveu
+    (`receber`, que retorna a lista de Resultados por arquivo). Um Resultado
+    só é devolvido depois que o arquivo que o contém está gravado em
+    definitivo; `finalizar` devolve os que ainda estavam retidos.
+"""
+
+import json
+import os
+import time
+import zipfile
+
+from conversao import Resultado, caminho_pdf, converter, ler_xml
+from diario import gravar_atomico, publicar, temporario
+from pdf_docs import DaCCe, Danfe
+
+
+class SaidaPasta:
+    funcao = staticmethod(converter)
+
+    def preparar(self, tarefas):
+        return tarefas
+
+    def receber(self, resultado):
+        return [resultado]
+
+    def finalizar(self):
+        return []
+
+    def fechar(self):
+        pass
+
+
+def renderizar(tarefa):
+    # Worker da SaidaZip: devolve o PDF em memória para o processo principal
+    fullpath, filename, destfolder, opcoes, conteudo = tarefa
+    nome = caminho_pdf(filename, '')
+    inicio = time.perf_counter()
+    try:
+        if opcoes.get('documento') == 'dacce':
+            pdf = DaCCe(xmls=[ler_xml(fullpath, conteudo)],
+                        image=opcoes.get('image'))
+        else:
+            pdf = Danfe(xmls=[ler_xml(fullpath, conteudo)], **opcoes)
+        dados = bytes(pdf.output())
+    except Exception as e:
+        return Resultado(fullpath, nome, False, time.perf_counter() - inicio,
+                         0, repr(e)), None
+    return Resultado(fullpath, nome, True, time.perf_counter() - inicio,
+                     pdf.pages_count, None), dados
+
+
+class SaidaZip:
+    funcao = staticmethod(renderizar)
+
+    def __init__(self, prefixo, docs_por_arquivo=500,
+                 compressao=zipfile.ZIP_STORED):
+        # O conteúdo das páginas já sai comprimido do fpdf; ZIP_STORED
+        # evita gastar CPU comprimindo de novo
+        self.prefixo = prefixo
+        self.docs_por_arquivo = docs_por_arquivo
+        self.compressao = compressao
+        self.numero = 0
+        self.zip = None
+        self.retidos = []
+
+    def preparar(self, tarefas):
+        return tarefas
+
+    def abrir(self):
+        self.numero += 1
+        self.caminho = f"{self.prefixo}-{self.numero:05d}.zip"
+        self.temp = temporario(self.caminho)
+        self.zip = zipfile.ZipFile(self.temp, 'w', compression=self.compressao,
+                                   allowZip64=True)
+        self.gravados = 0
+
+    def receber(self, item):
+        resultado, dados = item
+        if dados is None:
+            return [resultado]
+        if self.zip is None:
+            self.abrir()
+        self.zip.writestr(resultado.destino, dados)
+        self.gravados += 1
+        self.retidos.append(resultado._replace(
+            destino=f"{self.caminho}::{resultado.destino}"))
+        if self.gravados >= self.docs_por_arquivo:
+            return self.finalizar()
+        return []
+
+    def finalizar(self):
+        # Fecha o .zip corrente e o publica com o nome definitivo
+        if self.zip is None:
+            return []
+        self.zip.close()
+        self.zip = None
+        publicar(self.temp, self.caminho)
+        retidos, self.retidos = self.retidos, []
+        return retidos
+
+    def fechar(self):
+        # Interrompido no meio de um arquivo: o temporário é descartado e
+        # suas notas serão convertidas de novo na retomada
+        if self.zip is not None:
+            self.zip.close()
+            self.zip = None
+            os.remove(self.temp)
+
+
+def converter_spool(lote):
+    # Worker da SaidaSpool: um PDF e um índice por lote de XMLs
+    arquivo, tarefas = lote
+    pdf = None
+    indice = []
+    resultados = []
+    for fullpath, filename, destfolder, opcoes, conteudo in tarefas:
+        if pdf is None:
+            pdf = Danfe(xmls=[], **opcoes)
+        ultima = pdf.page
+        inicio = time.perf_counter()
+        try:
+            pdf.adicionar(ler_xml(fullpath, conteudo))
+        except Exception as e:
+            pdf.discard_pages(ultima)
+            resultados.append(Resultado(fullpath, arquivo, False,
+                                        time.perf_counter() - inicio, 0,
+                                        repr(e)))
+            continue
+        indice.append({'chave': pdf.key_nfe, 'origem': fullpath,
+                       'pagina': ultima + 1, 'paginas': pdf.page - ultima})
+        resultados.append(Resultado(fullpath, arquivo, True,
+                                    time.perf_counter() - inicio,
+                                    pdf.page - ultima, None))
+    if indice:
+        inicio = time.perf_counter()
+        gravar_atomico(arquivo, pdf.output())
+        gravar_atomico(f"{os.path.splitext(arquivo)[0]}.json", json.dumps(
+            {'pdf': os.path.basename(arquivo), 'notas': indice},
+            ensure_ascii=False, indent=1).encode('utf8'))
+        # O tempo de gravação é rateado entre as notas do lote
+        gravacao = (time.perf_counter() - inicio) / len(indice)
+        resultados = [r._replace(tempo=r.tempo + gravacao) if r.ok else r
+                      for r in resultados]
+    return resultados
+
+
+class SaidaSpool:
+    funcao = staticmethod(converter_spool)
+    # Cada tarefa já é um lote inteiro
+    chunksize = 1
+
+    def __init__(self, prefixo, docs_por_lote=500):
+        self.prefixo = prefixo
+        self.docs_por_lote = docs_por_lote
+
+    def preparar(self, tarefas):
+        lote = []
+        numero = 0
+        for tarefa in tarefas:
+            lote.append(tarefa)
+            if len(lote) >= self.docs_por_lote:
+                numero += 1
+                yield f"{self.prefixo}-{numero:05d}.pdf", lote
+                lote = []
+        if lote:
+            yield f"{self.prefixo}-{numero + 1:05d}.pdf", lote
+
+    def receber(self, resultados):
+        return resultados
+
+    def finalizar(self):
+        return []
+
+    def fechar(self):
+        pass
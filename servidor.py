@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Serviço HTTP local de geração de PDFs
+
+    POST /danfe   corpo: XML da NF-e (nfeProc)          -> application/pdf
+                  parâmetros: layout, recibo
+    POST /dacce   corpo: XML do evento (procEventoNFe)  -> application/pdf
+                  parâmetros: nome, end, bairro, cidade, uf, fone
+    GET  /saude   situação do serviço em JSON
+
+    Os PDFs são gerados num pool de processos criado e aquecido na subida,
+    de modo que cada requisição não paga a inicialização do interpretador
+    nem a importação do fpdf. A fila de espera é limitada: acima dela o
+    serviço responde 503 em vez de acumular requisições. Uma geração que
+    estoura o tempo é respondida com 504, mas continua ocupando a sua vaga
+    (e a fila) até o worker realmente terminar.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qs, urlsplit
+
+from pdf_docs import DaCCe, Danfe
+
+MOTIVOS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 411: 'Length Required',
+           413: 'Payload Too Large', 422: 'Unprocessable Entity',
+           500: 'Internal Server Error', 503: 'Service Unavailable',
+           504: 'Gateway Timeout'}
+
+CAMPOS_EMITENTE = ('nome', 'end', 'bairro', 'cidade', 'uf', 'fone')
+
+
+def iniciar_worker():
+    warnings.simplefilter('ignore')
+
+
+def aquecer(_):
+    # Mantém o worker ocupado um instante para que cada tarefa de
+    # aquecimento suba um processo diferente
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def renderizar(tipo, xml, opcoes):
+    # Executado nos workers
+    if tipo == 'danfe':
+        pdf = Danfe(xmls=[xml], **opcoes)
+    else:
+        pdf = DaCCe(xmls=[xml], **opcoes)
+    return bytes(pdf.output()), pdf.pages_count
+
+
+class Servidor:
+    def __init__(self, workers=None, fila=256, max_corpo=10 << 20,
+                 timeout=30.0, ocioso=15.0):
+        self.workers = workers or os.cpu_count()
+        self.fila = fila
+        self.max_corpo = max_corpo
+        self.timeout = timeout
+        self.ocioso = ocioso
+        self.executor = self.novo_executor()
+        # Limita o que é entregue ao pool; o restante aguarda aqui
+        self.vagas = asyncio.Semaphore(self.workers * 2)
+        self.pendentes = 0
+        self.em_execucao = 0
+        self.atendidas = 0
+        self.falhas = 0
+        self.recusadas = 0
+        self.inicio = time.time()
+
+    def novo_executor(self):
+        return ProcessPoolExecutor(self.workers, initializer=iniciar_worker)
+
+    def aquecer(self):
+        # Sobe todos os workers antes da primeira requisição
+        list(self.executor.map(aquecer, range(self.workers)))
+
+    async def gerar(self, tipo, xml, opcoes):
+        if self.pendentes >= self.fila:
+            self.recusadas += 1
+            return 503, 'text/plain', b'fila cheia\n', {'Retry-After': '1'}
+        self.pendentes += 1
+        futuro = None
+        try:
+            await self.vagas.acquire()
+            executor = self.executor
+            try:
+                futuro = executor.submit(renderizar, tipo, xml, opcoes)
+            except BaseException:
+                self.vagas.release()
+                raise
+            self.em_execucao += 1
+            loop = asyncio.get_running_loop()
+            futuro.add_done_callback(
+                lambda _: loop.call_soon_threadsafe(self.concluida))
+            # wait_for cancelaria só o invólucro asyncio, não o processo:
+            # o shield deixa o futuro seguir e a vaga é liberada por
+            # concluida()
+            pdf, paginas = await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(futuro)), self.timeout)
+        except asyncio.TimeoutError:
+            # Ainda na fila do executor: pode ser descartada
+            futuro.cancel()
+            self.falhas += 1
+            return 504, 'text/plain', b'tempo esgotado\n', {}
+        except BrokenProcessPool as e:
+            # Um worker morreu (ex.: falta de memória): o pool não aceita
+            # mais tarefas e é recriado
+            self.falhas += 1
+            if self.executor is executor:
+                self.executor = self.novo_executor()
+                executor.shutdown(wait=False, cancel_futures=True)
+            return 503, 'text/plain', f'{e!r}\n'.encode(), {'Retry-After': '1'}
+        except Exception as e:
+            self.falhas += 1
+            return 422, 'text/plain', f'{e!r}\n'.encode(), {}
+        finally:
+            if futuro is None:
+                self.pendentes -= 1
+        self.atendidas += 1
+        return 200, 'application/pdf', pdf, {'X-Paginas': str(paginas)}
+
+    def concluida(self):
+        # Fim real da tarefa no worker, mesmo depois de um 504
+        self.em_execucao -= 1
+        self.pendentes -= 1
+        self.vagas.release()
+
+    def saude(self):
+        dados = {'status': 'ok', 'workers': self.workers,
+                 'fila': self.pendentes, 'limite_fila': self.fila,
+                 'em_execucao': self.em_execucao, 'atendidas': self.atendidas,
+                 'falhas': self.falhas, 'recusadas': self.recusadas,
+                 'ativo_ha': round(time.time() - self.inicio, 1)}
+        return 200, 'application/json', json.dumps(dados).encode(), {}
+
+    async def rotear(self, metodo, alvo, corpo):
+        partes = urlsplit(alvo)
+        params = {k: v[-1] for k, v in parse_qs(partes.query).items()}
+        if partes.path == '/saude':
+            return self.saude()
+        if partes.path not in ('/danfe', '/dacce'):
+            return 404, 'text/plain', b'rota desconhecida\n', {}
+        if metodo != 'POST':
+            return 405, 'text/plain', b'use POST\n', {'Allow': 'POST'}
+        if not corpo:
+            return 400, 'text/plain', b'XML nao informado\n', {}
+
+        if partes.path == '/danfe':
+            opcoes = dict(cfg_layout=params.get('layout', 'ICMS_IPI'),
+                          receipt_pos=params.get('recibo', 'top'))
+            return await self.gerar('danfe', corpo, opcoes)
+        emitente = {campo: params.get(campo, '') for campo in CAMPOS_EMITENTE}
+        opcoes = dict(emitente=emitente if any(emitente.values()) else None)
+        return await self.gerar('dacce', corpo, opcoes)
+
+    async def atender(self, reader, writer):
+        try:
+            while True:
+                try:
+                    cabecalho = await asyncio.wait_for(
+                        reader.readuntil(b'\r\n\r\n'), self.ocioso)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError, ConnectionError):
+                    break
+                linha, *campos = cabecalho.decode('latin-1').split('\r\n')
+                try:
+                    metodo, alvo, versao = linha.split(' ', 2)
+                    headers = {}
+                    for campo in campos:
+                        if campo:
+                            nome, valor = campo.split(':', 1)
+                            headers[nome.strip().lower()] = valor.strip()
+                    tamanho = int(headers.get('content-length', 0))
+                    if tamanho < 0:
+                        raise ValueError(tamanho)
+                except ValueError:
+                    await self.responder(writer, 400, 'text/plain',
+                                         b'requisicao invalida\n', {}, False)
+                    break
+
+                if 'transfer-encoding' in headers:
+                    await self.responder(writer, 411, 'text/plain',
+                                         b'informe Content-Length\n', {}, False)
+                    break
+                if tamanho > self.max_corpo:
+                    await self.responder(writer, 413, 'text/plain',
+                                         b'XML muito grande\n', {}, False)
+                    break
+                corpo = await reader.readexactly(tamanho) if tamanho else b''
+
+                manter = (versao.strip() == 'HTTP/1.1' and
+                          headers.get('connection', '').lower() != 'close')
+                status, tipo, dados, extras = await self.rotear(
+                    metodo, alvo, corpo)
+                await self.responder(writer, status, tipo, dados, extras,
+                                     manter)
+                if not manter:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def responder(self, writer, status, tipo, dados, extras, manter):
+        linhas = [f'HTTP/1.1 {status} {MOTIVOS[status]}',
+                  f'Content-Type: {tipo}',
+                  f'Content-Length: {len(dados)}',
+                  'Connection: %s' % ('keep-alive' if manter else 'close')]
+        linhas.extend(f'{k}: {v}' for k, v in extras.items())
+        writer.write(('\r\n'.join(linhas) + '\r\n\r\n').encode('latin-1'))
+        writer.write(dados)
+        await writer.drain()
+
+    def fechar(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+async def servir(host, porta, **kwargs):
+    servidor = Servidor(**kwargs)
+    await asyncio.get_running_loop().run_in_executor(None, servidor.aquecer)
+    srv = await asyncio.start_server(servidor.atender, host, porta,
+                                     backlog=1024)
+    print(f'Servindo em http://{host}:{porta} ({servidor.workers} workers)',
+          flush=True)
+    try:
+        async with srv:
+            await srv.serve_forever()
+    finally:
+        servidor.fechar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serviço HTTP de geração de DANFE/DACCe")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8080)
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="processos de renderização (0 = todos os núcleos)")
+    parser.add_argument("--fila", type=int, default=256,
+                        help="máximo de requisições admitidas (em execução "
+                             "ou aguardando); acima disso responde 503")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="tempo máximo de geração de um PDF (s)")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    try:
+        asyncio.run(servir(args.host, args.porta, workers=args.workers or None,
+                           fila=args.fila, timeout=args.timeout))
+    except KeyboardInterrupt:
+        pass
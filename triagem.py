@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Identificação do tipo de documento pelo início do XML
+
+    Lê só os primeiros KB (no máximo `limite` bytes) com um parser
+    incremental e para assim que sabe o que é o documento: o elemento raiz,
+    o modelo (55 NF-e, 65 NFC-e) e o tpImp do grupo ide, ou o tpEvento de
+    um procEventoNFe. Um XML de outro tipo é reconhecido já na raiz.
+
+    rota() diz qual renderizador atende o documento: 'danfe', 'dacce',
+    'distribuicao' (retDistDFeInt, ver fontes.documentos_distribuicao) ou
+    None (não suportado).
+"""
+
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+from nfe import NS, eh_caminho
+
+Documento = namedtuple('Documento', 'raiz modelo evento tpImp')
+
+RAIZES_NFE = ('nfeProc', 'NFe')
+RAIZES_EVENTO = ('procEventoNFe',)
+RAIZES_DIST = ('retDistDFeInt',)
+CCE = '110110'
+
+
+def blocos(fonte, bloco, limite):
+    if eh_caminho(fonte):
+        with open(fonte, 'rb') as f:
+            while limite > 0:
+                dados = f.read(min(bloco, limite))
+                if not dados:
+                    return
+                limite -= len(dados)
+                yield dados
+        return
+    if not isinstance(fonte, str):
+        fonte = memoryview(fonte)
+    for inicio in range(0, min(len(fonte), limite), bloco):
+        yield fonte[inicio:inicio + min(bloco, limite - inicio)]
+
+
+def identificar(fonte, bloco=4096, limite=64 << 10):
+    """Documento com o que foi possível identificar no início de `fonte`"""
+    raiz = modelo = evento = tpImp = None
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    try:
+        for dados in blocos(fonte, bloco, limite):
+            parser.feed(dados)
+            for tipo, el in parser.read_events():
+                if raiz is None:
+                    if not el.tag.startswith(NS):
+                        return Documento(el.tag, None, None, None)
+                    raiz = el.tag[len(NS):]
+                    if raiz not in RAIZES_NFE + RAIZES_EVENTO:
+                        return Documento(raiz, None, None, None)
+                    continue
+                if tipo != 'end':
+                    continue
+                tag = el.tag[len(NS):]
+                if tag == 'mod':
+                    modelo = el.text
+                elif tag == 'tpImp':
+                    tpImp = el.text
+                elif tag == 'ide':
+                    # mod e tpImp ficam no ide, o primeiro grupo da NF-e
+                    return Documento(raiz, modelo, evento, tpImp)
+                elif tag == 'tpEvento':
+                    evento = el.text
+                    return Documento(raiz, modelo, evento, tpImp)
+    except ET.ParseError:
+        pass
+    return Documento(raiz, modelo, evento, tpImp)
+
+
+def rota(documento):
+    if documento.raiz in RAIZES_NFE:
+        # Sem o modelo no início o parse completo decide
+        return 'danfe' if documento.modelo in ('55', None) else None
+    if documento.raiz in RAIZES_EVENTO and documento.evento == CCE:
+        return 'dacce'
+    if documento.raiz in RAIZES_DIST:
+        return 'distribuicao'
+    return None
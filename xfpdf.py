@@ -1,12 +1,34 @@
 # -*- coding: utf-8 -*-
 
-from fpdf import FPDF
+from fpdf import FPDF, FPDF_VERSION
+from fpdf.enums import CharVPos, TextMode
+from fpdf.fonts import CoreFont, CORE_FONTS_CHARWIDTHS
+from fpdf.image_parsing import get_img_info
+from fpdf.linearization import LinearizedOutputProducer
+from fpdf.output import OutputProducer
+from fpdf.syntax import Name, PDFContentStream
+from fpdf.syntax import create_dictionary_string as pdf_dict
+from fpdf.syntax import iobj_ref as pdf_ref
+from fpdf.util import escape_parens
 
+from collections import OrderedDict
+from copy import copy
 from io import BytesIO as IO
+from urllib.request import urlopen
 
 import base64
+import bisect
+import functools
+import hashlib
+import itertools
 
 
+# text_cell() and the form XObjects (frame(), FormsMixin) work on fpdf2
+# internals (_out, _lasth, the graphics state stack, the output producer)
+# as of the version pinned in requirements.txt; any other version goes
+# through the public cell() and local_context()
+FPDF_INTERNALS = FPDF_VERSION == "2.7.9"
+
 # Value Weights 128A    128B    128C
 CODE128_CHART = """
 0       212222  space   space   00
@@ -127,14 +149,224 @@ CODE128C = dict(zip(CODE128_CHART[4::5], VALUES))
 for charset in (CODE128A, CODE128B):
     charset[' '] = charset.pop('space')
 
+
+def code128_codes(data):
+    """
+    Code 128 symbols (start, data, checksum and stop) for ASCII text
+    """
+    text     = str(data)
+    pos      = 0
+    length   = len(text)
+
+    # Start Code
+    if text[:2].isdigit() and length > 1:
+        charset = CODE128C
+        codes   = [charset['StartC']]
+    else:
+        charset = CODE128B
+        codes   = [charset['StartB']]
+
+    # Data
+    while pos < length:
+        if charset is CODE128C:
+            if text[pos:pos+2].isdigit() and length - pos > 1:
+                # Encode Code C two characters at a time
+                codes.append(int(text[pos:pos+2]))
+                pos += 2
+            else:
+                # Switch to Code B
+                codes.append(charset['CodeB'])
+                charset = CODE128B
+        elif text[pos:pos+4].isdigit() and length - pos >= 4:
+            # Switch to Code C
+            codes.append(charset['CodeC'])
+            charset = CODE128C
+        else:
+            # Encode Code B one character at a time
+            codes.append(charset[text[pos]])
+            pos += 1
+
+    # Checksum
+    checksum = 0
+    for weight, code in enumerate(codes):
+        checksum += max(weight, 1) * code
+    codes.append(checksum % 103)
+
+    # Stop Code
+    codes.append(charset['Stop'])
+    return codes
+
+
+def code128_runs(codes):
+    # (start, width) of each bar, in modules from the start of the symbol
+    bars = []
+    start = 0
+    for code in codes:
+        for n, weight in enumerate(WEIGHTS[code]):
+            if not n % 2:
+                bars.append((start, int(weight)))
+            start += int(weight)
+    return tuple(bars)
+
+
+def code128_path(bars, height, thickness):
+    # Filled path of the bars, in points from the top left corner
+    return " ".join(f"{start * thickness:.2f} 0 {width * thickness:.2f} "
+                    f"{-height:.2f} re" for start, width in bars) + " f"
+
+
+@functools.lru_cache(maxsize=4096)
+def code128_bars(text):
+    # Bars of the barcode of `text`: the same access key is drawn on every
+    # page of its DANFE, on reprints and on the DACCe of its events
+    return code128_runs(code128_codes(text))
+
+
+@functools.lru_cache(maxsize=4096)
+def code128_cached_path(text, height, thickness):
+    return code128_path(code128_bars(text), height, thickness)
+
+
+# Glyph widths of the core fonts (1/1000 em) as flat lists indexed by the
+# code point of the normalized (one byte encoded) text, built on first use
+GLYPH_WIDTHS = {}
+
+
+def glyph_widths(fontkey):
+    widths = GLYPH_WIDTHS.get(fontkey)
+    if widths is None:
+        charwidths = CORE_FONTS_CHARWIDTHS[fontkey]
+        widths = GLYPH_WIDTHS[fontkey] = [
+            charwidths.get(chr(code), 0) for code in range(256)]
+    return widths
+
+
+def text_width(widths, text):
+    # Width of normalized `text` (a str or fpdf's list of characters) in
+    # 1/1000 em: an exact integer sum, so identical to fpdf's per-character
+    # dict lookups
+    if len(text) == 1:
+        return widths[ord(text[0])]
+    if not isinstance(text, str):
+        text = ''.join(text)
+    return sum(map(widths.__getitem__, text.encode('latin-1')))
+
+
+class TableCoreFont(CoreFont):
+    """
+    CoreFont measuring through the flat width table; fpdf calls
+    get_text_width for every cell alignment and multi_cell wrap
+    """
+
+    __slots__ = ('widths',)
+
+    def __init__(self, font):
+        for slot in CoreFont.__slots__:
+            setattr(self, slot, getattr(font, slot))
+        self.widths = glyph_widths(font.fontkey)
+
+    def get_text_width(self, text, font_size_pt, _):
+        return (len(text), text_width(self.widths, text) * font_size_pt * 0.001)
+
+
+class PDFFormXObject(PDFContentStream):
+    def __init__(self, contents, bbox, compress):
+        super().__init__(contents=contents, compress=compress)
+        self.type = Name('XObject')
+        self.subtype = Name('Form')
+        self.b_box = '[%s]' % ' '.join('%.2f' % v for v in bbox)
+        self.resources = None
+
+
+class FormsMixin:
+    """
+    Output producer hooks adding the form XObjects recorded by
+    xFPDF.frame() next to the images, in the resources shared by every
+    page; the forms use those same resources (fonts)
+    """
+
+    def _add_images(self):
+        img_objs_per_index = super()._add_images()
+        self.form_objs = []
+        for name, contents, bbox in self.fpdf.form_list:
+            form = PDFFormXObject(contents, bbox, self.fpdf.compress)
+            self._add_pdf_obj(form, "forms")
+            self.form_objs.append((name, form))
+        return img_objs_per_index
+
+    def _add_resources_dict(self, font_objs_per_index, img_objs_per_index,
+                            gfxstate_objs_per_name):
+        resources = super()._add_resources_dict(
+            font_objs_per_index, img_objs_per_index, gfxstate_objs_per_name)
+        if self.form_objs:
+            x_object = {f"/I{index}": pdf_ref(img_obj.id) for index, img_obj
+                        in sorted(img_objs_per_index.items())}
+            for name, form in self.form_objs:
+                x_object[f"/{name}"] = pdf_ref(form.id)
+                form.resources = resources
+            resources.x_object = pdf_dict(x_object)
+        return resources
+
+
+class FormOutputProducer(FormsMixin, OutputProducer):
+    pass
+
+
+class LinearizedFormOutputProducer(FormsMixin, LinearizedOutputProducer):
+    pass
+
+
+class LineCache:
+    """
+    Bounded LRU of multi_cell(split_only=True) results, shared by every
+    document in the process; hits/misses are kept for tuning `maxsize`
+    """
+
+    def __init__(self, maxsize=20000):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        lines = self.data.get(key)
+        if lines is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.data.move_to_end(key)
+        return lines
+
+    def put(self, key, lines):
+        self.data[key] = lines
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+        self.hits = self.misses = 0
+
+
 class xFPDF(FPDF): 
 
+    line_cache = LineCache()
+    # Decoded images (logos) by content hash, shared by every document in
+    # the process: same bounded LRU as the line cache
+    image_info_cache = LineCache(maxsize=32)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Image keys by name (shared_image) and the forms of frame()
+        self.image_keys = {}
+        self.forms = {}
+        self.form_list = []
+
     def load_resource(self, reason, filename):
         
         if reason == "image":
             if filename.startswith("http://") or filename.startswith("https://"):
                 f = IO(urlopen(filename).read())
-            elif filename.startswith("base64"):
+            elif filename.startswith("base64") or filename.startswith("data:"):
                 f = filename.split('base64,')[1]
                 f = base64.b64decode(f)
                 f = IO(f)
@@ -144,92 +376,226 @@ class xFPDF(FPDF):
         else:
             self.error("Unknown resource loading reason \"%s\"" % reason)
 
+    def image(self, name, x=None, y=None, w=0, h=0, type="", link="",
+              title=None, alt_text=None, dims=None, keep_aspect_ratio=False):
+        if isinstance(name, str) and dims is None and not name.endswith(".svg"):
+            name = self.shared_image(name)
+        return super().image(name, x, y, w, h, type, link, title, alt_text,
+                             dims, keep_aspect_ratio)
+
+    def shared_image(self, name):
+        # Key of image `name` (path, URL or base64) in this document's
+        # image cache: the content hash, so the image is embedded once and
+        # decoded once per process (image_info_cache)
+        keys = self.image_keys
+        key = keys.get(name)
+        images = self.image_cache.images
+        if key in images:
+            return key
+        with self.load_resource("image", name) as f:
+            data = f.read()
+        key = keys[name] = hashlib.sha1(data).hexdigest()
+        if key in images:
+            return key
+        image_filter = self.image_cache.image_filter
+        shared = self.image_info_cache.get((key, image_filter))
+        if shared is None:
+            shared = get_img_info(key, IO(data), image_filter)
+            self.image_info_cache.put((key, image_filter), shared)
+        # Per-document fields, as set by fpdf's preload_image()
+        info = copy(shared)
+        info["i"] = len(images) + 1
+        info["usages"] = 0
+        info["iccp_i"] = None
+        iccp = info.get("iccp")
+        if iccp:
+            profiles = self.image_cache.icc_profiles
+            info["iccp_i"] = profiles.setdefault(iccp, len(profiles))
+            info["iccp"] = None
+        images[key] = info
+        return key
+
     def code128_format(self, data):
         
         """
         Generate an optimal barcode from ASCII text
         """
-        text     = str(data)
-        pos      = 0
-        length   = len(text)
-    
-        # Start Code
-        if text[:2].isdigit() and length > 1:
-            charset = CODE128C
-            codes   = [charset['StartC']]
+        return code128_codes(data)
+
+    def code128(self, text, x, y, height=10, thickness=3, quiet_zone=True):
+        # Every bar as a rectangle of one path, filled by a single operator
+        # and placed at (x, y) by a translation
+        height, thickness = height * self.k, thickness * self.k
+        if text[-1] == CODE128B['Stop']:
+            path = code128_path(code128_runs(text), height, thickness)
+        else:
+            path = code128_cached_path(str(text), height, thickness)
+        self._out(f"q 1 0 0 1 {x * self.k:.2f} {(self.h - y) * self.k:.2f} "
+                  f"cm {path} Q")
+
+    def set_font(self, family=None, style="", size=0):
+        super().set_font(family, style, size)
+        font = self.current_font
+        if type(font) is CoreFont:
+            self.current_font = self.fonts[font.fontkey] = TableCoreFont(font)
+
+    def get_string_width(self, s, normalized=False, markdown=False):
+        font = self.current_font
+        if (markdown or not isinstance(font, TableCoreFont) or
+                self.font_stretching != 100 or self.char_spacing):
+            return super().get_string_width(s, normalized, markdown)
+        s = s if normalized else self.normalize_text(s)
+        return text_width(font.widths, s) * self.font_size_pt * 0.001 / self.k
+
+    def char_widths(self, text):
+        # Width of each character of `text` in user units
+        font = self.current_font
+        if (isinstance(font, TableCoreFont) and
+                self.font_stretching == 100 and not self.char_spacing):
+            scale = self.font_size_pt * 0.001 / self.k
+            return [width * scale for width in map(
+                font.widths.__getitem__,
+                self.normalize_text(text).encode('latin-1'))]
+        widths = {char: self.get_string_width(char) for char in set(text)}
+        return [widths[char] for char in text]
+
+    def text_cell(self, w, h, text, align='L'):
+        # Same as cell(w, h, text, align=align) for a plain table cell:
+        # core font, no border, fill or link, default spacing, colors and
+        # text mode, no automatic page break. The text object cell() would
+        # produce is written directly; anything else, or another fpdf2
+        # version (FPDF_INTERNALS), goes through cell()
+        font = self.current_font
+        if (not FPDF_INTERNALS or not w or not h or
+                align not in ('L', 'C', 'R') or
+                not isinstance(font, TableCoreFont) or self.text_shaping or
+                self.underline or self.font_stretching != 100 or
+                self.char_spacing or self.char_vpos != CharVPos.LINE or
+                self.text_mode != TextMode.FILL or
+                self.text_color != self.fill_color or
+                self.auto_page_break or self._record_text_quad_points):
+            return self.cell(w, h, text, 0, align=align)
+        text = self.normalize_text(text)
+        if text:
+            k = self.k
+            width = text_width(font.widths, text) * self.font_size_pt * 0.001 / k
+            if align == 'R':
+                dx = w - self.c_margin - width
+            elif align == 'C':
+                dx = (w - width) / 2
+            else:
+                dx = self.c_margin
+            self._out(
+                f"BT {(self.x + dx) * k:.2f} "
+                f"{(self.h - self.y - 0.5 * h - 0.3 * self.font_size) * k:.2f}"
+                f" Td ({escape_parens(text)}) Tj ET")
+        self._lasth = h
+        self.x += w
+        return False
+
+    def frame(self, draw, *args):
+        # Static part of a page (borders, captions): draw(*args) runs once
+        # per arguments, page size and graphics state into a form XObject,
+        # placed afterwards with a single Do on this and every later page
+        # of the document. draw() must depend only on its arguments;
+        # whatever it changes (font, colors, line width, position) is
+        # undone, as the Do operator restores the graphics state. Without
+        # FPDF_INTERNALS draw() runs on the page, inside local_context()
+        if not FPDF_INTERNALS:
+            x, y = self.x, self.y
+            with self.local_context():
+                draw(*args)
+            self.x, self.y = x, y
+            return
+        state = self._get_current_graphics_state()
+        variants = self.forms.setdefault((draw, args, self.w_pt, self.h_pt),
+                                         [])
+        for saved, name in variants:
+            if saved == state:
+                break
         else:
-            charset = CODE128B
-            codes   = [charset['StartB']]
-    
-        # Data
-        while pos < length:
-            if charset is CODE128C:
-                if text[pos:pos+2].isdigit() and length - pos > 1:
-                    # Encode Code C two characters at a time
-                    codes.append(int(text[pos:pos+2]))
-                    pos += 2
-                else:
-                    # Switch to Code B
-                    codes.append(charset['CodeB'])
-                    charset = CODE128B
-            elif text[pos:pos+4].isdigit() and length - pos >= 4:
-                # Switch to Code C
-                codes.append(charset['CodeC'])
-                charset = CODE128C
+            name = f"Fm{len(self.form_list) + 1}"
+            contents = self.pages[self.page].contents
+            start = len(contents)
+            x, y, lasth = self.x, self.y, self._lasth
+            self._push_local_stack()
+            try:
+                draw(*args)
+            finally:
+                self._pop_local_stack()
+                self.x, self.y, self._lasth = x, y, lasth
+            self.form_list.append((name, bytes(contents[start:]),
+                                   (0, 0, self.w_pt, self.h_pt)))
+            del contents[start:]
+            variants.append((state, name))
+        self._out(f"/{name} Do")
+
+    def output(self, name="", dest="", linearize=False,
+               output_producer_class=None):
+        if output_producer_class is None:
+            # form_list is only filled with FPDF_INTERNALS
+            if self.form_list:
+                output_producer_class = (LinearizedFormOutputProducer
+                                         if linearize else FormOutputProducer)
+                linearize = False
             else:
-                # Encode Code B one character at a time
-                codes.append(charset[text[pos]])
-                pos += 1
-    
-        # Checksum
-        checksum = 0
-        for weight, code in enumerate(codes):
-            checksum += max(weight, 1) * code
-        codes.append(checksum % 103)
-    
-        # Stop Code
-        codes.append(charset['Stop'])
-        return codes
+                output_producer_class = OutputProducer
+        return super().output(name, dest, linearize, output_producer_class)
 
-    def code128(self, text, x, y, height=10, thickness=3, quiet_zone=True):
-        
-        if not text[-1] == CODE128B['Stop']:
-            text = self.code128_format(text)
-    
-        barcode_widths = []
-        for code in text:
-            for weight in WEIGHTS[code]:
-                barcode_widths.append(int(weight) * thickness)
-        '''
-        width = sum(barcode_widths)
-        #x = 0
-        if quiet_zone:
-            width += 20 * thickness
-            x = 10 * thickness
-        '''                                                                             
-        draw_bar = True
-        for width in barcode_widths:
-            if draw_bar:                
-                
-                #[(x1, y1), (x2, y2)] 
-                #draw.rectangle(((x, 0), (x + width - 1, height)), fill=0)
-                
-                self.rect(x, y, width, height, 'F')
-                
-            draw_bar = not draw_bar
-            x += width                                                                    
+    def discard_pages(self, last_page):
+        # Drop every page after `last_page` (e.g. a document that failed
+        # halfway through a multi-document PDF). Forms recorded by frame()
+        # on those pages are kept: unused, but still written by output()
+        for n in range(last_page + 1, self.page + 1):
+            del self.pages[n]
+        self.page = last_page
 
+    def split_lines(self, w, h, txt):
+        # Same as multi_cell(w, h, txt, split_only=True), memoized on the
+        # current font and the cell width. The returned list is shared:
+        # do not modify it
+        if not w:
+            # Width taken from the current position: not cacheable
+            return self.multi_cell(w=w, h=h, txt=txt, split_only=True)
+        key = (self.font_family, self.font_style, self.font_size_pt,
+               self.char_spacing, self.font_stretching, self.c_margin, w, txt)
+        lines = self.line_cache.get(key)
+        if lines is None:
+            lines = self.multi_cell(w=w, h=h, txt=txt, split_only=True)
+            self.line_cache.put(key, lines)
+        return lines
 
     def long_field(self, text='', limit=0): 
-        # Take care of long field
+        # Take care of long field: keep the longest prefix that fits with
+        # '...' appended. The prefix never ends in whitespace and is at
+        # most len(text) - 4 characters (the result of the former loop that
+        # chopped 4 characters, then 1 per step, and measured again)
         if text is None:
             return ''
-            
-        while self.get_string_width(text) > limit:
+        if self.get_string_width(text) <= limit:
+            return text
+
+        # Cumulative widths of the prefixes
+        cumulative = list(itertools.accumulate(
+            self.char_widths(text), initial=0))
+        end = len(text[:-4].rstrip())
+        room = limit - self.get_string_width('...')
+        size = max(bisect.bisect_right(cumulative, room, 0, end + 1) - 1, 0)
+        cut = text[:size].rstrip()
 
-            # text = text[:-2] + u'\u2026'
-            text = '%s...' % text[:-4].rstrip()
-        return text
+        # Summed floats may round differently from a measurement of the
+        # whole string right at the limit: settle it with real measurements
+        while cut and self.get_string_width(cut + '...') > limit:
+            cut = cut[:-1].rstrip()
+        while True:
+            size = len(cut) + 1
+            while size <= end and text[size - 1].isspace():
+                size += 1
+            if (size > end or
+                    self.get_string_width(text[:size] + '...') > limit):
+                break
+            cut = text[:size]
+        return cut + '...'
 
 
 